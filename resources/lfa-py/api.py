@@ -0,0 +1,263 @@
+from main import read_input_master, read_input_file, load_inputs, run, reference_readers
+from parallel import map_jobs
+from full_experiment import export_full_worklist
+from cache import get_hash, get_file_hash, cache_load, cache_store, cache_count, get_cache_count
+import pandas as pd
+import contextlib
+import traceback
+import json
+import sys
+import os
+
+default_dir = os.path.dirname(os.path.abspath(__file__))
+
+# input dataframes and the settings naming their files
+input_file_keys = {'exp_input': 'exp_input_file',
+                   'plate_df': 'plate_df_file',
+                   'time_df': 'time_df_file',
+                   'sol_df': 'sol_df_file',
+                   'liquid_type_df': 'liquid_type_df_file'}
+
+# settings that change where or how the outputs are made, but not the outputs
+fingerprint_ignore = ['output_dir', 'full_dir', 'export_intermediate', 'in_memory', 'jobs',
+                      'cache_dir', 'cache_max_mb', 'result_cache_dir', 'result_cache_max_mb']
+
+
+def read_config(input_master_file=os.path.join(default_dir, 'input_master.csv')):
+    """
+    read settings from input_master.csv, with input files relative to the directory of input_master.csv
+    :param input_master_file: path to input_master.csv, the one next to this file by default
+    :return: dictionary of settings
+    """
+    config = read_input_master(input_master_file)
+    base_dir = os.path.dirname(os.path.abspath(input_master_file))
+    for each in input_file_keys.values():
+        config[each] = os.path.join(base_dir, config[each])
+    return config
+
+
+def generate(config, workspace=None, file_cache=None):
+    """
+    make run worklists and full worklists for one experiment. neither the inputs nor any shared files are modified,
+    so experiments can be made concurrently
+    :param config: dictionary of settings overriding the default input_master.csv, the input dataframes (exp_input,
+        plate_df, time_df, sol_df, liquid_type_df) can be given directly instead of their files
+    :param workspace: directory to write the output files in, with the output directories of the settings inside it,
+        None to not write any files
+    :param file_cache: dictionary of parsed reference dataframes to reuse between experiments, see read_input_file
+    :return: dictionary of outputs of full_from_run_worklist, keyed by the name of each sub experiment. if the
+        result_cache_dir setting is not 'none', outputs are reused when the fingerprint of all inputs matches, and only
+        the full worklist files are written then
+    """
+    input_dict = read_config()
+    for key, value in config.items():
+        input_dict[key] = value.copy() if isinstance(value, pd.DataFrame) else value
+
+    if workspace is None:
+        input_dict['in_memory'] = 1
+        input_dict['export_intermediate'] = 0
+        input_dict['output_dir'] = ''
+        input_dict['full_dir'] = ''
+    else:
+        input_dict['output_dir'] = os.path.join(workspace, input_dict['output_dir'])
+        input_dict['full_dir'] = os.path.join(workspace, input_dict['full_dir'])
+
+    result_cache_dir = str(input_dict.get('result_cache_dir', 'none'))
+    if result_cache_dir.lower() != 'none':
+        key = get_fingerprint(input_dict)
+        out = cache_load(result_cache_dir, key)
+        cache_count(result_cache_dir, 'miss' if out is None else 'hit')
+        if out is not None:
+            if input_dict['full_dir']:
+                os.makedirs(input_dict['full_dir'], exist_ok=True)
+                for name, each in out.items():
+                    export_full_worklist(each, input_dict['full_dir'], name + '_')
+            return out
+
+    input_dict = load_inputs(input_dict, file_cache)
+    full_out = run(input_dict)
+    # drop the trailing '_' of the output prefix
+    out = {name[:-1]: each for name, each in full_out.items()}
+
+    if result_cache_dir.lower() != 'none':
+        cache_store(result_cache_dir, key, out, input_dict['result_cache_max_mb'])
+    return out
+
+
+def get_fingerprint(input_dict):
+    """
+    get a fingerprint of all inputs of an experiment, including the code version. input files are hashed by content,
+    so the solutions workbook does not need to be parsed
+    :param input_dict: dictionary of settings, and optionally input dataframes
+    :return: string, fingerprint
+    """
+    settings = {key: value for key, value in input_dict.items()
+                if key not in fingerprint_ignore and key not in input_file_keys and
+                key not in input_file_keys.values()}
+    inputs = {key: input_dict[key] if key in input_dict else get_file_hash(input_dict[file_key])
+              for key, file_key in input_file_keys.items()}
+    return get_hash('result', settings, inputs)
+
+
+def get_result_cache_stats(result_cache_dir):
+    """
+    get the number of hits and misses of the result cache, counted across all processes using the directory
+    :param result_cache_dir: directory of the result cache
+    :return: dictionary of hit, miss, and hit_rate
+    """
+    hit = get_cache_count(result_cache_dir, 'hit')
+    miss = get_cache_count(result_cache_dir, 'miss')
+    return {'hit': hit,
+            'miss': miss,
+            'hit_rate': hit / (hit + miss) if hit + miss > 0 else 0}
+
+
+def frame_to_json(df):
+    """
+    convert a dataframe to a compact json-friendly dictionary
+    :param df: dataframe
+    :return: dictionary with columns and data (list of rows)
+    """
+    return json.loads(df.to_json(orient='split', index=False))
+
+
+def get_job_config(job):
+    """
+    get the settings of a json job
+    :param job: dictionary with
+        id: id of the job, returned with the result
+        cwd: directory the input files are relative to, the directory of this file by default
+        input_master: path to input_master.csv, input_master.csv by default
+        settings: dictionary of settings to override those in input_master.csv
+        exp_input: list of records to use instead of exp_input_file
+        plate_df: list of records to use instead of plate_df_file
+        write_files: 1 to also write the output files as main.py does, 0 by default
+    :return: tuple, settings for generate and the workspace, None if no files are written
+    """
+    cwd = job.get('cwd', default_dir)
+    config = read_config(os.path.join(cwd, job.get('input_master', 'input_master.csv')))
+    config.update(job.get('settings', {}))
+    for key in ['exp_input', 'plate_df']:
+        if key in job:
+            config[key] = pd.DataFrame.from_records(job[key])
+    workspace = cwd if job.get('write_files', 0) else None
+    return config, workspace
+
+
+def get_job_result(job_id, full_out):
+    """
+    convert the outputs of a job to json
+    :param job_id: id of the job
+    :param full_out: outputs of generate
+    :return: dictionary with id, ok, and results keyed by sub experiment, then output
+    """
+    results = {name: {key: frame_to_json(value) for key, value in each.items()} for name, each in full_out.items()}
+    return {'id': job_id, 'ok': True, 'results': results}
+
+
+def run_json_job(job, file_cache=None):
+    """
+    make worklists for one job
+    :param job: dictionary describing the job, see get_job_config
+    :param file_cache: dictionary of parsed reference dataframes to reuse between jobs, see read_input_file
+    :return: dictionary with id, ok, and either results (keyed by sub experiment, then output) or error
+    """
+    job_id = job.get('id')
+    try:
+        config, workspace = get_job_config(job)
+
+        # print statements in the pipeline must not go into the framed output
+        with contextlib.redirect_stdout(sys.stderr):
+            full_out = generate(config, workspace=workspace, file_cache=file_cache)
+
+        return get_job_result(job_id, full_out)
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return {'id': job_id, 'ok': False, 'error': type(e).__name__ + ': ' + str(e)}
+
+
+def run_json_batch(job_list, processes=1):
+    """
+    make worklists for many jobs, see generate_batch
+    :param job_list: list of dictionaries describing the jobs, see get_job_config
+    :param processes: number of worker processes
+    :return: list of dictionaries with id, ok, and either results or error, in the same order as job_list
+    """
+    config_list = []
+    workspace_list = []
+    error_list = []
+    for job in job_list:
+        try:
+            config, workspace = get_job_config(job)
+            error = None
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            config, workspace, error = {}, None, type(e).__name__ + ': ' + str(e)
+        config_list = config_list + [config]
+        workspace_list = workspace_list + [workspace]
+        error_list = error_list + [error]
+
+    # jobs with invalid settings are not run
+    index_run = [i for i, error in enumerate(error_list) if error is None]
+    batch_out = generate_batch([config_list[i] for i in index_run], processes=processes,
+                               workspace_list=[workspace_list[i] for i in index_run])
+
+    result_list = [{'id': job.get('id'), 'ok': False, 'error': error} for job, error in zip(job_list, error_list)]
+    for i, each in zip(index_run, batch_out):
+        if each['ok']:
+            result_list[i] = get_job_result(job_list[i].get('id'), each['results'])
+        else:
+            result_list[i]['error'] = each['error']
+    return result_list
+
+
+def generate_batch(config_list, processes=1, workspace_list=None):
+    """
+    make worklists for many experiments. the reference files (plates, timings, solutions, liquid types) are read once
+    for all experiments and sent to each worker process once. an error in one experiment does not stop the others
+    :param config_list: list of settings, see generate
+    :param processes: number of worker processes, each experiment runs in one process
+    :param workspace_list: list of workspaces, see generate, None to not write any files
+    :return: list of dictionaries with ok, and either results (outputs of generate) or error, in the same order as
+        config_list
+    """
+    if workspace_list is None:
+        workspace_list = [None] * len(config_list)
+
+    # read each distinct reference file once
+    file_cache = {}
+    default_config = read_config()
+    for config in config_list:
+        for key, read_func in reference_readers:
+            if key not in config:
+                try:
+                    read_input_file(read_func, config.get(key + '_file', default_config[key + '_file']), file_cache)
+                except Exception:
+                    # reported by the experiment using the file
+                    pass
+
+    args_list = []
+    for config, workspace in zip(config_list, workspace_list):
+        if processes > 1:
+            # the worker processes are the parallelism, they cannot start pools of their own
+            config = dict(config, jobs=1)
+        args_list = args_list + [{'config': config, 'workspace': workspace}]
+
+    return map_jobs(generate_batch_one, args_list, processes, {'file_cache': file_cache})
+
+
+def generate_batch_one(args, shared):
+    """
+    make worklists for one experiment of a batch
+    :param args: dictionary of config and workspace, see generate
+    :param shared: dictionary of shared inputs, file_cache
+    :return: dictionary with ok, and either results or error
+    """
+    try:
+        # outputs are returned, so print statements in the pipeline go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            out = generate(args['config'], workspace=args['workspace'], file_cache=shared['file_cache'])
+        return {'ok': True, 'results': out}
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return {'ok': False, 'error': type(e).__name__ + ': ' + str(e)}
@@ -0,0 +1,149 @@
+from api import generate
+from synthetic import get_synthetic_config
+from cache import get_code_version
+from tracer import start_trace, stop_trace, read_trace
+from engine import engine_list
+import pandas as pd
+import numpy as np
+import contextlib
+import tempfile
+import platform
+import argparse
+import json
+import sys
+import os
+
+# sizes of the synthetic experiments, increasing number of strips
+size_sets = {'small': [{'n_option': n, 'nrep': 2} for n in [2, 3, 4]],
+             'default': [{'n_option': n, 'nrep': 4} for n in [2, 3, 4, 6, 8]],
+             'large': [{'n_option': n, 'nrep': 4} for n in [4, 8, 12, 16]] +
+                      [{'n_option': 8, 'n_var': 3, 'nrep': 4, 'n_step': 4}]}
+
+
+def time_stages(config, repeat=1):
+    """
+    time each traced stage of one experiment
+    :param config: settings of the experiment, see api.generate
+    :param repeat: number of runs, the fastest is kept for each stage
+    :return: dataframe, total seconds and largest number of rows in and out of each stage
+    """
+    time_list = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace_file = os.path.join(tmp_dir, 'trace.jsonl')
+            start_trace(trace_file, 'json')
+            try:
+                # the pipeline prints progress, keep stdout for the results
+                with contextlib.redirect_stdout(sys.stderr):
+                    generate(dict(config, jobs=1, cache_dir='none', result_cache_dir='none'))
+            finally:
+                stop_trace()
+            trace_df = read_trace(trace_file)
+        time_list = time_list + [trace_df.groupby('name').agg(time_s=('duration', 'sum'),
+                                                              rows_in=('rows_in', 'max'),
+                                                              rows_out=('rows_out', 'max'))]
+    return pd.concat(time_list).groupby(level=0).agg({'time_s': 'min', 'rows_in': 'max', 'rows_out': 'max'})
+
+
+def fit_complexity(n, t):
+    """
+    fit the empirical complexity t ~ c * n^k, on a log-log scale
+    :param n: list of sizes
+    :param t: list of times in seconds
+    :return: exponent k, None if there are fewer than 2 usable points
+    """
+    n = np.array(n, dtype=float)
+    t = np.array(t, dtype=float)
+    usable = (n > 0) & (t > 0)
+    if np.unique(n[usable]).shape[0] < 2:
+        return None
+    return float(np.polyfit(np.log(n[usable]), np.log(t[usable]), 1)[0])
+
+
+def run_benchmark(size_list, repeat=1, engine='reference'):
+    """
+    time the pipeline stages on synthetic experiments of increasing size
+    :param size_list: list of dictionaries of arguments to synthetic.get_synthetic_config
+    :param repeat: number of runs of each size, the fastest is kept
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :return: dictionary, json-friendly, with the environment, the sizes, and the times and fitted exponent of each
+        stage. sizes are the number of rows of the run worklist
+    """
+    stage_df_list = []
+    n_list = []
+    for size in size_list:
+        stage_df = time_stages(dict(get_synthetic_config(**size), engine=engine), repeat)
+        n = int(stage_df.loc['make_worklist_one_run', 'rows_out'])
+        print('size', json.dumps(size), 'rows', n, 'seconds', round(stage_df['time_s'].max(), 3), file=sys.stderr)
+        stage_df_list = stage_df_list + [stage_df['time_s']]
+        n_list = n_list + [n]
+
+    time_df = pd.concat(stage_df_list, axis=1).T.reset_index(drop=True)
+    stages = {}
+    for stage in time_df.columns:
+        t = time_df[stage].fillna(0).tolist()
+        stages[stage] = {'time_s': t, 'exponent': fit_complexity(n_list, t)}
+
+    return {'code_version': get_code_version(),
+            'engine': engine,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'sizes': size_list,
+            'rows': n_list,
+            'stages': stages}
+
+
+def compare_benchmark(old, new, tolerance=0.25, min_seconds=0.01):
+    """
+    compare two benchmark results made with the same sizes
+    :param old: dictionary, output of run_benchmark, the reference
+    :param new: dictionary, output of run_benchmark
+    :param tolerance: relative slowdown above which a stage is a regression
+    :param min_seconds: times below this are ignored, they are mostly noise
+    :return: dataframe, one row per stage, with the total times, ratio, exponents, and whether it regressed
+    """
+    if old['sizes'] != new['sizes']:
+        raise ValueError('benchmarks were run on different sizes')
+
+    compare = []
+    for stage in sorted(set(old['stages']) | set(new['stages'])):
+        old_t = np.sum(old['stages'].get(stage, {}).get('time_s', [0]))
+        new_t = np.sum(new['stages'].get(stage, {}).get('time_s', [0]))
+        ratio = new_t / old_t if old_t > 0 else np.nan
+        compare = compare + [{'stage': stage,
+                              'old_s': old_t,
+                              'new_s': new_t,
+                              'ratio': ratio,
+                              'old_exponent': old['stages'].get(stage, {}).get('exponent'),
+                              'new_exponent': new['stages'].get(stage, {}).get('exponent'),
+                              'regression': bool(max(old_t, new_t) >= min_seconds and ratio > 1 + tolerance)}]
+    return pd.DataFrame(compare).sort_values('ratio', ascending=False).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time the pipeline stages on synthetic experiments of increasing size '
+                                                 'and fit their empirical complexity')
+    parser.add_argument('--sizes', default='default', choices=list(size_sets.keys()), help='set of sizes to run')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of each size, the fastest is kept')
+    parser.add_argument('--engine', default='reference', choices=engine_list, help='implementations to time')
+    parser.add_argument('--output', default='', help='json file to save the results to')
+    parser.add_argument('--compare', default='', help='json file of an earlier benchmark to compare the results to')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    result = run_benchmark(size_sets[args.sizes], repeat=args.repeat, engine=args.engine)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=1)
+
+    pd.set_option('display.width', 200)
+    summary = pd.DataFrame({stage: {'total_s': np.sum(each['time_s']), 'exponent': each['exponent']}
+                            for stage, each in result['stages'].items()}).T.sort_values('total_s', ascending=False)
+    print(summary.round(3).to_string())
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare = compare_benchmark(json.load(f), result, tolerance=args.tolerance)
+        print(compare.round(3).to_string(index=False))
+        sys.exit(1 if compare['regression'].any() else 0)
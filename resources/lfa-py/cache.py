@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+import functools
+import hashlib
+import glob
+import pickle
+import time
+import os
+
+# seconds after which the lock of a counter is taken to be left by a process that died, see cache_count
+lock_stale_s = 10
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_version():
+    """
+    get a hash of the python source files, so that cached outputs are not reused after the code changes
+    :return: string, hash of the source files
+    """
+    code_hash = hashlib.sha256()
+    for each in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(each, 'rb') as f:
+            code_hash.update(f.read())
+    return code_hash.hexdigest()
+
+
+def get_file_hash(filename):
+    """
+    get a hash of the content of a file
+    :param filename: path to the file
+    :return: string, hash
+    """
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def update_hash(content_hash, obj):
+    """
+    update a hash with the content of an object
+    :param content_hash: hashlib object
+    :param obj: dataframe, array, dictionary, list, or any object with a stable repr
+    :return: none
+    """
+    if isinstance(obj, pd.DataFrame):
+        content_hash.update(repr([list(obj.columns), list(obj.dtypes.astype(str)), list(obj.index)]).encode())
+        content_hash.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        content_hash.update(repr([obj.dtype.str, obj.shape]).encode())
+        content_hash.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj.keys()):
+            content_hash.update(repr(key).encode())
+            update_hash(content_hash, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        content_hash.update(repr(len(obj)).encode())
+        for each in obj:
+            update_hash(content_hash, each)
+    else:
+        content_hash.update(repr(obj).encode())
+
+
+def get_hash(*objs):
+    """
+    get a content hash of objects, including the code version
+    :param objs: objects to hash, see update_hash
+    :return: string, hash
+    """
+    content_hash = hashlib.sha256()
+    update_hash(content_hash, get_code_version())
+    for each in objs:
+        update_hash(content_hash, each)
+    return content_hash.hexdigest()
+
+
+def cache_load(cache_dir, key):
+    """
+    load a cached output
+    :param cache_dir: cache directory
+    :param key: content hash
+    :return: cached output, None if it is not in the cache
+    """
+    path = os.path.join(cache_dir, key + '.pkl')
+    try:
+        with open(path, 'rb') as f:
+            out = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    # mark as recently used, for eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return out
+
+
+def cache_store(cache_dir, key, value, cache_max_mb):
+    """
+    store an output in the cache, then evict the least recently used outputs if the cache is too large
+    :param cache_dir: cache directory
+    :param key: content hash
+    :param value: output to store
+    :param cache_max_mb: maximum size of the cache directory, in MB
+    :return: none
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # write to a temporary file first so that other processes never read a partial file
+    path = os.path.join(cache_dir, key + '.pkl')
+    path_temp = path + '.' + str(os.getpid()) + '.tmp'
+    with open(path_temp, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path_temp, path)
+
+    cache_evict(cache_dir, cache_max_mb)
+
+
+def cache_evict(cache_dir, cache_max_mb):
+    """
+    remove the least recently used outputs until the cache, counters included, fits in its size limit
+    :param cache_dir: cache directory
+    :param cache_max_mb: maximum size of the cache directory, in MB
+    :return: number of removed outputs
+    """
+    files = []
+    for each in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        try:
+            stat = os.stat(each)
+        except OSError:
+            continue
+        files = files + [[stat.st_mtime, stat.st_size, each]]
+
+    files.sort()
+    # the counters are small and kept, but count towards the limit
+    size_total = sum([each[1] for each in files]) + \
+        sum([os.path.getsize(each) for each in glob.glob(os.path.join(cache_dir, '*.count'))])
+    size_max = cache_max_mb * 1024 * 1024
+
+    nremove = 0
+    for mtime, size, each in files:
+        if size_total <= size_max:
+            break
+        try:
+            os.remove(each)
+        except OSError:
+            pass
+        size_total -= size
+        nremove += 1
+    return nremove
+
+
+def cache_count(cache_dir, event):
+    """
+    count an event, such as a hit or a miss, in the cache directory. the count is a small integer file, updated under a
+    lock file so that processes sharing the directory do not lose counts
+    :param cache_dir: cache directory
+    :param event: name of the event
+    :return: none
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, event + '.count')
+    path_lock = path + '.lock'
+    while True:
+        try:
+            fd = os.open(path_lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            break
+        except FileExistsError:
+            # break the lock of a process that died while holding it
+            try:
+                if time.time() - os.path.getmtime(path_lock) > lock_stale_s:
+                    os.remove(path_lock)
+            except OSError:
+                pass
+            time.sleep(0.001)
+    try:
+        path_temp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(path_temp, 'w') as f:
+            f.write(str(get_cache_count(cache_dir, event) + 1))
+        os.replace(path_temp, path)
+    finally:
+        os.close(fd)
+        os.remove(path_lock)
+
+
+def get_cache_count(cache_dir, event):
+    """
+    get the number of times an event has been counted, see cache_count
+    :param cache_dir: cache directory
+    :param event: name of the event
+    :return: count
+    """
+    try:
+        with open(os.path.join(cache_dir, event + '.count')) as f:
+            content = f.read()
+    except OSError:
+        return 0
+    try:
+        return int(content)
+    except ValueError:
+        # older caches appended one byte per event
+        return len(content)
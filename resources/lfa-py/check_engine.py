@@ -0,0 +1,120 @@
+from api import generate, read_config
+from synthetic import get_synthetic_config
+import pandas as pd
+import numpy as np
+import contextlib
+import argparse
+import sys
+
+
+def get_first_difference(reference, fast, labels=('reference', 'fast')):
+    """
+    find the first difference between two dataframes
+    :param reference: dataframe, from the reference engine
+    :param fast: dataframe, from the fast engine
+    :param labels: names of the two dataframes, for the rows shown
+    :return: string describing the first difference, None if the dataframes are the same
+    """
+    if list(reference.columns) != list(fast.columns):
+        return 'columns differ: ' + str(list(reference.columns)) + ' vs ' + str(list(fast.columns))
+    if reference.shape[0] != fast.shape[0]:
+        return 'number of rows differ: ' + str(reference.shape[0]) + ' vs ' + str(fast.shape[0])
+
+    for irow in range(reference.shape[0]):
+        row_ref = reference.iloc[irow]
+        row_fast = fast.iloc[irow]
+        if reference.index[irow] != fast.index[irow]:
+            return 'row ' + str(irow) + ': index ' + str(reference.index[irow]) + ' vs ' + str(fast.index[irow])
+        for col in reference.columns:
+            value_ref = row_ref[col]
+            value_fast = row_fast[col]
+            if pd.isna(value_ref) and pd.isna(value_fast):
+                continue
+            if type(value_ref) != type(value_fast) or value_ref != value_fast:
+                return 'row ' + str(irow) + ', column ' + str(col) + ': ' + repr(value_ref) + ' vs ' + \
+                    repr(value_fast) + '\n' + pd.DataFrame([row_ref, row_fast], index=list(labels)).to_string()
+
+    dtype_ref = reference.dtypes.astype(str)
+    dtype_fast = fast.dtypes.astype(str)
+    if not dtype_ref.equals(dtype_fast):
+        col = dtype_ref.index[dtype_ref != dtype_fast][0]
+        return 'column ' + str(col) + ': dtype ' + dtype_ref[col] + ' vs ' + dtype_fast[col]
+    return None
+
+
+def check_config(config):
+    """
+    make the worklists of one experiment with both engines and compare them
+    :param config: settings of the experiment, see api.generate
+    :return: list of strings, one per output that differs, naming the sub experiment, the output, and the first
+        diverging row. if an engine raises an error, only the types of the errors are compared
+    """
+    out = {}
+    error = {}
+    for engine in ['reference', 'fast']:
+        # the pipeline prints progress, keep stdout for the report
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                out[engine] = generate(dict(config, engine=engine, jobs=1, cache_dir='none', result_cache_dir='none'))
+        except Exception as e:
+            error[engine] = e
+
+    if len(error) > 0:
+        error_type = [type(error[each]).__name__ if each in error else 'no error' for each in ['reference', 'fast']]
+        if error_type[0] == error_type[1]:
+            return []
+        return ['errors differ: ' + ' vs '.join([repr(error[each]) if each in error else 'no error'
+                                                 for each in ['reference', 'fast']])]
+
+    difference_list = []
+    for name in sorted(set(out['reference']) | set(out['fast'])):
+        if name not in out['reference'] or name not in out['fast']:
+            difference_list = difference_list + [name + ': made by one engine only']
+            continue
+        for key, reference in out['reference'][name].items():
+            difference = get_first_difference(reference, out['fast'][name][key])
+            if difference is not None:
+                difference_list = difference_list + [name + ' ' + key + ': ' + difference]
+    return difference_list
+
+
+def get_random_size(rng):
+    """
+    draw the size of a random synthetic experiment
+    :param rng: numpy random generator
+    :return: dictionary of arguments to synthetic.get_synthetic_config
+    """
+    n_step = int(rng.integers(2, 6))
+    n_option = int(rng.integers(1, 6))
+    return {'n_step': n_step,
+            'n_option': n_option,
+            'n_var': int(rng.integers(1, min(n_step, 3) + 1)),
+            'nrep': int(rng.integers(1, 5)),
+            'nsub': int(rng.integers(1, n_option + 1)),
+            'n_stock': int(rng.integers(1, 6)),
+            'n_library': int(rng.integers(0, 20)),
+            'nperplate': int(rng.choice([48, 96])),
+            'ncol': 6}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='make worklists with the reference and fast engines, and report the '
+                                                 'first diverging row of each output that differs')
+    parser.add_argument('--random', type=int, default=5, help='number of random synthetic experiments')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random synthetic experiments')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    cases = [['example', read_config()]]
+    for i in range(args.random):
+        size = get_random_size(rng)
+        cases = cases + [['synthetic ' + str(size), get_synthetic_config(**size)]]
+
+    n_differ = 0
+    for name, config in cases:
+        difference_list = check_config(config)
+        print(name + ': ' + ('same' if len(difference_list) == 0 else 'DIFFERENT'))
+        for each in difference_list:
+            print('  ' + each)
+        n_differ = n_differ + (len(difference_list) > 0)
+    sys.exit(1 if n_differ > 0 else 0)
@@ -0,0 +1,40 @@
+engine_list = ['reference', 'fast']
+
+# fast implementations, keyed by the module and name of the reference implementation
+fast_funcs = {}
+
+
+def get_func_key(func):
+    """
+    get the key of a function in fast_funcs
+    :param func: function
+    :return: string, module and name of the function
+    """
+    return func.__module__ + '.' + func.__name__
+
+
+def fast_version(reference_func):
+    """
+    decorator to register the fast implementation of a function. it must return the same output as the reference
+    implementation for any input the pipeline makes, which check_engine.py verifies
+    :param reference_func: reference implementation
+    :return: decorator
+    """
+    def decorator(func):
+        fast_funcs[get_func_key(reference_func)] = func
+        return func
+    return decorator
+
+
+def select(reference_func, engine='reference'):
+    """
+    select the implementation of a function
+    :param reference_func: reference implementation
+    :param engine: 'reference' for the reference implementation, 'fast' for the fast one if there is one
+    :return: function
+    """
+    if engine not in engine_list:
+        raise ValueError('engine must be one of ' + ', '.join(engine_list) + ', not ' + str(engine))
+    if engine == 'fast':
+        return fast_funcs.get(get_func_key(reference_func), reference_func)
+    return reference_func
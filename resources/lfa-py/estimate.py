@@ -0,0 +1,244 @@
+from split_input import get_sub_exp_split, iter_sub_exp_input, get_sub_exp_names, get_sub_exp_index
+import pandas as pd
+import numpy as np
+
+# time to make the worklists of one sub experiment, compute_ms_coef * rows ** compute_ms_exponent, fitted with
+# benchmark.py on the reference engine. refit them on much faster or slower machines
+compute_ms_coef = 20
+compute_ms_exponent = 0.8
+
+
+def count_options(cell, delimiter_cell):
+    """
+    count the options in a cell of the experimental setup, as get_perm_df does
+    :param cell: cell of exp_input
+    :param delimiter_cell: delimiter to separate options of a variable
+    :return: number of options
+    """
+    return len(str(cell).replace(' ', '').split(delimiter_cell))
+
+
+def get_cell_numbers(cell, delimiter_cell):
+    """
+    get the numbers listed in a cell of the experimental setup, such as a volume with options
+    :param cell: cell of exp_input
+    :param delimiter_cell: delimiter to separate options of a variable
+    :return: list of floats, one per option
+    """
+    return [float(each) for each in str(cell).replace(' ', '').split(delimiter_cell)]
+
+
+def get_usable_plate(volume, plate_df):
+    """
+    get the smallest plate whose wells hold a volume, as assign_src does
+    :param volume: volume of the source
+    :param plate_df: dataframe, plates on the instrument
+    :return: row of plate_df, None if no well is large enough
+    """
+    plate_df = plate_df.copy()
+    plate_df['volume_usable'] = plate_df['volume_well'] - plate_df['volume_holdover']
+    plate_df = plate_df[plate_df['volume_usable'] >= volume].sort_values('volume_usable')
+    if plate_df.shape[0] == 0:
+        return None
+    return plate_df.iloc[0]
+
+
+def estimate_sub_exp(exp_input, nrep, npergroup, nplate, nperplate, plate_df, time_df, tip_size, delimiter_cell):
+    """
+    estimate the resources one sub experiment needs, analytically from the option counts, without making its worklist
+    :param exp_input: dataframe, experimental setup of the sub experiment
+    :param nrep: number of replicates
+    :param npergroup: number of strips per group
+    :param nplate: number of assay plates
+    :param nperplate: number of strips per assay plate
+    :param plate_df: dataframe, plates on the instrument
+    :param time_df: dataframe, time it takes to run steps
+    :param tip_size: tip sizes, usually [50, 300, 1000]
+    :param delimiter_cell: delimiter to separate options of a variable
+    :return: dictionary of destinations, transfers, assay_plates, source_wells, source_plates (by plate type), tips (as
+        counted by get_tip_count, before solutions are made, of the largest volume of each step), robot_time_s (a lower bound, None if a step has no time
+        in time_df), compute_ms, and problems (list of strings, empty if the sub experiment fits)
+    """
+    problems = []
+    option_count = exp_input.map(lambda each: count_options(each, delimiter_cell))
+    n_dst = int(np.prod(option_count.values[option_count.values > 1])) * nrep
+    n_step = exp_input.shape[0]
+
+    assay_plates = int(np.ceil(n_dst / nperplate))
+    if assay_plates > nplate:
+        problems = problems + [str(n_dst) + ' strips need ' + str(assay_plates) + ' assay plates of ' +
+                               str(nperplate) + ', but nplate is ' + str(nplate)]
+
+    # strips are grouped by npergroup in each step, groups of 8 use full tip racks
+    group_size = [npergroup] * (n_dst // npergroup) + ([n_dst % npergroup] if n_dst % npergroup > 0 else [])
+    n_group = len(group_size)
+    tips = {}
+    source_volume = {}
+    source_step = []
+    handling_s = 0
+    chain_s = 0
+    time_known = True
+    exp_time = dict(zip(time_df['step'], time_df['exp_time']))
+    for _, row in exp_input.iterrows():
+        # options of the volume are varied like those of other cells, each used by the same number of strips
+        volume_list = get_cell_numbers(row['volume'], delimiter_cell)
+        volume = max(volume_list)
+        if volume > max(tip_size):
+            problems = problems + [str(row['step']) + ' transfers ' + str(volume) + ' ul, more than the largest tip, ' +
+                                   str(max(tip_size))]
+        # counted with the tips of the largest volume
+        tip_type = min([each for each in tip_size if each >= volume], default=max(tip_size))
+        for each in group_size:
+            key = 'tip_' + str(tip_type) + '_' + ('partial' if each < 8 else 'full')
+            tips[key] = tips.get(key, 0) + each
+
+        # each option is used by the same number of strips
+        option_list = [each for each in str(row['source']).replace(' ', '').split(delimiter_cell)]
+        for each in option_list:
+            source_volume[each] = source_volume.get(each, 0) + np.mean(volume_list) * n_dst / len(option_list)
+            source_step = source_step + [[row['step'], each]]
+
+        if row['step'] in exp_time:
+            handling_s = handling_s + n_group * exp_time[row['step']]
+            chain_s = chain_s + exp_time[row['step']] + max(min(get_cell_numbers(row['time'], delimiter_cell)), 0)
+        else:
+            time_known = False
+
+    # wells of each step start in a new column of each plate type, as in assign_src
+    source_wells = 0
+    plate_wells = {}
+    for step in pd.unique(pd.Series([each[0] for each in source_step])):
+        well_count = {}
+        for each_step, each in source_step:
+            if each_step != step:
+                continue
+            plate = get_usable_plate(source_volume[each], plate_df)
+            if plate is None:
+                problems = problems + ['source ' + each + ' needs ' + str(round(source_volume[each], 2)) +
+                                       ' ul, more than the largest well holds']
+                continue
+            well_count[plate['plate']] = well_count.get(plate['plate'], 0) + 1
+            source_wells = source_wells + 1
+        for plate, n in well_count.items():
+            nrow = int(plate_df.loc[plate_df['plate'] == plate, 'nrow'].values[0])
+            plate_wells[plate] = plate_wells.get(plate, 0) + int(np.ceil(n / nrow)) * nrow
+    source_plates = {}
+    for plate, n in plate_wells.items():
+        plate_row = plate_df[plate_df['plate'] == plate].iloc[0]
+        source_plates[plate] = int(np.ceil(n / (plate_row['nrow'] * plate_row['ncol'])))
+
+    rows = n_dst * n_step
+    return {'destinations': n_dst,
+            'transfers': rows,
+            'assay_plates': assay_plates,
+            'source_wells': source_wells,
+            'source_plates': source_plates,
+            'tips': dict(sorted(tips.items())),
+            'robot_time_s': float(max(handling_s, chain_s)) if time_known else None,
+            'compute_ms': int(compute_ms_coef * rows ** compute_ms_exponent),
+            'problems': problems}
+
+
+def estimate(input_dict):
+    """
+    estimate the resources of the selected sub experiments of an experiment before making any worklist. solutions made
+    on the deck add plates and tips that are not counted
+    :param input_dict: dictionary of settings and input dataframes, from main.load_inputs
+    :return: dictionary with feasible, problems (list of strings naming the sub experiment or combined run),
+        compute_ms (all sub experiments), sub_exp, the estimate of each sub experiment keyed by name, see
+        estimate_sub_exp, and combined, the plates of each combined run, see estimate_combined
+    """
+    coord_list, perm_ind = get_sub_exp_split(input_dict['exp_input'], input_dict['coord0'], input_dict['coord1'],
+                                             input_dict['nsub0'], input_dict['nsub1'],
+                                             input_dict['delimiter_cell'], input_dict['delimiter_col'],
+                                             split=input_dict['split'], coord_extra=input_dict['coord_extra'],
+                                             nsub_extra=input_dict['nsub_extra'], nrep=input_dict['nrep'],
+                                             nplate=input_dict['nplate'], nperplate=input_dict['nperplate'])
+    names = get_sub_exp_names(len(perm_ind), input_dict['prefix'])
+    index_list = get_sub_exp_index(len(perm_ind), input_dict['sub_exp'])
+    sub_exp_input_list = iter_sub_exp_input(input_dict['exp_input'], coord_list, [perm_ind[i] for i in index_list],
+                                            input_dict['delimiter_cell'], input_dict['delimiter_col'])
+
+    sub_exp = {}
+    problems = []
+    for i, sub_exp_input in zip(index_list, sub_exp_input_list):
+        each = estimate_sub_exp(sub_exp_input,
+                                nrep=input_dict['nrep'],
+                                npergroup=input_dict['npergroup'],
+                                nplate=input_dict['nplate'],
+                                nperplate=input_dict['nperplate'],
+                                plate_df=input_dict['plate_df'],
+                                time_df=input_dict['time_df'],
+                                tip_size=list(input_dict['tip_size']),
+                                delimiter_cell=input_dict['delimiter_cell'])
+        deck_plates = each['assay_plates'] + sum(each['source_plates'].values())
+        if input_dict['max_plates'] > 0 and deck_plates > input_dict['max_plates']:
+            each['problems'] = each['problems'] + [str(deck_plates) + ' plates do not fit on the deck, max_plates is ' +
+                                                   str(input_dict['max_plates'])]
+        sub_exp[names[i]] = each
+        problems = problems + [names[i] + ': ' + problem for problem in each['problems']]
+
+    combined = estimate_combined(sub_exp, input_dict['combine_run'], input_dict['prefix'], input_dict['nplate'],
+                                 input_dict['nperplate'], input_dict['max_plates'])
+    for name, each in combined.items():
+        problems = problems + [name + ': ' + problem for problem in each['problems']]
+
+    return {'feasible': len(problems) == 0,
+            'problems': problems,
+            'compute_ms': sum([each['compute_ms'] for each in sub_exp.values()]),
+            'sub_exp': sub_exp,
+            'combined': combined}
+
+
+def estimate_combined(sub_exp, combine_run, prefix, nplate, nperplate, max_plates):
+    """
+    estimate the plates of the runs made of several consecutive sub experiments on one deck, named and split as in
+    full_experiment.make_worklist_full_2d. each sub experiment starts on a new assay plate, see
+    one_run.combine_factorial, and the sources they share have one well, so the largest number of source plates of
+    each type is counted
+    :param sub_exp: dictionary of estimates of the selected sub experiments, in order, see estimate_sub_exp
+    :param combine_run: number of sub experiments run together, 1 to run each alone
+    :param prefix: prefix of names
+    :param nplate: number of assay plates
+    :param nperplate: number of strips per assay plate
+    :param max_plates: maximum number of plates on the deck, 0 for no limit
+    :return: dictionary keyed by the name of each combined run, of sub_exp (list of names), assay_plates, deck_plates
+        and problems, empty if combine_run is 1
+    """
+    if combine_run <= 1:
+        return {}
+    names = list(sub_exp.keys())
+    combined = {}
+    for i in range(0, len(names), combine_run):
+        run_names = names[i:i + combine_run]
+        assay_plates = sum([sub_exp[each]['assay_plates'] for each in run_names])
+        source_plates = {}
+        for each in run_names:
+            for plate, n in sub_exp[each]['source_plates'].items():
+                source_plates[plate] = max(source_plates.get(plate, 0), n)
+        deck_plates = assay_plates + sum(source_plates.values())
+
+        problems = []
+        if assay_plates > nplate:
+            problems = problems + [str(len(run_names)) + ' sub experiments need ' + str(assay_plates) +
+                                   ' assay plates of ' + str(nperplate) + ', but nplate is ' + str(nplate)]
+        if max_plates > 0 and deck_plates > max_plates:
+            problems = problems + [str(deck_plates) + ' plates do not fit on the deck, max_plates is ' +
+                                   str(max_plates)]
+        combined[prefix + '_combined' + str(i // combine_run)] = {'sub_exp': run_names,
+                                                                  'assay_plates': assay_plates,
+                                                                  'deck_plates': deck_plates,
+                                                                  'problems': problems}
+    return combined
+
+
+def check_feasibility(input_dict):
+    """
+    stop before making any worklist if the experiment does not fit, see estimate
+    :param input_dict: dictionary of settings and input dataframes, from main.load_inputs
+    :return: output of estimate
+    """
+    out = estimate(input_dict)
+    if not out['feasible']:
+        raise ValueError('experiment does not fit: ' + '; '.join(out['problems']))
+    return out
@@ -1,6 +1,13 @@
-from one_run import make_worklist_one_run
-from split_input import get_sub_exp_input_list, write_sub_exp_input_list
+from one_run import make_worklist_one_run, export_worklist_one_run
+from split_input import get_sub_exp_split, iter_sub_exp_input, get_sub_exp_names, get_sub_exp_index, \
+    write_sub_exp_input_list
+from util import full_from_run_worklist, update_liquid_class, combine_run_worklists
+from parallel import map_jobs
+from cache import get_hash, cache_load, cache_store
+from tracer import traced
 import pandas as pd
+import glob
+import os
 
 
 def make_worklist_full_2d(exp_input, delimiter_cell, delimiter_col,  # info about experiment input file
@@ -13,7 +20,9 @@ def make_worklist_full_2d(exp_input, delimiter_cell, delimiter_col,  # info abou
                           nzfill,  # shared deck parameter: how the hamilton software adds leading zeroes
                           assay_plate_prefix, nplate, nperplate, ncol, sort_by_col,  # destination setup
                           plate_df, export_intermediate, # source setup
-                          time_df, prefix):
+                          time_df, prefix, jobs=1, in_memory=0, cache_dir='none', cache_max_mb=500, sub_exp='all',
+                          engine='reference', multi_dispense=1, source_layout='alphabetical', split='fixed',
+                          coord_extra='none', nsub_extra='none', combine_run=1):
     """
     make worklists from experimentel setup
     :param exp_input: dataframe, experimental setup
@@ -39,21 +48,248 @@ def make_worklist_full_2d(exp_input, delimiter_cell, delimiter_col,  # info abou
     :param export_intermediate: export intermediate files
     :param time_df: dataframe, time it takes to run steps
     :param prefix: prefix for output filenames
-    :return: none
+    :param jobs: number of worker processes to make the sub experiments in parallel
+    :param in_memory: pass the sub experiment dataframes directly instead of writing and reading them back, the sub
+        experiment files are then only written if export_intermediate
+    :param cache_dir: directory to cache the worklist of each sub experiment, keyed by a hash of its inputs, 'none' to
+        not use any cache
+    :param cache_max_mb: maximum size of the cache directory, in MB
+    :param sub_exp: sub experiments to make, 'all', 'first', or indices separated by commas, the others are not
+        computed
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param multi_dispense: maximum number of dispenses per aspiration, 1 to aspirate for each dispense
+    :param source_layout: 'alphabetical' or 'optimized' placement of the sources in their wells
+    :param split: 'fixed' blocks of nsub0 and nsub1 options, or 'balanced' blocks that fill the deck in the fewest sub
+        experiments, see get_sub_exp_split
+    :param coord_extra: coordinates of more variables to split, separated by delimiter_cell, 'none' for none
+    :param nsub_extra: sub-numbers of options of these variables, separated by delimiter_cell, for the fixed split
+    :param combine_run: number of sub experiments to run together on one deck, on distinct assay plates, with their
+        groups scheduled jointly, see combine_factorial; 1 to run each alone
+    :return: dictionary of outputs of make_worklist_one_run, keyed by the output prefix of each selected sub experiment,
+        or of each combined run, prefix_combined0_ and so on
     """
     # gets step/dx/dz/volume/liquid_class/time/source
-    sub_exp_input_list = get_sub_exp_input_list(exp_input, coord0, coord1,
-                                                nsub0, nsub1, delimiter_cell, delimiter_col)
-
-    # write output_run_assay_worklist/factorial_experiment0.csv
-    input_files = write_sub_exp_input_list(sub_exp_input_list, output_dir, prefix)
-    for each in input_files:
-        output_prefix = each[:-4] + '_'
-        temp = make_worklist_one_run(pd.read_csv(each), delimiter_cell, delimiter_col,  # info about experiment input file
-                                     nrep, npergroup,  # experiment setup info not in the file
-                                     reverse_var,  # reverse the importance of the variables
-                                     dispense_type, asp_mixing,  # liquid handing parameters
-                                     nzfill,  # shared deck parameter: how the hamilton software adds leading zeroes
-                                     assay_plate_prefix, nplate, nperplate, ncol, sort_by_col,  # destination setup
-                                     plate_df, output_prefix, export_intermediate,  # source setup
-                                     time_df)
+    coord_list, perm_ind = get_sub_exp_split(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col,
+                                             split=split, coord_extra=coord_extra, nsub_extra=nsub_extra, nrep=nrep,
+                                             nplate=nplate, nperplate=nperplate)
+
+    # names are based on all sub experiments, so that they do not depend on the selection
+    index_list = get_sub_exp_index(len(perm_ind), sub_exp)
+    names = [get_sub_exp_names(len(perm_ind), prefix)[i] for i in index_list]
+    # only the selected sub experiments are made
+    sub_exp_input_list = dict(zip(index_list, iter_sub_exp_input(exp_input, coord_list,
+                                                                 [perm_ind[i] for i in index_list],
+                                                                 delimiter_cell, delimiter_col)))
+    if in_memory:
+        if export_intermediate:
+            write_sub_exp_input_list(sub_exp_input_list, output_dir, prefix, index_list, len(perm_ind))
+        sub_exp_input_dict = dict(zip(names, [sub_exp_input_list[i] for i in index_list]))
+    else:
+        # write output_run_assay_worklist/factorial_experiment0.csv
+        sub_exp_input_dict = dict(zip(names, write_sub_exp_input_list(sub_exp_input_list, output_dir, prefix,
+                                                                      index_list, len(perm_ind))))
+
+    # consecutive sub experiments run together, in the order they are selected
+    if combine_run > 1:
+        names = list(sub_exp_input_dict.keys())
+        sub_exp_input_dict = {prefix + '_combined' + str(i // combine_run):
+                              {name: sub_exp_input_dict[name] for name in names[i:i + combine_run]}
+                              for i in range(0, len(names), combine_run)}
+
+    run_input = {'delimiter_cell': delimiter_cell,
+                 'delimiter_col': delimiter_col,
+                 'nrep': nrep,
+                 'npergroup': npergroup,
+                 'reverse_var': reverse_var,
+                 'dispense_type': dispense_type,
+                 'asp_mixing': asp_mixing,
+                 'nzfill': nzfill,
+                 'assay_plate_prefix': assay_plate_prefix,
+                 'nplate': nplate,
+                 'nperplate': nperplate,
+                 'ncol': ncol,
+                 'sort_by_col': sort_by_col,
+                 'export_intermediate': export_intermediate,
+                 'engine': engine,
+                 'multi_dispense': multi_dispense,
+                 'source_layout': source_layout,
+                 'cache_dir': cache_dir,
+                 'cache_max_mb': cache_max_mb}
+    args_list = [dict(run_input, exp_input=each, output_prefix=os.path.join(output_dir, name + '_'))
+                 for name, each in sub_exp_input_dict.items()]
+    out = map_jobs(make_worklist_one, args_list, jobs, {'plate_df': plate_df, 'time_df': time_df})
+    return dict(zip([name + '_' for name in sub_exp_input_dict], out))
+
+
+def make_worklist_one(run_input, shared):
+    """
+    make the run worklist of one sub experiment
+    :param run_input: dictionary of inputs of make_worklist_one_run, exp_input is either a dataframe or a file, or a
+        dictionary of them for a combined run
+    :param shared: dictionary of shared inputs, plate_df and time_df
+    :return: dictionary of worklist and source dataframes
+    """
+    run_input = run_input.copy()
+    cache_dir = run_input.pop('cache_dir')
+    cache_max_mb = run_input.pop('cache_max_mb')
+    if isinstance(run_input['exp_input'], str):
+        run_input['exp_input'] = pd.read_csv(run_input['exp_input'])
+    elif isinstance(run_input['exp_input'], dict):
+        run_input['exp_input'] = {name: pd.read_csv(each) if isinstance(each, str) else each
+                                  for name, each in run_input['exp_input'].items()}
+
+    out = None
+    if cache_dir.lower() != 'none':
+        # the output names and whether to export do not change the worklist
+        key_input = {key: value for key, value in run_input.items()
+                     if key not in ['output_prefix', 'export_intermediate']}
+        key = get_hash('run', key_input, shared['plate_df'], shared['time_df'])
+        out = cache_load(cache_dir, key)
+
+    if out is None:
+        out = make_worklist_one_run(plate_df=shared['plate_df'],
+                                    time_df=shared['time_df'],
+                                    **dict(run_input, export_intermediate=0))
+
+        if cache_dir.lower() != 'none':
+            cache_store(cache_dir, key, out, cache_max_mb)
+
+    if run_input['export_intermediate']:
+        export_worklist_one_run(out, run_input['output_prefix'])
+    return out
+
+
+def make_full_worklists(run_worklists, full_dir, diluent, sol_df, liquid_type_df, plate_df, reservoir_tag,
+                        assay_plate_tag, tip_size, n_per_group, nzfill, jobs=1, cache_dir='none', cache_max_mb=500,
+                        engine='reference', tip_reuse=0, pack_groups=0, shared_solution=0, prefix='',
+                        well_packing='smallest'):
+    """
+    make full worklists from run worklists and export them
+    :param run_worklists: dictionary of run worklists, either dataframes or files, keyed by the output prefix
+    :param full_dir: output directory of full worklists, nothing is exported if empty
+    :param diluent: diluent
+    :param sol_df: dataframe, descriptions of solutions
+    :param liquid_type_df: dataframe, liquid types
+    :param plate_df: dataframe, plates on the instrument
+    :param reservoir_tag: tag for reservoirs
+    :param assay_plate_tag: tag for the assay plates
+    :param tip_size: tip sizes, usually [50, 300, 1000]
+    :param n_per_group: number of steps per group
+    :param nzfill: number of digits to fill to using leading zeroes
+    :param jobs: number of worker processes to make the full worklists in parallel
+    :param cache_dir: directory to cache the full worklist of each run worklist, keyed by a hash of its inputs, 'none'
+        to not use any cache
+    :param cache_max_mb: maximum size of the cache directory, in MB
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param tip_reuse: reuse tips for transfers from the same source where they can not be contaminated
+    :param pack_groups: merge groups making solutions that use few channels
+    :param shared_solution: make one full worklist for all run worklists, run in one session on the instrument, so
+        that solutions they share are made once, see combine_run_worklists
+    :param prefix: prefix for naming, the full worklist of a shared session is named prefix + '_shared_'
+    :param well_packing: 'smallest' or 'dead_volume' choice of the wells of the solutions the user puts on the
+        instrument to make other solutions from
+    :return: dictionary of outputs of full_from_run_worklist, keyed by the output prefix
+    """
+    full_input = {'full_dir': full_dir,
+                  'diluent': diluent,
+                  'reservoir_tag': reservoir_tag,
+                  'assay_plate_tag': assay_plate_tag,
+                  'tip_size': tip_size,
+                  'n_per_group': n_per_group,
+                  'nzfill': nzfill,
+                  'engine': engine,
+                  'tip_reuse': tip_reuse,
+                  'pack_groups': pack_groups,
+                  'well_packing': well_packing,
+                  'cache_dir': cache_dir,
+                  'cache_max_mb': cache_max_mb}
+    # sort so that the order of the outputs does not depend on the file system
+    base_names = sorted(run_worklists.keys())
+    if shared_solution and len(base_names) > 1:
+        run_worklist_list = [pd.read_csv(run_worklists[each]) if isinstance(run_worklists[each], str)
+                             else run_worklists[each] for each in base_names]
+        # drop the trailing '_' of the output prefix
+        run_worklists = {prefix + '_shared_': combine_run_worklists(run_worklist_list,
+                                                                    [each[:-1] for each in base_names])}
+        base_names = list(run_worklists.keys())
+    args_list = [dict(full_input, run_worklist=run_worklists[each], base_name=each) for each in base_names]
+    out = map_jobs(make_full_worklist_one, args_list, jobs,
+                   {'sol_df': sol_df, 'liquid_type_df': liquid_type_df, 'plate_df': plate_df})
+    return dict(zip(base_names, out))
+
+
+def get_run_worklist_files(output_dir):
+    """
+    find run worklist files written by make_worklist_one_run
+    :param output_dir: output directory of worklists to run the assay
+    :return: dictionary of files, keyed by the output prefix
+    """
+    run_worklist_files = glob.glob(os.path.join(output_dir, '*_worklist.csv'))
+    return {os.path.basename(each).replace('worklist.csv', ''): each for each in run_worklist_files}
+
+
+def make_full_worklist_one(full_input, shared):
+    """
+    make and export the full worklist of one run worklist
+    :param full_input: dictionary of inputs of full_from_run_worklist, with base_name and full_dir,
+        run_worklist is either a dataframe or a file
+    :param shared: dictionary of shared inputs, sol_df, liquid_type_df and plate_df
+    :return: dictionary, including worklist and info for the user to put solutions, labware, and tips on
+    """
+    full_input = full_input.copy()
+    run_worklist = full_input.pop('run_worklist')
+    base_name = full_input.pop('base_name')
+    full_dir = full_input.pop('full_dir')
+
+    cache_dir = full_input.pop('cache_dir')
+    cache_max_mb = full_input.pop('cache_max_mb')
+
+    if isinstance(run_worklist, str):
+        run_worklist = pd.read_csv(run_worklist)
+
+    full = None
+    if cache_dir.lower() != 'none':
+        key = get_hash('full', run_worklist, full_input,
+                       shared['sol_df'], shared['liquid_type_df'], shared['plate_df'])
+        full = cache_load(cache_dir, key)
+
+    if full is None:
+        full = full_from_run_worklist(run_worklist,
+                                      sol_df=shared['sol_df'],
+                                      liquid_type_df=shared['liquid_type_df'],
+                                      plate_df=shared['plate_df'],
+                                      **full_input)
+
+        # update liquid class
+        full['worklist'] = update_liquid_class(full['worklist'], shared['liquid_type_df'])
+
+        # Drop user_defined_liquid_class column before exporting to CSV
+        if 'user_defined_liquid_class' in full['worklist'].columns:
+            full['worklist'] = full['worklist'].drop(columns=['user_defined_liquid_class'])
+
+        if cache_dir.lower() != 'none':
+            cache_store(cache_dir, key, full, cache_max_mb)
+
+    if full_dir:
+        export_full_worklist(full, full_dir, base_name)
+    return full
+
+
+@traced('export')
+def export_full_worklist(full, full_dir, base_name):
+    """
+    export the full worklist and the info for the user
+    :param full: dictionary, output of make_full_worklist_one
+    :param full_dir: output directory of full worklists
+    :param base_name: prefix for output filenames
+    :return: none
+    """
+    full['worklist'].to_csv(os.path.join(full_dir, base_name + 'full_worklist.csv'), index=False)
+    full['user_solution'].to_csv(os.path.join(full_dir, base_name + 'full_user_solution.csv'), index=False)
+    full['user_labware'].to_csv(os.path.join(full_dir, base_name + 'full_user_labware.csv'), index=False)
+    full['user_tip'].to_csv(os.path.join(full_dir, base_name + 'full_user_tip.csv'), index=False)
+    if 'channel_utilization' in full:
+        full['channel_utilization'].to_csv(os.path.join(full_dir, base_name + 'full_channel_utilization.csv'),
+                                           index=False)
+    if 'well_packing' in full:
+        full['well_packing'].to_csv(os.path.join(full_dir, base_name + 'full_well_packing.csv'), index=False)
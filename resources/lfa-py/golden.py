@@ -0,0 +1,180 @@
+from api import generate, read_config, default_dir
+from check_engine import get_first_difference
+from tracer import start_trace, stop_trace, read_trace
+from engine import engine_list
+import pandas as pd
+import numpy as np
+import contextlib
+import tempfile
+import argparse
+import hashlib
+import shutil
+import json
+import time
+import sys
+import os
+
+# directories of the shipped example outputs, and the file with their fingerprints and timings
+golden_dirs = ['output_run_assay_worklist', 'output_full_worklist']
+golden_file = os.path.join(default_dir, 'golden.json')
+
+
+def normalize_worklist(df, decimals=6):
+    """
+    put a worklist or any output dataframe in a canonical form, so that equivalent outputs are equal whether they are
+    read from a file or not: columns are sorted, numbers are floats rounded to a tolerance, other values are strings.
+    the order of the groups of a worklist is kept, rows are sorted within each group. dataframes without groups are
+    sorted
+    :param df: dataframe
+    :param decimals: number of decimals numbers are rounded to
+    :return: dataframe
+    """
+    df = df[sorted(df.columns.astype(str))].reset_index(drop=True)
+    out = pd.DataFrame(index=df.index)
+    for col in df.columns:
+        each = df[col]
+        if each.dtype == bool:
+            each = each.astype(str)
+        numeric = pd.to_numeric(each, errors='coerce')
+        if (numeric.notna() == each.notna()).all():
+            # 0.0 is added to turn -0.0 into 0.0
+            out[col] = numeric.astype(float).round(decimals) + 0.0
+        else:
+            out[col] = each.astype(str).where(each.notna(), '')
+
+    if 'group_number' in out.columns:
+        # groups in the order they are run
+        group_order = pd.Series(np.arange(out['group_number'].nunique(dropna=False)),
+                                index=out['group_number'].drop_duplicates())
+        out['_group_order'] = group_order[out['group_number'].values].values
+        out = out.sort_values(['_group_order'] + list(df.columns), kind='stable').drop(columns='_group_order')
+    else:
+        out = out.sort_values(list(df.columns), kind='stable')
+    return out.reset_index(drop=True)
+
+
+def get_worklist_fingerprint(df, decimals=6):
+    """
+    get a fingerprint of a worklist or any output dataframe, the same for equivalent outputs, see normalize_worklist
+    :param df: dataframe
+    :param decimals: number of decimals numbers are rounded to
+    :return: string, fingerprint
+    """
+    text = normalize_worklist(df, decimals).to_csv(index=False, float_format='%.' + str(decimals) + 'f')
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def make_example(workspace, engine='reference'):
+    """
+    make the outputs of the example in input_master.csv
+    :param workspace: directory to write the outputs in
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :return: tuple, list of output files relative to the workspace, and dataframe of total seconds of each stage
+    """
+    trace_file = os.path.join(workspace, 'trace.jsonl')
+    start = time.perf_counter()
+    start_trace(trace_file, 'json')
+    try:
+        # the pipeline prints progress, keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            generate(dict(read_config(), engine=engine, jobs=1, cache_dir='none', result_cache_dir='none'),
+                     workspace=workspace)
+    finally:
+        stop_trace()
+    total = time.perf_counter() - start
+
+    time_s = read_trace(trace_file).groupby('name')['duration'].sum()
+    time_s['total'] = total
+    file_list = sorted([os.path.join(each_dir, each) for each_dir in golden_dirs
+                        for each in os.listdir(os.path.join(workspace, each_dir))])
+    return file_list, time_s
+
+
+def check_golden(engine='reference', max_slowdown=2.0, min_seconds=0.05, decimals=6):
+    """
+    make the example again, and compare the fingerprint of each output and the time of each stage with golden.json.
+    the first diverging row from the shipped file is reported for outputs that differ. golden.json may have been made
+    on another machine, so each stage is compared by its share of the total time, not by its seconds
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param max_slowdown: ratio to the golden share of the total above which a stage is a regression
+    :param min_seconds: stages faster than this are not compared, they are mostly noise
+    :param decimals: number of decimals numbers are rounded to, if golden.json does not set it
+    :return: tuple, list of strings describing each difference, and dataframe comparing timings
+    """
+    with open(golden_file) as f:
+        golden = json.load(f)
+    decimals = golden.get('decimals', decimals)
+
+    difference_list = []
+    with tempfile.TemporaryDirectory() as workspace:
+        file_list, time_s = make_example(workspace, engine)
+        for each in sorted(set(file_list) | set(golden['fingerprint'])):
+            if each not in file_list:
+                difference_list = difference_list + [each + ': not made']
+                continue
+            if each not in golden['fingerprint']:
+                difference_list = difference_list + [each + ': not in golden.json']
+                continue
+            new = pd.read_csv(os.path.join(workspace, each))
+            if get_worklist_fingerprint(new, decimals) != golden['fingerprint'][each]:
+                difference = 'fingerprint differs from golden.json'
+                shipped_file = os.path.join(default_dir, each)
+                if os.path.exists(shipped_file):
+                    difference = get_first_difference(normalize_worklist(pd.read_csv(shipped_file), decimals),
+                                                      normalize_worklist(new, decimals),
+                                                      labels=('shipped', 'new')) or difference
+                difference_list = difference_list + [each + ': ' + difference]
+
+    timing = pd.DataFrame({'golden_s': pd.Series(golden['time_s']), 'new_s': time_s})
+    timing['golden_share'] = timing['golden_s'] / golden['time_s']['total']
+    timing['new_share'] = timing['new_s'] / time_s['total']
+    timing['ratio'] = timing['new_share'] / timing['golden_share']
+    timing['regression'] = (timing[['golden_s', 'new_s']].max(axis=1) >= min_seconds) & \
+                           (timing['ratio'] > max_slowdown)
+    return difference_list, timing.sort_values('golden_s', ascending=False)
+
+
+def update_golden(engine='reference', decimals=6):
+    """
+    make the example again, replace the shipped outputs with the new ones, and write their fingerprints and the time of
+    each stage to golden.json. only run this when the change of outputs is intended
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param decimals: number of decimals numbers are rounded to
+    :return: none
+    """
+    with tempfile.TemporaryDirectory() as workspace:
+        file_list, time_s = make_example(workspace, engine)
+        fingerprint = {}
+        for each in file_list:
+            shutil.copyfile(os.path.join(workspace, each), os.path.join(default_dir, each))
+            fingerprint[each] = get_worklist_fingerprint(pd.read_csv(os.path.join(workspace, each)), decimals)
+
+    with open(golden_file, 'w') as f:
+        json.dump({'decimals': decimals,
+                   'fingerprint': fingerprint,
+                   'time_s': {key: round(value, 4) for key, value in time_s.items()}}, f, indent=1)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='make the example outputs again and compare their fingerprints and '
+                                                 'timings with golden.json')
+    parser.add_argument('--engine', default='reference', choices=engine_list, help='implementations to use')
+    parser.add_argument('--max-slowdown', type=float, default=2.0,
+                        help='ratio to the golden share of the total time above which a stage is a regression')
+    parser.add_argument('--check-timing', action='store_true',
+                        help='also exit with 1 if a stage is a regression, timings are only reported otherwise')
+    parser.add_argument('--update', action='store_true',
+                        help='replace the shipped outputs and golden.json, when the change of outputs is intended')
+    args = parser.parse_args()
+
+    if args.update:
+        update_golden(engine=args.engine)
+        sys.exit(0)
+
+    difference_list, timing = check_golden(engine=args.engine, max_slowdown=args.max_slowdown)
+    print('outputs: ' + ('same' if len(difference_list) == 0 else 'DIFFERENT'))
+    for each in difference_list:
+        print('  ' + each)
+    print(timing.round(3).to_string())
+    sys.exit(1 if len(difference_list) > 0 or (args.check_timing and timing['regression'].any()) else 0)
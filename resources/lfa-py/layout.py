@@ -0,0 +1,231 @@
+from tracer import traced, count
+import pandas as pd
+import numpy as np
+import bisect
+
+# cost model of the arm, rough values: seconds per aspiration move and arm speed along the deck
+aspirate_s = 2
+travel_mm_per_s = 200
+# sbs plate width and distance between channels, in mm
+plate_width_mm = 127.76
+channel_pitch_mm = 9
+
+
+def get_well_position(plate, plate_well, plate_df):
+    """
+    get the position of source wells on the deck. the deck layout is not known, plates are taken to be side by side,
+    by type in the order of plate_df, then by index
+    :param plate: list of plate types, without index
+    :param plate_well: list of wells, numbered by column from 1 and going on to the next plate, as in assign_src
+    :param plate_df: dataframe, plates on the instrument
+    :return: dataframe of x (mm), column (id of the column on the deck), row (from 0) and nrow, one row per well
+    """
+    well_df = pd.DataFrame({'plate': list(plate), 'plate_well': np.array(plate_well).astype(int)})
+    well_df = well_df.merge(plate_df.loc[:, ['plate', 'nrow', 'ncol']], how='left')
+    nwell = well_df['nrow'] * well_df['ncol']
+    well_df['plate_index'] = (well_df['plate_well'] - 1) // nwell
+    well_df['row'] = (well_df['plate_well'] - 1) % well_df['nrow']
+    well_df['col'] = ((well_df['plate_well'] - 1) % nwell) // well_df['nrow']
+
+    # rank of each plate on the deck
+    plate_order = dict(zip(plate_df['plate'], np.arange(plate_df.shape[0])))
+    deck_df = well_df.loc[:, ['plate', 'plate_index']].drop_duplicates()
+    deck_df['order'] = deck_df['plate'].map(plate_order)
+    deck_df = deck_df.sort_values(['order', 'plate_index'])
+    deck_df['rank'] = np.arange(deck_df.shape[0])
+    well_df = well_df.merge(deck_df.loc[:, ['plate', 'plate_index', 'rank']], how='left')
+
+    well_df['x'] = well_df['rank'] * plate_width_mm + well_df['col'] * channel_pitch_mm * 12 / well_df['ncol']
+    well_df['column'] = well_df['rank'] * 1000 + well_df['col']
+    return well_df.loc[:, ['x', 'column', 'row', 'nrow']]
+
+
+def count_passes(channel, row, nrow):
+    """
+    count the aspiration moves of channels in one column. channels can not cross and are channel_pitch_mm apart, so
+    they only aspirate together from rows that are at least as far apart as the channels are
+    :param channel: list of channels, from 1, in increasing order
+    :param row: list of rows of the wells they aspirate from, from 0
+    :param nrow: number of rows of the plate, plates of fewer than 8 rows are troughs all channels reach at once
+    :return: number of moves
+    """
+    if nrow < 8:
+        return 1
+    # channels aspirate together if key does not decrease, the fewest moves is the longest decreasing subsequence
+    key = np.array(row) - nrow / 8 * np.array(channel)
+    tails = []
+    for each in -key:
+        i = bisect.bisect_left(tails, each)
+        tails[i:i + 1] = [each]
+    return len(tails)
+
+
+def get_group_cost(channel, x, column, row, nrow):
+    """
+    get the time one group spends aspirating: the moves in each column, and the travel across the columns
+    :param channel: array of channels, from 1, in increasing order
+    :param x: array of x of the wells each channel aspirates from
+    :param column: array of columns of these wells
+    :param row: array of rows of these wells
+    :param nrow: array of number of rows of the plates of these wells
+    :return: tuple, seconds and center of the columns visited, (0, None) if no channel aspirates
+    """
+    if len(channel) == 0:
+        return 0, None
+    passes = 0
+    for each in np.unique(column):
+        in_column = column == each
+        passes = passes + count_passes(channel[in_column], row[in_column], nrow[in_column][0])
+    return aspirate_s * passes + (x.max() - x.min()) / travel_mm_per_s, (x.max() + x.min()) / 2
+
+
+def get_group_usage(worklist, no_layout_class=['imaging']):
+    """
+    get the sources each group aspirates, in the order the groups are run. the channel of a row is its position in the
+    group
+    :param worklist: worklist with group_number and source, in the order it is run
+    :param no_layout_class: liquid classes defined by the user that are not aspirated from a source plate
+    :return: tuple, list of group numbers and list of dataframes of the rows of each group, with channel
+    """
+    worklist = worklist.copy()
+    worklist['channel'] = worklist.groupby('group_number', sort=False).cumcount() + 1
+    worklist = worklist[~worklist['user_defined_liquid_class'].isin(no_layout_class)]
+    group_list = list(pd.unique(worklist['group_number']))
+    usage = dict(list(worklist.groupby('group_number', sort=False)))
+    return group_list, [usage[each] for each in group_list]
+
+
+def get_layout_cost(worklist, plate_df):
+    """
+    estimate the time the arm spends aspirating in a worklist, from the position of its source wells, see
+    get_group_cost. travel between groups is counted between the centers of the columns they visit
+    :param worklist: worklist, after assign_src, in the order it is run
+    :param plate_df: dataframe, plates on the instrument
+    :return: seconds
+    """
+    worklist = worklist.reset_index(drop=True)
+    # from_well goes on to the next plate, as plate_well in assign_src
+    plate = [each.rsplit('_', 1)[0] for each in worklist['from_plate']]
+    position = get_well_position(plate, worklist['from_well'].values, plate_df)
+    worklist = pd.concat([worklist, position], axis=1)
+
+    _, usage = get_group_usage(worklist)
+    total = 0
+    previous = None
+    for each in usage:
+        cost, center = get_group_cost(each['channel'].values, each['x'].values, each['column'].values,
+                                      each['row'].values, each['nrow'].values)
+        total = total + cost
+        if center is not None:
+            if previous is not None:
+                total = total + abs(center - previous) / travel_mm_per_s
+            previous = center
+    return total
+
+
+@traced('optimize_source_layout')
+def optimize_source_layout(source_df, worklist, plate_df, max_pass=10):
+    """
+    place the sources in the wells assign_src reserves for their step and plate, so that the channels of each group
+    aspirate in few moves with little travel, see get_layout_cost. sources are placed greedily in the order they are
+    first used, then the contents of pairs of wells are swapped as long as it saves time. plates of fewer than 8 rows
+    are left as they are
+    :param source_df: dataframe of sources from assign_src, with step, plate, nrow and plate_well
+    :param worklist: worklist with group_number and source, in the order it is run
+    :param plate_df: dataframe, plates on the instrument
+    :param max_pass: maximum number of passes over all pairs of wells
+    :return: source_df with the new plate_well
+    """
+    source_df = source_df.copy()
+    source_id = dict(zip(source_df['source'], np.arange(source_df.shape[0])))
+
+    # wells that can be used: all wells of the columns reserved for each step and plate
+    slot_plate = []
+    slot_well = []
+    block_list = []
+    source_slot = np.zeros(source_df.shape[0], dtype=int)
+    for _, block in source_df.groupby(['step', 'plate'], sort=False):
+        nrow = block['nrow'].values[0]
+        if nrow < 8:
+            well_list = list(block['plate_well'])
+        else:
+            first = (block['plate_well'].min() - 1) // nrow * nrow + 1
+            well_list = list(range(first, int(np.ceil(block['plate_well'].max() / nrow) * nrow) + 1))
+            block_list = block_list + [[len(slot_well) + np.arange(len(well_list)),
+                                        [source_id[each] for each in block['source']]]]
+        source_slot[[source_id[each] for each in block['source']]] = \
+            len(slot_well) + np.array([well_list.index(each) for each in block['plate_well']])
+        slot_plate = slot_plate + [block['plate'].values[0]] * len(well_list)
+        slot_well = slot_well + well_list
+    slot = get_well_position(slot_plate, slot_well, plate_df)
+    slot_x, slot_column, slot_row, slot_nrow = [slot[each].values for each in ['x', 'column', 'row', 'nrow']]
+
+    # sources and channels of each group, and groups using each source
+    _, usage = get_group_usage(worklist[worklist['source'].isin(source_id.keys())])
+    usage = [[each['source'].map(source_id).values, each['channel'].values] for each in usage]
+    source_group = [[] for _ in range(source_df.shape[0])]
+    for i, (source, _) in enumerate(usage):
+        for each in np.unique(source):
+            source_group[each] = source_group[each] + [i]
+
+    def get_local_cost(group_set):
+        # cost of some groups and of the travel to and from them, sources not placed yet are left out
+        around = set(group_set) | {i - 1 for i in group_set if i > 0} | {i + 1 for i in group_set if i + 1 < len(usage)}
+        term = {}
+        for i in around:
+            source, channel = usage[i]
+            each_slot = source_slot[source]
+            placed = each_slot >= 0
+            each_slot = each_slot[placed]
+            term[i] = get_group_cost(channel[placed], slot_x[each_slot], slot_column[each_slot], slot_row[each_slot],
+                                     slot_nrow[each_slot])
+        cost = sum([term[i][0] for i in group_set])
+        pair_set = {(i - 1, i) for i in group_set if i > 0} | {(i, i + 1) for i in group_set if i + 1 < len(usage)}
+        for i, j in pair_set:
+            if term[i][1] is not None and term[j][1] is not None:
+                cost = cost + abs(term[i][1] - term[j][1]) / travel_mm_per_s
+        return cost
+
+    # greedy: sources in the order they are first used take the free well that costs the least
+    for block_slot, block_source in block_list:
+        source_slot[block_source] = -1
+    first_use = list(pd.unique(np.concatenate([each[0] for each in usage] + [np.arange(source_df.shape[0])])))
+    for block_slot, block_source in block_list:
+        for each in [each for each in first_use if each in block_source]:
+            best = None
+            for candidate in block_slot:
+                if candidate in source_slot:
+                    continue
+                source_slot[each] = candidate
+                cost = get_local_cost(source_group[each])
+                if best is None or cost < best[0] - 1e-9:
+                    best = [cost, candidate]
+            source_slot[each] = best[1]
+
+    # local search: swap the contents of two wells of a block, a source and an empty well included
+    for _ in range(max_pass):
+        improved = False
+        for block_slot, block_source in block_list:
+            for i in range(len(block_slot)):
+                for j in range(i + 1, len(block_slot)):
+                    slot_i = block_slot[i]
+                    slot_j = block_slot[j]
+                    source_i = np.where(source_slot == slot_i)[0]
+                    source_j = np.where(source_slot == slot_j)[0]
+                    if source_i.shape[0] + source_j.shape[0] == 0:
+                        continue
+                    count('iterations')
+                    group_set = sorted(set(sum([source_group[each] for each in np.append(source_i, source_j)], [])))
+                    before = get_local_cost(group_set)
+                    source_slot[source_i] = slot_j
+                    source_slot[source_j] = slot_i
+                    if get_local_cost(group_set) < before - 1e-9:
+                        improved = True
+                    else:
+                        source_slot[source_i] = slot_i
+                        source_slot[source_j] = slot_j
+        if not improved:
+            break
+
+    source_df['plate_well'] = np.array(slot_well)[source_slot]
+    return source_df
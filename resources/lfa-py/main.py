@@ -1,30 +1,83 @@
 from util import *
-from full_experiment import make_worklist_full_2d
+from full_experiment import make_worklist_full_2d, make_full_worklists, get_run_worklist_files
+from cache import get_file_hash
+from tracer import start_trace, start_memory
+from estimate import estimate, check_feasibility
+from planner import plan_robots, export_robot_manifest
 import pandas as pd
-import glob
+import json
+import sys
 import os
 import inspect
 
 
-def main():
-    input_df = pd.read_csv('input_master.csv')
+# reference dataframes shared by experiments, and how to read their files
+reference_readers = [['plate_df', pd.read_csv], ['time_df', pd.read_csv], ['sol_df', get_sol_df],
+                     ['liquid_type_df', pd.read_csv]]
+
+
+def read_input_master(input_master_file='input_master.csv'):
+    """
+    read the settings in input_master.csv
+    :param input_master_file: path to input_master.csv
+    :return: dictionary of settings, integers where possible
+    """
+    input_df = pd.read_csv(input_master_file)
     dict_val = pd.to_numeric(input_df['value'], errors='coerce').astype('Int64').astype('object')
     dict_val.loc[dict_val.isna()] = input_df.loc[dict_val.isna(), 'value']
     input_dict = dict(zip(input_df['key'], dict_val))
+    return input_dict
+
+
+def read_input_file(read_func, filename, file_cache=None):
+    """
+    read an input file, reusing the parsed dataframe if the file content has been read before
+    :param read_func: function to read the file, such as pd.read_csv
+    :param filename: path to the file
+    :param file_cache: dictionary of parsed dataframes keyed by file content, None to always read the file
+    :return: dataframe
+    """
+    if file_cache is None:
+        return read_func(filename)
+
+    key = (read_func.__name__, get_file_hash(filename))
+    if key not in file_cache:
+        file_cache[key] = read_func(filename)
+    return file_cache[key].copy()
+
 
-    input_dict['exp_input'] = pd.read_csv(input_dict['exp_input_file'])
-    input_dict['plate_df'] = pd.read_csv(input_dict['plate_df_file'])
-    input_dict['time_df'] = pd.read_csv(input_dict['time_df_file'])
-    input_dict['sol_df'] = get_sol_df(input_dict['sol_df_file'])
-    input_dict['liquid_type_df'] = pd.read_csv(input_dict['liquid_type_df_file'])
+def load_inputs(input_dict, file_cache=None):
+    """
+    read the input files listed in the settings
+    :param input_dict: dictionary of settings, from read_input_master, and optionally input dataframes
+    :param file_cache: dictionary of parsed reference dataframes, to reuse between experiments, see read_input_file
+    :return: dictionary of settings and input dataframes
+    """
+    input_dict = input_dict.copy()
+    # dataframes already in input_dict are used instead of the files
+    if 'exp_input' not in input_dict:
+        input_dict['exp_input'] = pd.read_csv(input_dict['exp_input_file'])
+    for key, read_func in reference_readers:
+        if key not in input_dict:
+            input_dict[key] = read_input_file(read_func, input_dict[key + '_file'], file_cache)
     input_dict['tip_size'] = np.array(input_dict['tip_size_string'].split(',')).astype(int)
     input_dict['n_per_group'] = input_dict['npergroup']
+    return input_dict
 
-    full_dir = input_dict['full_dir']
+
+def run(input_dict):
+    """
+    make run worklists and full worklists
+    :param input_dict: dictionary of settings and input dataframes, from load_inputs
+    :return: dictionary of outputs of full_from_run_worklist, keyed by the output prefix of each sub experiment
+    """
+    # stop before any heavy computation if the experiment does not fit
+    if input_dict['check_feasibility']:
+        check_feasibility(input_dict)
 
     # make directories
     for each_dir in [input_dict['output_dir'], input_dict['full_dir']]:
-        if not os.path.exists(each_dir):
+        if each_dir and not os.path.exists(each_dir):
             os.makedirs(each_dir)
 
     # make assay worklists
@@ -32,35 +85,110 @@ def main():
     values = [input_dict[each] for each in keys]
     current_input = dict(zip(keys, values))
     # generates output_run_assay_worklist/factorial_experiment0.csv
-    make_worklist_full_2d(**current_input)
+    run_out = make_worklist_full_2d(**current_input)
+
+    # distribute the sub experiments over the robots, see planner.py
+    if input_dict['n_robot'] > 0:
+        if input_dict['shared_solution']:
+            raise ValueError('n_robot can not be used with shared_solution, the sub experiments run on one deck')
+        plan = plan_robots(run_out, input_dict['time_df'], input_dict['n_robot'])
+        if input_dict['output_dir']:
+            export_robot_manifest(plan, input_dict['n_robot'], input_dict['output_dir'], input_dict['prefix'])
 
     # make full worklists
-    keys = list(inspect.signature(full_from_run_worklist).parameters.keys())
-    keys = np.setdiff1d(keys, 'run_worklist_input')
+    keys = list(inspect.signature(make_full_worklists).parameters.keys())
+    keys = np.setdiff1d(keys, 'run_worklists')
     values = [input_dict[each] for each in keys]
     current_input = dict(zip(keys, values))
 
-    run_worklist_files = glob.glob(os.path.join(input_dict['output_dir'], '*_worklist.csv'))
-    for each_file in run_worklist_files:
-        run_worklist = pd.read_csv(each_file)
-        full = full_from_run_worklist(run_worklist, **current_input)
-
-        # update liquid class
-        full['worklist'] = update_liquid_class(full['worklist'], input_dict['liquid_type_df'])
-
-        base_name = os.path.basename(each_file).replace('worklist.csv', '')
-        
-        # Drop user_defined_liquid_class column before exporting to CSV
-        if 'user_defined_liquid_class' in full['worklist'].columns:
-            worklist_export = full['worklist'].drop(columns=['user_defined_liquid_class'])
-        else:
-            worklist_export = full['worklist']
-            
-        worklist_export.to_csv(os.path.join(full_dir, base_name + 'full_worklist.csv'), index=False)
-        full['user_solution'].to_csv(os.path.join(full_dir, base_name + 'full_user_solution.csv'), index=False)
-        full['user_labware'].to_csv(os.path.join(full_dir, base_name + 'full_user_labware.csv'), index=False)
-        full['user_tip'].to_csv(os.path.join(full_dir, base_name + 'full_user_tip.csv'), index=False)
-
-main()
-# if __name__ == 'main':
-#      main()
+    if input_dict['in_memory']:
+        run_worklists = {name: each['worklist'] for name, each in run_out.items()}
+    else:
+        # only the sub experiments made in this run, not the files left from earlier runs
+        run_worklists = get_run_worklist_files(input_dict['output_dir'])
+        run_worklists = {name: each for name, each in run_worklists.items() if name in run_out}
+    full_out = make_full_worklists(run_worklists, **current_input)
+    return full_out
+
+
+def main():
+    # imported here because api builds on this module
+    from api import read_config, generate
+
+    generate(read_config('input_master.csv'), workspace=os.getcwd())
+
+
+def main_cache_stats():
+    """
+    write the hit and miss counts of the result cache in input_master.csv to stdout, as json
+    :return: none
+    """
+    from api import get_result_cache_stats
+
+    result_cache_dir = read_input_master()['result_cache_dir']
+    sys.stdout.write(json.dumps(get_result_cache_stats(result_cache_dir)) + '\n')
+
+
+def main_estimate():
+    """
+    write the estimated resources of the experiment in input_master.csv to stdout, as json, see estimate.estimate
+    :return: exit code, 0 if the experiment fits
+    """
+    from api import read_config
+
+    out = estimate(load_inputs(read_config('input_master.csv')))
+    sys.stdout.write(json.dumps(out, indent=1) + '\n')
+    return 0 if out['feasible'] else 1
+
+
+def main_json():
+    """
+    read one json job from stdin and write the worklists, user solutions, labware and tips as compact json to stdout,
+    see api.run_json_job for the format of the job
+    :return: exit code, 0 if the job succeeded
+    """
+    # imported here because api builds on this module
+    from api import run_json_job
+
+    job = json.load(sys.stdin)
+    job.setdefault('cwd', os.getcwd())
+    result = run_json_job(job)
+    sys.stdout.write(json.dumps(result, separators=(',', ':')) + '\n')
+    return 0 if result['ok'] else 1
+
+
+def main_batch():
+    """
+    read a json list of jobs from stdin and write a json list of results to stdout, in the same order. the reference
+    files are read once and the jobs run on the number of processes set by jobs in input_master.csv
+    :return: exit code, 0 if all jobs succeeded
+    """
+    from api import run_json_batch
+
+    job_list = json.load(sys.stdin)
+    for each in job_list:
+        each.setdefault('cwd', os.getcwd())
+    result_list = run_json_batch(job_list, processes=read_input_master()['jobs'])
+    sys.stdout.write(json.dumps(result_list, separators=(',', ':')) + '\n')
+    return 0 if all([each['ok'] for each in result_list]) else 1
+
+
+if __name__ == '__main__':
+    # trace the pipeline stages with --trace=<file> or the LFA_TRACE environment variable
+    trace_arg = [each.split('=', 1)[1] for each in sys.argv[1:] if each.startswith('--trace=')]
+    if len(trace_arg) > 0 or os.environ.get('LFA_TRACE'):
+        start_trace(trace_arg[0] if len(trace_arg) > 0 else os.environ['LFA_TRACE'],
+                    os.environ.get('LFA_TRACE_FORMAT', 'chrome'))
+    # profile memory with --memory, or LFA_MEMORY=1, and stop above LFA_MEMORY_BUDGET_MB
+    if '--memory' in sys.argv[1:] or os.environ.get('LFA_MEMORY', '0') not in ['', '0']:
+        start_memory(float(os.environ.get('LFA_MEMORY_BUDGET_MB', '0') or 0))
+
+    if '--json' in sys.argv[1:]:
+        sys.exit(main_json())
+    if '--batch' in sys.argv[1:]:
+        sys.exit(main_batch())
+    if '--estimate' in sys.argv[1:]:
+        sys.exit(main_estimate())
+    if '--cache-stats' in sys.argv[1:]:
+        sys.exit(main_cache_stats())
+    main()
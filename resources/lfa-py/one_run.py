@@ -2,6 +2,9 @@ import numpy as np
 import pandas as pd
 import itertools
 from rearrange_worklist import reorder_groups
+from tracer import traced, count
+from engine import select, fast_version
+from layout import optimize_source_layout
 
 
 #############
@@ -26,6 +29,8 @@ def patch_input(exp_input):
     :param exp_input: dataframe describing experimental setup
     :return: dataframe with extra columns
     """
+    exp_input = exp_input.copy()
+
     # determine step index and step group index based on timing
     exp_input['step_index'] = np.arange(exp_input.shape[0]) + 1
     exp_input['step_group_index'] = exp_input['step_index']
@@ -39,6 +44,7 @@ def patch_input(exp_input):
     return exp_input
 
 
+@traced('permutation')
 def get_perm_df(exp_input, nrep, delimiter_cell, delimiter_col, reverse_var):
     """
     get dataframe of permutations
@@ -80,11 +86,84 @@ def get_perm_df(exp_input, nrep, delimiter_cell, delimiter_col, reverse_var):
     return perm_df
 
 
+# columns of a dataframe of permutations that are not options of a variable
+perm_info_col = ['rep', 'destination', 'multiplicity', 'rep_stride']
+
+
+def get_condition_df(perm_df):
+    """
+    get the distinct conditions of a dataframe of permutations. replicates of a condition only differ by their
+    destination, so the worklist is made for the permutations of the first replicate and repeated for the others when
+    the destinations are assigned, see expand_replicates. rows whose replicates fall in different groups are split
+    when the strips are grouped, see split_replicates
+    :param perm_df: dataframe of permutations, from get_perm_df
+    :return: dataframe of permutations of the first replicate, without rep, with multiplicity (number of replicates)
+        and rep_stride (difference of destination between two replicates of a condition)
+    """
+    nrep = perm_df['rep'].nunique()
+    condition_df = perm_df[perm_df['rep'] == 0].drop('rep', axis=1).reset_index(drop=True)
+    condition_df['multiplicity'] = nrep
+    # rep is either the first or the last product dimension, its first increment leaves the other options first
+    condition_df['rep_stride'] = perm_df.loc[perm_df['rep'] == 1, 'destination'].min() - 1 if nrep > 1 else 0
+    return condition_df
+
+
+def get_replicate_destination(worklist):
+    """
+    get the destination of each replicate of the rows of a worklist of distinct conditions
+    :param worklist: worklist with multiplicity and rep_stride
+    :return: tuple of arrays, one value per replicate: position of its row in the worklist, replicate number counted
+        from the row, and destination
+    """
+    multiplicity = worklist['multiplicity'].values
+    row = np.repeat(np.arange(worklist.shape[0]), multiplicity)
+    rep = np.arange(multiplicity.sum()) - np.repeat(np.cumsum(multiplicity) - multiplicity, multiplicity)
+    return row, rep, worklist['destination'].values[row] + rep * worklist['rep_stride'].values[row]
+
+
+def split_replicates(worklist, npergroup):
+    """
+    split the rows of a worklist of distinct conditions whose replicates fall in different groups of npergroup strips,
+    so that every row stands for strips of one group, as reorder_groups schedules each group on its own. rows stay
+    whole only with replicates next to each other (reverse_var 0) and npergroup a multiple of nrep; with the default
+    reverse_var 1, replicates of a condition are a block of conditions apart and every row is split to one per strip
+    :param worklist: worklist with multiplicity and rep_stride
+    :param npergroup: number of strips per group
+    :return: worklist, each row with the destination of its first replicate and the number of replicates it stands for
+    """
+    if 'multiplicity' not in worklist.columns:
+        return worklist
+    row, rep, destination = get_replicate_destination(worklist)
+    dst_group = (destination - 1) // npergroup
+    # a new row starts at the first replicate of a row and where the destination group changes
+    start = (rep == 0) | (np.append(-1, dst_group[:-1]) != dst_group)
+    return worklist.iloc[row[start]].assign(destination=destination[start],
+                                            multiplicity=np.bincount(np.cumsum(start) - 1))
+
+
+def expand_replicates(worklist, sort_col):
+    """
+    repeat the rows of a worklist of distinct conditions for each replicate, see get_condition_df
+    :param worklist: worklist with multiplicity and rep_stride
+    :param sort_col: columns to sort the rows by, as the worklist is sorted, with destination last
+    :return: worklist without multiplicity and rep_stride, one row per strip and step
+    """
+    if 'multiplicity' not in worklist.columns:
+        return worklist
+    row, _, destination = get_replicate_destination(worklist)
+    worklist = worklist.iloc[row].assign(destination=destination)
+    if 'guid' in worklist.columns:
+        # guid is the destination, see cleanup_worklist
+        worklist = worklist.assign(guid=destination)
+    return worklist.drop(['multiplicity', 'rep_stride'], axis=1).sort_values(sort_col)
+
+
+@traced('get_worklist_from_perm')
 def get_worklist_from_perm(exp_input, perm_df, npergroup, delimiter_col):
     """
     get worklist from permutations
     :param exp_input: dataframe, experimental setup
-    :param perm_df: dataframe of permutations
+    :param perm_df: dataframe of permutations, or of distinct conditions with multiplicity, see get_condition_df
     :param npergroup: number of strips per group
     :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
     :return: worklist
@@ -92,19 +171,62 @@ def get_worklist_from_perm(exp_input, perm_df, npergroup, delimiter_col):
     # iterate through permutation dataframe to make worklist
     worklist = pd.DataFrame()
 
+    count('iterations', perm_df.shape[0])
     for iperm in range(perm_df.shape[0]):
         perm = perm_df.iloc[iperm, :]
 
         temp = exp_input.copy()
         # temp['rep'] = perm['rep']
-        temp['destination'] = perm['destination']
+        for each in np.intersect1d(perm_info_col[1:], perm.index.values):
+            temp[each] = perm[each]
 
-        for perm_each_col in np.setdiff1d(perm.index.values, ['rep', 'destination']):
+        for perm_each_col in np.setdiff1d(perm.index.values, perm_info_col):
             coord = np.array(perm_each_col.split(delimiter_col)).astype(int)
             temp.iloc[tuple(coord)] = perm[perm_each_col]
 
         worklist = pd.concat([worklist, temp], ignore_index=False, sort=False)
 
+    return add_group_columns(worklist, npergroup)
+
+
+@fast_version(get_worklist_from_perm)
+@traced('get_worklist_from_perm')
+def get_worklist_from_perm_fast(exp_input, perm_df, npergroup, delimiter_col):
+    """
+    get worklist from permutations, see get_worklist_from_perm. the rows of all permutations are made at once instead
+    of one permutation at a time
+    :param exp_input: dataframe, experimental setup
+    :param perm_df: dataframe of permutations, or of distinct conditions with multiplicity, see get_condition_df
+    :param npergroup: number of strips per group
+    :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
+    :return: worklist
+    """
+    count('iterations', perm_df.shape[0])
+    nrow = exp_input.shape[0]
+    nperm = perm_df.shape[0]
+
+    # one copy of exp_input per permutation, keeping the index of exp_input as in get_worklist_from_perm
+    worklist = exp_input.iloc[np.tile(np.arange(nrow), nperm)].copy()
+    for each in np.intersect1d(perm_info_col[1:], perm_df.columns.values):
+        worklist[each] = np.repeat(perm_df[each].values, nrow)
+
+    for perm_each_col in np.setdiff1d(perm_df.columns.values, perm_info_col):
+        coord = np.array(perm_each_col.split(delimiter_col)).astype(int)
+        worklist.iloc[coord[0] + np.arange(nperm) * nrow, coord[1]] = perm_df[perm_each_col].values
+
+    return add_group_columns(worklist, npergroup)
+
+
+def add_group_columns(worklist, npergroup):
+    """
+    add destination groups, groups, and previous groups to the worklist of all permutations
+    :param worklist: worklist, one copy of the experimental setup per destination, or per distinct condition with
+        multiplicity, see split_replicates
+    :param npergroup: number of strips per group
+    :return: worklist
+    """
+    worklist = split_replicates(worklist, npergroup)
+
     # determine destination group based on the number of strips to do at once
     all_dst = np.sort(worklist['destination'].unique())
     dst_group = np.floor((all_dst - 1) / npergroup).astype(int) + 1
@@ -134,7 +256,8 @@ def get_worklist_from_perm(exp_input, perm_df, npergroup, delimiter_col):
     return worklist
 
 
-def get_worklist_full_factorial(exp_input, nrep, npergroup, delimiter_cell, delimiter_col, reverse_var):
+def get_worklist_full_factorial(exp_input, nrep, npergroup, delimiter_cell, delimiter_col, reverse_var,
+                                engine='reference'):
     """
     :param exp_input: dataframe describing experimental setup
     :param nrep: number of technical replicates
@@ -142,6 +265,7 @@ def get_worklist_full_factorial(exp_input, nrep, npergroup, delimiter_cell, deli
     :param delimiter_cell: delimiter to separate options of a variable
     :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
     :param reverse_var: reverse the order of variables to sort
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
     :return: worklist
     """
     exp_input = patch_input(exp_input)
@@ -167,13 +291,49 @@ def get_worklist_full_factorial(exp_input, nrep, npergroup, delimiter_cell, deli
                     newcol[icol] = delimiter_col.join(coord.astype(str))
                     perm_df = pd.DataFrame(data=perm_df, columns=newcol)
 
-    # then get worklist
-    worklist = get_worklist_from_perm(exp_input, perm_df, npergroup, delimiter_col)
+    # then get worklist, made once for each distinct condition
+    worklist = select(get_worklist_from_perm, engine)(exp_input, get_condition_df(perm_df), npergroup, delimiter_col)
     return {'worklist': worklist,
             'perm_df': perm_df,
             'exp_input': exp_input}
 
 
+@traced('combine_factorial')
+def combine_factorial(factorial_dict, npergroup, nperplate, nplate):
+    """
+    put the full factorial worklists of several sub experiments on one deck, each starting on a new assay plate. their
+    groups are numbered together, step by step as in add_group_columns, so that reorder_groups schedules them jointly
+    and the groups of one sub experiment run while the others wait on their timers
+    :param factorial_dict: dictionary of outputs of get_worklist_full_factorial, keyed by sub experiment name
+    :param npergroup: number of strips per group
+    :param nperplate: number of strips per plate
+    :param nplate: number of plates
+    :return: dictionary of worklist, perm_df and exp_input, as get_worklist_full_factorial, with a sub_exp column
+    """
+    worklist_list = []
+    perm_list = []
+    exp_list = []
+    offset = 0
+    for name, factorial in factorial_dict.items():
+        worklist = factorial['worklist'].drop(['destination_group', 'group', 'previous_group'], axis=1)
+        worklist['destination'] = worklist['destination'] + offset
+        perm_df = factorial['perm_df'].copy()
+        perm_df['destination'] = perm_df['destination'] + offset
+        worklist_list = worklist_list + [worklist.assign(sub_exp=name)]
+        perm_list = perm_list + [perm_df.assign(sub_exp=name)]
+        exp_list = exp_list + [factorial['exp_input'].assign(sub_exp=name)]
+        offset = int(np.ceil(perm_df['destination'].max() / nperplate)) * nperplate
+
+    if offset > nplate * nperplate:
+        raise ValueError(str(len(factorial_dict)) + ' sub experiments need ' + str(offset // nperplate) +
+                         ' assay plates of ' + str(nperplate) + ', but nplate is ' + str(nplate))
+    worklist = add_group_columns(pd.concat(worklist_list, ignore_index=True, sort=False), npergroup)
+    return {'worklist': worklist,
+            'perm_df': pd.concat(perm_list, ignore_index=True, sort=False),
+            'exp_input': pd.concat(exp_list, ignore_index=True, sort=False)}
+
+
+@traced('cleanup_worklist')
 def cleanup_worklist(worklist, dispense_type, asp_mixing):
     """
     clean up worklist
@@ -197,16 +357,21 @@ def cleanup_worklist(worklist, dispense_type, asp_mixing):
     worklist['dispense_type'] = dispense_type
     worklist['tip_type'] = get_tip_type(worklist['volume_ul'])
 
-    worklist['dispense_type_temp'] = worklist['dispense_type']
-    worklist['dispense_type_temp'].replace(regex=True, inplace=True, to_replace='_', value='')
     worklist['user_defined_liquid_class'] = worklist['liquid_class']
-    worklist['liquid_class'] = 'ivl_tip' + worklist['tip_type'].astype(str) + '_' + \
-                               worklist['liquid_class'] + '_' + worklist['dispense_type_temp']
-
-    worklist = worklist.drop('dispense_type_temp', axis=1)
+    worklist['liquid_class'] = get_liquid_class(worklist)
     return worklist
 
 
+def get_liquid_class(worklist):
+    """
+    get the liquid class of the instrument for each row, such as ivl_tip50_water_JetEmpty
+    :param worklist: worklist with tip_type, user_defined_liquid_class and dispense_type
+    :return: series of liquid classes
+    """
+    return 'ivl_tip' + worklist['tip_type'].astype(str) + '_' + worklist['user_defined_liquid_class'] + '_' + \
+        worklist['dispense_type'].str.replace('_', '')
+
+
 def get_tip_type(volume, types=[0, 50, 300, 1000]):
     """
     get tip types for each volume in a volume list
@@ -251,6 +416,7 @@ def get_assay_area_df(assay_plate_prefix, nplate, nperplate, ncol, nzfill, sort_
     return assay_area_df
 
 
+@traced('assign_dst')
 def assign_dst(worklist, assay_plate_prefix, nplate, nperplate, ncol, nzfill, sort_by_col):
     """
     assign destinations
@@ -261,8 +427,9 @@ def assign_dst(worklist, assay_plate_prefix, nplate, nperplate, ncol, nzfill, so
     :param ncol: number of columns
     :param nzfill: number to add leading zeros
     :param sort_by_col: sort by column
-    :return: worklist with assigned destinations (strip locations)
+    :return: worklist with assigned destinations (strip locations), one row per strip and step
     """
+    worklist = expand_replicates(worklist, ['group_number', 'destination'])
     assay_area_df = get_assay_area_df(assay_plate_prefix=assay_plate_prefix,
                                       nplate=nplate,
                                       nperplate=nperplate,
@@ -281,14 +448,20 @@ def assign_dst(worklist, assay_plate_prefix, nplate, nperplate, ncol, nzfill, so
     return worklist
 
 
-def assign_src(worklist, plate_df, nzfill):
+@traced('assign_src')
+def assign_src(worklist, plate_df, nzfill, source_layout='alphabetical'):
     """
     assign sources
     :param worklist: input worklist
     :param plate_df: dataframe describing plates on the instrument
     :param nzfill: number to fill with leading zeros to
+    :param source_layout: 'alphabetical' to fill the wells of each step in the order of the sources, 'optimized' to
+        place them so that each group aspirates in few moves, see layout.optimize_source_layout
     :return: worklist with sources
     """
+    if source_layout not in ['alphabetical', 'optimized']:
+        raise ValueError('source_layout must be alphabetical or optimized, not ' + str(source_layout))
+
     # first tally up the total volume
     source_df = worklist.groupby('source')['volume_ul'].sum().to_frame().reset_index()
     step_df = worklist.loc[:, ['source', 'step_index', 'step']].drop_duplicates()
@@ -296,6 +469,7 @@ def assign_src(worklist, plate_df, nzfill):
     source_df = source_df[source_df['volume_ul'] > 0]
 
     # reagent plate df
+    plate_df = plate_df.copy()
     plate_df['volume_usable'] = plate_df['volume_well'] - plate_df['volume_holdover']
     plate_df = plate_df.sort_values('volume_usable')
 
@@ -330,6 +504,8 @@ def assign_src(worklist, plate_df, nzfill):
                 plate_well = plate_well + shift
                 source_df.loc[sub_df.index.values, 'plate_well'] = plate_well
     source_df['plate_well'] = source_df['plate_well'].astype(int)
+    if source_layout == 'optimized':
+        source_df = optimize_source_layout(source_df, worklist, plate_df)
     source_df['plate_index'] = np.ceil(source_df['plate_well'] / source_df['ncol'] / source_df['nrow']).astype(int)
     source_df['from_plate'] = source_df['plate'] + '_' + source_df['plate_index'].astype(str).str.zfill(nzfill)
     source_df['from_well'] = source_df['plate_well']
@@ -360,10 +536,72 @@ def assign_src(worklist, plate_df, nzfill):
             'source_df': source_df_out}
 
 
+@traced('batch_dispense')
+def batch_dispense(worklist, max_dispense, no_batch_class=['imaging']):
+    """
+    let each channel dispense into several strips from one aspiration. the channel of a row is its position in the
+    group, as on the robot. a channel keeps its liquid for the next group if that group runs right after, is the same
+    step and liquid class, does not wait on a timer, and uses the same source well, so rows, groups and timers are
+    unchanged and only aspirations are saved. the aspirated volume stays within the tip of get_tip_type
+    :param worklist: worklist, after assign_src
+    :param max_dispense: maximum number of dispenses per aspiration
+    :param no_batch_class: liquid classes defined by the user that are never batched, such as imaging
+    :return: worklist with channel, aspirate (0/1), volume_aspirate (0 if the tip already holds the liquid),
+        dispense_index (in the aspiration, from 1) and n_dispense columns. dispense_type of all but the last dispense
+        of an aspiration is the partial version, such as Jet_Part for Jet_Empty, and so is its liquid_class
+    """
+    worklist = worklist.copy()
+    worklist['channel'] = worklist.groupby('group_number', sort=False).cumcount() + 1
+
+    # groups in the order they are run, and whether each continues the aspirations of the previous one
+    group_df = worklist.groupby('group_number', sort=False).agg(step=('step', 'first'),
+                                                                liquid_class=('liquid_class', 'first'),
+                                                                n_liquid_class=('liquid_class', 'nunique'),
+                                                                user_class=('user_defined_liquid_class', 'first'),
+                                                                timer_group_check=('timer_group_check', 'first'))
+    same = (group_df['step'] == group_df['step'].shift()) & \
+           (group_df['liquid_class'] == group_df['liquid_class'].shift()) & \
+           (group_df['n_liquid_class'] == 1) & (group_df['n_liquid_class'].shift() == 1) & \
+           (group_df['timer_group_check'] == 0) & ~group_df['user_class'].isin(no_batch_class)
+    group_df['chain'] = (~same).cumsum()
+    worklist['chain'] = group_df.loc[worklist['group_number'], 'chain'].values
+
+    # capacity of the tip, in dispenses
+    capacity = np.where(worklist['volume_ul'] > 0,
+                        np.floor(worklist['tip_type'] / worklist['volume_ul'].where(worklist['volume_ul'] > 0, 1)),
+                        max_dispense)
+    capacity = np.clip(capacity, 1, max_dispense).astype(int)
+
+    source = (worklist['from_plate'].astype(str) + '_' + worklist['from_well'].astype(str)).values
+    aspiration = np.zeros(worklist.shape[0], dtype=int)
+    dispense_index = np.zeros(worklist.shape[0], dtype=int)
+    n_aspiration = 0
+    for index in worklist.groupby(['chain', 'channel'], sort=False).indices.values():
+        # rows of one channel in the order they are run
+        for i_previous, i in zip(np.concatenate([[-1], index[:-1]]), index):
+            if i_previous < 0 or source[i] != source[i_previous] or dispense_index[i_previous] >= capacity[i]:
+                n_aspiration = n_aspiration + 1
+                dispense_index[i] = 1
+            else:
+                dispense_index[i] = dispense_index[i_previous] + 1
+            aspiration[i] = n_aspiration
+
+    worklist['aspiration'] = aspiration
+    worklist['dispense_index'] = dispense_index
+    worklist['n_dispense'] = worklist.groupby('aspiration')['dispense_index'].transform('max')
+    worklist['aspirate'] = (worklist['dispense_index'] == 1).astype(int)
+    worklist['volume_aspirate'] = worklist.groupby('aspiration')['volume_ul'].transform('sum') * worklist['aspirate']
+    last = worklist['dispense_index'] == worklist['n_dispense']
+    worklist.loc[~last, 'dispense_type'] = worklist.loc[~last, 'dispense_type'].str.replace('Empty', 'Part')
+    worklist.loc[~last, 'liquid_class'] = get_liquid_class(worklist[~last])
+    return worklist.drop(['chain', 'aspiration'], axis=1)
+
+
 #############
 # major function
 #############
 
+@traced('make_worklist_one_run')
 def make_worklist_one_run(exp_input, delimiter_cell, delimiter_col,  # info about experiment input file
                           nrep, npergroup,  # experiment setup info not in the file
                           reverse_var,  # reverse the importance of the variables
@@ -371,10 +609,11 @@ def make_worklist_one_run(exp_input, delimiter_cell, delimiter_col,  # info abou
                           nzfill,  # shared deck parameter: how the hamilton software adds leading zeroes
                           assay_plate_prefix, nplate, nperplate, ncol, sort_by_col,  # destination setup
                           plate_df, output_prefix, export_intermediate,  # source setup
-                          time_df):
+                          time_df, engine='reference', multi_dispense=1, source_layout='alphabetical'):
     """
     make worklist for one run
-    :param exp_input: dataframe, experimental setup
+    :param exp_input: dataframe, experimental setup, or dictionary of them keyed by sub experiment name, to run these sub
+        experiments together on one deck, see combine_factorial
     :param delimiter_cell: delimiter to separate options of a variable
     :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
     :param nrep: number of replicates
@@ -392,16 +631,31 @@ def make_worklist_one_run(exp_input, delimiter_cell, delimiter_col,  # info abou
     :param output_prefix: prefix for output filenames
     :param export_intermediate: export intermediate file
     :param time_df: dataframe, time it takes to run steps
-    :return: dictionary of worklist and source dataframes
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param multi_dispense: maximum number of dispenses per aspiration, 1 to aspirate for each dispense, see
+        batch_dispense
+    :param source_layout: 'alphabetical' or 'optimized' placement of the sources in their wells, see assign_src
+    :return: dictionary of worklist, source, and intermediate dataframes, worklist_raw with the rows of distinct
+        conditions, see expand_replicates
     """
+    # usable volume of each well, also reported in source_real
+    plate_df = plate_df.copy()
+    plate_df['volume_usable'] = plate_df['volume_well'] - plate_df['volume_holdover']
+
     # protocol definition
     # full factorial worklist
-    factorial = get_worklist_full_factorial(exp_input=exp_input,
-                                            nrep=nrep,
-                                            npergroup=npergroup,
-                                            delimiter_cell=delimiter_cell,
-                                            delimiter_col=delimiter_col,
-                                            reverse_var=reverse_var)
+    factorial_input = {'nrep': nrep,
+                       'npergroup': npergroup,
+                       'delimiter_cell': delimiter_cell,
+                       'delimiter_col': delimiter_col,
+                       'reverse_var': reverse_var,
+                       'engine': engine}
+    if isinstance(exp_input, dict):
+        factorial = combine_factorial({name: get_worklist_full_factorial(exp_input=each, **factorial_input)
+                                       for name, each in exp_input.items()},
+                                      npergroup=npergroup, nperplate=nperplate, nplate=nplate)
+    else:
+        factorial = get_worklist_full_factorial(exp_input=exp_input, **factorial_input)
     worklist = factorial['worklist']
     worklist_raw = worklist.copy()
 
@@ -425,11 +679,15 @@ def make_worklist_one_run(exp_input, delimiter_cell, delimiter_col,  # info abou
     # source assignment
     source_out = assign_src(worklist=worklist,
                             plate_df=plate_df,
-                            nzfill=nzfill)
+                            nzfill=nzfill,
+                            source_layout=source_layout)
     
     worklist = source_out['worklist']
     source_df = source_out['source_df']
 
+    if multi_dispense > 1:
+        worklist = batch_dispense(worklist, multi_dispense)
+
     groupby_df = worklist.groupby(by=['from_plate', 'from_well'])
     groupby_v = groupby_df['volume_ul'].sum().reset_index()
     groupby_item = groupby_df['source'].unique().reset_index()
@@ -440,18 +698,36 @@ def make_worklist_one_run(exp_input, delimiter_cell, delimiter_col,  # info abou
     source_real = source_real.merge(plate_df, how='left')
     source_real['volume_user_input'] = source_real['volume_ul'] + source_real['volume_holdover']
 
+    out = {'worklist': worklist,
+           'source_df': source_df,
+           'source_real': source_real,
+           'exp_input': factorial['exp_input'],
+           'perm_df': factorial['perm_df'],
+           'worklist_raw': worklist_raw}
+
     if export_intermediate:
-        factorial['exp_input'].to_csv(output_prefix + 'exp_input_patched.csv', index=False)
-        factorial['perm_df'].to_csv(output_prefix + 'perm_df.csv', index=False)
-        worklist_raw.to_csv(output_prefix + 'worklist_raw.csv', index=False)
-        worklist.to_csv(output_prefix + 'worklist.csv', index=False)
-        source_df_out = source_df.copy()
-        source_df_out['volume_total'] = source_df_out['volume_ul'] + source_df_out['volume_holdover']
-        source_df_out = source_df_out.loc[:, ['source', 'volume_total', 'from_plate', 'from_well',
-                                              'step', 'step_index', 'volume_ul']]
-        source_df_out.to_csv(output_prefix + 'source.csv', index=False)
-        source_real.to_csv(output_prefix + 'source_real.csv', index=False)
+        export_worklist_one_run(out, output_prefix)
 
-    return {'worklist': worklist,
-            'source_df': source_df,
-            'source_real': source_real}
+    return out
+
+
+@traced('export')
+def export_worklist_one_run(run_out, output_prefix):
+    """
+    export the worklist and intermediate files of one run
+    :param run_out: dictionary, output of make_worklist_one_run
+    :param output_prefix: prefix for output filenames
+    :return: none
+    """
+    run_out['exp_input'].to_csv(output_prefix + 'exp_input_patched.csv', index=False)
+    run_out['perm_df'].to_csv(output_prefix + 'perm_df.csv', index=False)
+    worklist_raw = expand_replicates(run_out['worklist_raw'],
+                                     ['step_group_index', 'destination_group', 'step_index', 'destination'])
+    worklist_raw.to_csv(output_prefix + 'worklist_raw.csv', index=False)
+    run_out['worklist'].to_csv(output_prefix + 'worklist.csv', index=False)
+    source_df_out = run_out['source_df'].copy()
+    source_df_out['volume_total'] = source_df_out['volume_ul'] + source_df_out['volume_holdover']
+    source_df_out = source_df_out.loc[:, ['source', 'volume_total', 'from_plate', 'from_well',
+                                          'step', 'step_index', 'volume_ul']]
+    source_df_out.to_csv(output_prefix + 'source.csv', index=False)
+    run_out['source_real'].to_csv(output_prefix + 'source_real.csv', index=False)
@@ -0,0 +1,42 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# read-only dataframes shared by all tasks of a pool, set once per worker process
+shared = {}
+
+
+def init_shared(shared_input):
+    """
+    initialize the shared read-only inputs, used as the pool initializer
+    :param shared_input: dictionary of read-only inputs, such as plate_df and time_df
+    :return: none
+    """
+    shared.clear()
+    shared.update(shared_input)
+
+
+def call_shared(func_args):
+    """
+    call a function with the shared inputs of the current worker process
+    :param func_args: tuple of function and its argument
+    :return: output of the function
+    """
+    func, args = func_args
+    return func(args, shared)
+
+
+def map_jobs(func, args_list, jobs, shared_input):
+    """
+    apply a function to a list of arguments, serially or on a process pool
+    :param func: module level function taking one element of args_list and the dictionary of shared inputs
+    :param args_list: list of arguments
+    :param jobs: number of worker processes, 1 or less to run serially in the current process
+    :param shared_input: dictionary of read-only inputs, sent to each worker once
+    :return: list of outputs, in the same order as args_list
+    """
+    jobs = min(int(jobs), len(args_list))
+    if jobs <= 1:
+        return [func(each, shared_input) for each in args_list]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_shared, initargs=(shared_input,)) as executor:
+        out = list(executor.map(call_shared, [(func, each) for each in args_list]))
+    return out
@@ -0,0 +1,105 @@
+from tracer import traced, count
+import pandas as pd
+import numpy as np
+import os
+
+# seconds a group takes when its step is not in exp_time.csv
+default_group_s = 60
+
+
+def get_run_time(worklist, time_df, default_s=default_group_s):
+    """
+    predict how long the instrument takes to run a run worklist. groups run one after another in the order of
+    group_number, each taking the exp_time of its step; a group that waits on a timer starts no earlier than the
+    timer_delta of the group in timer_group_check after that group started, as in reorder_groups
+    :param worklist: run worklist, with step, group_number, timer_delta and timer_group_check
+    :param time_df: dataframe, time it takes to run steps
+    :param default_s: seconds a group takes when its step is not in time_df
+    :return: dictionary of groups, run_time_s, wait_s (time spent waiting on timers) and steps_unknown (number of steps
+        not in time_df)
+    """
+    group_df = worklist.groupby('group_number', sort=False).agg(step=('step', 'first'),
+                                                                timer_delta=('timer_delta', 'first'),
+                                                                timer_group_check=('timer_group_check', 'first'))
+    exp_time = dict(zip(time_df['step'], time_df['exp_time']))
+    start = {}
+    clock = 0
+    wait = 0
+    for group, row in group_df.iterrows():
+        begin = clock
+        check = int(row['timer_group_check'])
+        if check > 0 and check in start:
+            timer = group_df.loc[check, 'timer_delta']
+            begin = max(begin, start[check] + max(float(timer), 0))
+        wait = wait + begin - clock
+        start[group] = begin
+        clock = begin + float(exp_time.get(row['step'], default_s))
+    return {'groups': int(group_df.shape[0]),
+            'run_time_s': float(clock),
+            'wait_s': float(wait),
+            'steps_unknown': int(len(set(group_df['step']) - set(exp_time)))}
+
+
+def assign_robots(run_time, n_robot):
+    """
+    assign sub experiments to robots, longest first, each to the robot that is free the earliest
+    :param run_time: dictionary of predicted run time of each sub experiment, in seconds, keyed by name
+    :param n_robot: number of robots
+    :return: dataframe of robot (from 1), order on the robot (from 1), sub_exp, run_time_s, start_s and end_s, sorted by
+        robot and order
+    """
+    if n_robot < 1:
+        raise ValueError('n_robot must be at least 1, not ' + str(n_robot))
+    load = np.zeros(n_robot)
+    n_job = np.zeros(n_robot, dtype=int)
+    row_list = []
+    # sorted by name first so that ties do not depend on the order of the dictionary
+    for name in sorted(sorted(run_time), key=lambda each: -run_time[each]):
+        count('iterations')
+        robot = int(np.argmin(load))
+        n_job[robot] = n_job[robot] + 1
+        row_list = row_list + [[robot + 1, int(n_job[robot]), name, run_time[name], load[robot],
+                                load[robot] + run_time[name]]]
+        load[robot] = load[robot] + run_time[name]
+    plan = pd.DataFrame(row_list, columns=['robot', 'order', 'sub_exp', 'run_time_s', 'start_s', 'end_s'])
+    return plan.sort_values(['robot', 'order']).reset_index(drop=True)
+
+
+@traced('plan_robots')
+def plan_robots(run_out, time_df, n_robot):
+    """
+    distribute the sub experiments over several robots so that they all finish as early as possible, from the run time
+    of each predicted by get_run_time. making the solutions is not counted
+    :param run_out: dictionary of outputs of make_worklist_one_run, keyed by the output prefix of each sub experiment
+    :param time_df: dataframe, time it takes to run steps
+    :param n_robot: number of robots
+    :return: dataframe, one row per sub experiment, see assign_robots, with groups, wait_s, steps_unknown, and
+        completion_s, the time the robot it runs on finishes
+    """
+    # drop the trailing '_' of the output prefix
+    time_list = {name[:-1]: get_run_time(each['worklist'], time_df) for name, each in run_out.items()}
+    plan = assign_robots({name: each['run_time_s'] for name, each in time_list.items()}, n_robot)
+    for key in ['groups', 'wait_s', 'steps_unknown']:
+        plan[key] = plan['sub_exp'].map(lambda name: time_list[name][key])
+    plan['completion_s'] = plan.groupby('robot')['end_s'].transform('max')
+    count('makespan_s', float(plan['end_s'].max()) if plan.shape[0] > 0 else 0.0)
+    count('total_s', float(plan['run_time_s'].sum()))
+    return plan
+
+
+def export_robot_manifest(plan, n_robot, output_dir, prefix):
+    """
+    write one manifest per robot, listing the sub experiments it runs in order, e.g. factorial_experiment_robot1.csv.
+    robots without any sub experiment get an empty manifest
+    :param plan: output of plan_robots
+    :param n_robot: number of robots
+    :param output_dir: output directory
+    :param prefix: prefix for output filenames
+    :return: list of files written
+    """
+    file_list = []
+    for robot in range(1, n_robot + 1):
+        filename = os.path.join(output_dir, prefix + '_robot' + str(robot) + '.csv')
+        plan[plan['robot'] == robot].to_csv(filename, index=False)
+        file_list = file_list + [filename]
+    return file_list
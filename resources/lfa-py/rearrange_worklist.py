@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
+from tracer import traced, count
 
 
+@traced('reorder_groups')
 def reorder_groups(worklist, exp_time):
     """
     reorder the worklist to satisfy timing requirements
@@ -64,6 +66,7 @@ def reorder_groups(worklist, exp_time):
     current_group = time_worklist['group'].min()
 
     while time_worklist.shape[0] > 0:
+        count('iterations')
         sub = time_worklist[time_worklist['group'] == current_group]
         
         if sub.empty:
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import itertools
 import os
 
 
@@ -29,6 +30,121 @@ def get_perm_ind(n0, n1, nsub0, nsub1):
     return perm_ind
 
 
+def get_balanced_indices(n, nblock):
+    """
+    split indices of range(n) into nblock sublists whose sizes differ by 1 at most, the larger first
+    :param n: total number of indices
+    :param nblock: number of sublists
+    :return: list of list
+    """
+    size = np.full(nblock, n // nblock)
+    size[:n % nblock] += 1
+    edge = np.append(0, np.cumsum(size))
+    return [list(range(edge[i], edge[i + 1])) for i in range(nblock)]
+
+
+def get_balanced_nblock(n_list, n_strip, capacity):
+    """
+    choose the number of blocks to split the options of each variable into, so that every sub experiment fits on the
+    deck, in the fewest sub experiments, then with their sizes as close as possible. blocks of a variable differ by 1
+    option at most, see get_balanced_indices
+    :param n_list: number of options of each variable
+    :param n_strip: number of strips of each combination of options of these variables, replicates included
+    :param capacity: number of strips that fit on the deck
+    :return: list of numbers of blocks, one option per block if even that does not fit
+    """
+    # only the numbers of blocks that change the largest block matter
+    candidate_list = [sorted({int(np.ceil(n / size)) for size in range(1, n + 1)}) for n in n_list]
+    best = None
+    for nblock in itertools.product(*candidate_list):
+        largest = np.prod([np.ceil(n / k) for n, k in zip(n_list, nblock)]) * n_strip
+        if largest > capacity:
+            continue
+        smallest = np.prod([n // k for n, k in zip(n_list, nblock)]) * n_strip
+        key = (np.prod(nblock), largest - smallest)
+        if best is None or key < best[0]:
+            best = [key, list(nblock)]
+    if best is None:
+        return list(n_list)
+    return best[1]
+
+
+def get_cell_options(exp_input, coord, delimiter_cell, delimiter_col):
+    """
+    get the options of a cell of the experimental setup
+    :param exp_input: dataframe describing experimental setup
+    :param coord: coordinate of the cell
+    :param delimiter_cell: delimiter to separate options of a variable
+    :param delimiter_col: delimiter to separate row and col indices of the coordinate
+    :return: array of options
+    """
+    string = exp_input.iloc[tuple(np.array(coord.split(delimiter_col)).astype(int))]
+    return np.array(str(string).replace(' ', '').split(delimiter_cell))
+
+
+def get_sub_exp_split(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col, split='fixed',
+                      coord_extra='none', nsub_extra='none', nrep=1, nplate=1, nperplate=96):
+    """
+    choose how to split an experiment into sub experiments, by blocks of options of 2 or more variables
+    :param exp_input: dataframe describing experimental setup
+    :param coord0: coordinate of the primary variable
+    :param coord1: coordinate of the secondary variable
+    :param nsub0: sub-number of options for the primary variable
+    :param nsub1: sub-number of options for the secondary variable
+    :param delimiter_cell: delimiter to separate options of a variable
+    :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
+    :param split: 'fixed' to cut the options of each variable into blocks of nsub, with the remainders in the last
+        block, or 'balanced' to choose blocks that fill the deck in the fewest sub experiments, see get_balanced_nblock
+    :param coord_extra: coordinates of more variables to split, separated by delimiter_cell, 'none' for none
+    :param nsub_extra: sub-numbers of options of these variables, separated by delimiter_cell, for the fixed split
+    :param nrep: number of replicates
+    :param nplate: number of assay plates
+    :param nperplate: number of strips per assay plate
+    :return: tuple, list of coordinates, and list of the indices of the options of each variable in each sub
+        experiment
+    """
+    coord_list = [coord0, coord1]
+    nsub_list = [nsub0, nsub1]
+    if str(coord_extra).lower() != 'none':
+        coord_list = coord_list + str(coord_extra).replace(' ', '').split(delimiter_cell)
+        if split == 'fixed':
+            nsub_list = nsub_list + [int(each) for each in str(nsub_extra).replace(' ', '').split(delimiter_cell)]
+    n_list = [len(get_cell_options(exp_input, each, delimiter_cell, delimiter_col)) for each in coord_list]
+
+    if split == 'fixed':
+        ilist = [get_sub_indices(n, nsub) for n, nsub in zip(n_list, nsub_list)]
+    elif split == 'balanced':
+        # strips of each combination of options of the variables split, from the options of the other cells
+        n_strip = nrep
+        for irow, icol in itertools.product(range(exp_input.shape[0]), range(exp_input.shape[1])):
+            if delimiter_col.join([str(irow), str(icol)]) not in coord_list:
+                n_strip = n_strip * len(str(exp_input.iloc[irow, icol]).replace(' ', '').split(delimiter_cell))
+        nblock_list = get_balanced_nblock(n_list, n_strip, nplate * nperplate)
+        ilist = [get_balanced_indices(n, nblock) for n, nblock in zip(n_list, nblock_list)]
+    else:
+        raise ValueError('split must be fixed or balanced, not ' + str(split))
+
+    perm_ind = [list(each) for each in itertools.product(*ilist)]
+    return coord_list, perm_ind
+
+
+def iter_sub_exp_input(exp_input, coord_list, perm_ind, delimiter_cell, delimiter_col):
+    """
+    make the exp_input dataframes of sub experiments one at a time, so that only those used are made
+    :param exp_input: dataframe describing experimental setup
+    :param coord_list: list of coordinates of the variables split, see get_sub_exp_split
+    :param perm_ind: list of the indices of the options of each variable in each sub experiment
+    :param delimiter_cell: delimiter to separate options of a variable
+    :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
+    :return: generator of dataframes for subexperiments
+    """
+    option_list = [get_cell_options(exp_input, each, delimiter_cell, delimiter_col) for each in coord_list]
+    for each in perm_ind:
+        option_row = pd.Series([delimiter_cell.join(option[index]) for option, index in zip(option_list, each)],
+                               index=coord_list)
+        yield get_sub_exp_input(exp_input, option_row, delimiter_col)
+
+
 def get_option_df(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col):
     """
     get options based on experimental setup, split into sub experiments
@@ -69,7 +185,8 @@ def get_sub_exp_input(exp_input, option_row, delimiter_col):
     return out
 
 
-def get_sub_exp_input_list(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col):
+def get_sub_exp_input_list(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col,
+                           **split_input):
     """
     get list of dataframes for subexperiments
     :param exp_input: dataframe describing experimental setup
@@ -79,31 +196,68 @@ def get_sub_exp_input_list(exp_input, coord0, coord1, nsub0, nsub1, delimiter_ce
     :param nsub1: sub-number of options for the secondary variable
     :param delimiter_cell: delimiter to separate options of a variable
     :param delimiter_col: delimiter to separate row and col indices of the coordinate, to use in column name of options
+    :param split_input: split, coord_extra, nsub_extra, nrep, nplate and nperplate, see get_sub_exp_split
     :return: list of dataframes for subexperiments
     """
-    option_df = get_option_df(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col)
-    sub_exp_input_list = [get_sub_exp_input(exp_input, option_df.iloc[i, :], delimiter_col)
-                          for i in range(option_df.shape[0])]
-    return sub_exp_input_list
+    coord_list, perm_ind = get_sub_exp_split(exp_input, coord0, coord1, nsub0, nsub1, delimiter_cell, delimiter_col,
+                                             **split_input)
+    return list(iter_sub_exp_input(exp_input, coord_list, perm_ind, delimiter_cell, delimiter_col))
 
 
-def write_sub_exp_input_list(sub_exp_input_list, output_dir, prefix):
+def get_sub_exp_names(nsub_exp, prefix):
+    """
+    get names of sub experiments, with leading zeros so that they sort in order
+    :param nsub_exp: number of sub experiments
+    :param prefix: prefix of names
+    :return: list of names
+    """
+    nzfill = len(str(nsub_exp))
+    return [prefix + str(i).zfill(nzfill) for i in range(nsub_exp)]
+
+
+def get_sub_exp_index(nsub_exp, sub_exp):
+    """
+    get indices of selected sub experiments
+    :param nsub_exp: number of sub experiments
+    :param sub_exp: 'all', 'first', or indices separated by commas, such as '0,2'
+    :return: list of indices
+    """
+    if str(sub_exp).lower() == 'all':
+        return list(range(nsub_exp))
+    if str(sub_exp).lower() == 'first':
+        return [0]
+
+    index_list = [int(each) for each in str(sub_exp).split(',')]
+    out_of_range = [each for each in index_list if each < 0 or each >= nsub_exp]
+    if len(out_of_range) > 0:
+        raise ValueError('sub experiment index out of range: ' + ','.join(map(str, out_of_range)) +
+                         ', there are ' + str(nsub_exp) + ' sub experiments')
+    return sorted(set(index_list))
+
+
+def write_sub_exp_input_list(sub_exp_input_list, output_dir, prefix, index_list=None, nsub_exp=None):
     """
     write sub experimental setup dataframes
-    :param sub_exp_input_list: list of sub experimental setup dataframes
+    :param sub_exp_input_list: list of sub experimental setup dataframes, or dictionary keyed by their indices
     :param output_dir: output directory
     :param prefix: prefix of filenames
+    :param index_list: indices of sub experiments to write, all by default
+    :param nsub_exp: number of sub experiments, to name them, len(sub_exp_input_list) by default
     :return: list of paths
     """
     if not os.path.isdir(output_dir):
         os.mkdir(output_dir)
 
-    nzfill = len(str(len(sub_exp_input_list)))
-
     path_list = []
 
-    for i, each in enumerate(sub_exp_input_list):
-        filename = os.path.join(output_dir, prefix + str(i).zfill(nzfill) + '.csv')
+    if nsub_exp is None:
+        nsub_exp = len(sub_exp_input_list)
+    names = get_sub_exp_names(nsub_exp, prefix)
+    if index_list is None:
+        index_list = range(len(sub_exp_input_list))
+
+    for name, each in [[names[i], sub_exp_input_list[i]] for i in index_list]:
+        filename = os.path.join(output_dir, name + '.csv')
         each.to_csv(filename, index=False)
         path_list = path_list + [filename]
 
@@ -0,0 +1,94 @@
+import pandas as pd
+import numpy as np
+
+# cycled through the steps of synthetic experiments, volumes cover each tip size
+step_volume = [1, 3, 5, 20, 75]
+step_liquid_class = ['water', 'pbst']
+
+
+def get_synthetic_exp_input(n_step=3, n_option=4, n_var=2, delimiter_cell=','):
+    """
+    make a factorial experiment input, in the format of input_experiment/factorial_experiment.csv
+    :param n_step: number of liquid transfer steps, an imaging step is added after them
+    :param n_option: number of options (solutions) of each variable
+    :param n_var: number of steps with n_option options, the first ones, the other steps have one option
+    :param delimiter_cell: delimiter to separate options in the source column
+    :return: dataframe, experiment input
+    """
+    n_var = min(n_var, n_step)
+    source = []
+    for i in range(n_step):
+        n = n_option if i < n_var else 1
+        source = source + [(delimiter_cell + ' ').join(['sol_' + str(i) + '_' + str(j) for j in range(n)])]
+
+    exp_input = pd.DataFrame({'step': ['Step' + str(i + 1) for i in range(n_step + 1)],
+                              'dx': 3,
+                              'dz': 5,
+                              'volume': [step_volume[i % len(step_volume)] for i in range(n_step)] + [5],
+                              'liquid_class': [step_liquid_class[i % len(step_liquid_class)] for i in range(n_step)] +
+                                              ['imaging'],
+                              'time': [2 * (i + 1) for i in range(n_step + 1)],
+                              'source': source + ['camera']})
+    return exp_input
+
+
+def get_synthetic_sol_df(exp_input, diluent='water', n_stock=4, n_library=0, delimiter_cell=','):
+    """
+    make a solution library, in the format of get_sol_df. each solution of the experiment is a dilution of one stock
+    :param exp_input: dataframe, experiment input, from get_synthetic_exp_input
+    :param diluent: diluent
+    :param n_stock: number of stock solutions
+    :param n_library: number of solutions added to the library that the experiment does not use
+    :param delimiter_cell: delimiter to separate options in the source column
+    :return: dataframe of solutions, indexed by solution, with the concentration of each stock as columns
+    """
+    solution_list = [each.strip() for cell in exp_input['source'] for each in cell.split(delimiter_cell)]
+    solution_list = [each for each in pd.unique(pd.Series(solution_list)) if each != 'camera']
+    solution_list = solution_list + ['unused_' + str(i) for i in range(n_library)]
+    stock_list = ['stock_' + str(i) for i in range(n_stock)]
+
+    sol_df = pd.DataFrame(0.0, index=solution_list + stock_list + [diluent], columns=stock_list + [diluent])
+    for i, each in enumerate(solution_list):
+        # different dilutions of the same stock
+        sol_df.loc[each, stock_list[i % n_stock]] = 1 / (2 + i // n_stock)
+    for each in stock_list + [diluent]:
+        sol_df.loc[each, each] = 1.0
+    return sol_df
+
+
+def get_synthetic_config(n_step=3, n_option=4, n_var=2, nrep=4, nperplate=96, ncol=6, n_stock=4, n_library=0,
+                         plate_df=None, nsub=None):
+    """
+    make the settings of a synthetic factorial experiment, to use with api.generate
+    :param n_step: number of liquid transfer steps
+    :param n_option: number of options of each variable
+    :param n_var: number of variables, steps with n_option options
+    :param nrep: number of replicates
+    :param nperplate: number of strips per assay plate
+    :param ncol: number of columns of strips on each assay plate
+    :param n_stock: number of stock solutions
+    :param n_library: number of solutions in the library that the experiment does not use
+    :param plate_df: dataframe, plates on the instrument, those of input_master.csv if None
+    :param nsub: number of options of the first two variables in each sub experiment, n_option (one sub experiment)
+        if None
+    :return: dictionary of settings and input dataframes
+    """
+    nsub = n_option if nsub is None else nsub
+    exp_input = get_synthetic_exp_input(n_step=n_step, n_option=n_option, n_var=n_var)
+    # strips of the largest sub experiment
+    n_strip = min(nsub, n_option) ** min(n_var, 2) * n_option ** max(n_var - 2, 0) * nrep
+
+    config = {'exp_input': exp_input,
+              'sol_df': get_synthetic_sol_df(exp_input, n_stock=n_stock, n_library=n_library),
+              'coord0': '0_6',
+              'coord1': '1_6',
+              'nsub0': nsub if n_var > 0 else 1,
+              'nsub1': nsub if n_var > 1 else 1,
+              'nrep': nrep,
+              'nperplate': nperplate,
+              'ncol': ncol,
+              'nplate': int(np.ceil(n_strip / nperplate)),
+              'prefix': 'synthetic_experiment'}
+    if plate_df is not None:
+        config['plate_df'] = plate_df
+    return config
@@ -11,6 +11,7 @@ worklist_data = [
         'dz': 0.2,
         'volume_ul': 1,
         'liquid_class': 'water',
+        'user_defined_liquid_class': 'water',
         'time': -1,
         'source': 'CS031',
         'step_index': 1,
@@ -30,6 +31,7 @@ worklist_data = [
         'dz': 1.0,
         'volume_ul': 75,
         'liquid_class': 'pbst',
+        'user_defined_liquid_class': 'pbst',
         'time': 1200,
         'source': 'ABI-131-N1',
         'step_index': 2,
@@ -49,6 +51,7 @@ worklist_data = [
         'dz': 0,
         'volume_ul': 0,
         'liquid_class': '',
+        'user_defined_liquid_class': 'imaging',
         'time': 0,
         'source': 'image',
         'step_index': 3,
@@ -0,0 +1,91 @@
+import pandas as pd
+import contextlib
+import pytest
+import sys
+from api import generate, read_config
+from one_run import batch_dispense, get_liquid_class
+from util import get_tip_count, get_tip_count_fast
+
+plate = 'ivl_384_flat_v1_0001'
+
+
+def get_group_worklist(group_list):
+    """
+    make a worklist after assign_src, one group after another in the order they are run
+    :param group_list: list of groups, each a dictionary of step, n (rows), volume_ul, from_well, tip_type and
+        timer_group_check
+    :return: worklist
+    """
+    row_list = []
+    for group_number, group in enumerate(group_list, start=1):
+        for i in range(group['n']):
+            row_list = row_list + [[group.get('step', 'Step1'), group_number, group.get('timer_group_check', 0),
+                                    group['volume_ul'], group.get('tip_type', 50), plate, group.get('from_well', 1),
+                                    group.get('user_defined_liquid_class', 'water')]]
+    worklist = pd.DataFrame(row_list, columns=['step', 'group_number', 'timer_group_check', 'volume_ul', 'tip_type',
+                                               'from_plate', 'from_well', 'user_defined_liquid_class'])
+    worklist['dispense_type'] = 'Jet_Empty'
+    worklist['liquid_class'] = get_liquid_class(worklist)
+    return worklist
+
+
+def test_capacity_of_the_tip():
+    # 20 ul into 50 ul tips, 2 dispenses per aspiration even if 4 are allowed
+    worklist = get_group_worklist([{'n': 8, 'volume_ul': 20.0}] * 5)
+    batched = batch_dispense(worklist, 4)
+    assert batched['n_dispense'].max() == 2
+    assert (batched['volume_aspirate'] <= batched['tip_type']).all()
+    assert batched['aspirate'].sum() == 8 * 3
+    # a channel aspirates for groups 1, 3 and 5
+    assert batched.loc[batched['aspirate'] == 1, 'group_number'].unique().tolist() == [1, 3, 5]
+    assert batched.loc[batched['aspirate'] == 1, 'volume_aspirate'].tolist() == [40.0] * 16 + [20.0] * 8
+
+
+@pytest.mark.parametrize('second, n_aspirate', [
+    ({}, 8),
+    # a group waiting on a timer starts new aspirations
+    ({'timer_group_check': 1}, 16),
+    # so does another step, liquid class or source well
+    ({'step': 'Step2'}, 16),
+    ({'user_defined_liquid_class': 'pbst'}, 16),
+    ({'from_well': 2}, 16),
+    # imaging is never batched
+    ({'user_defined_liquid_class': 'imaging'}, 16)])
+def test_chain_breaks(second, n_aspirate):
+    worklist = get_group_worklist([{'n': 8, 'volume_ul': 5.0}, dict({'n': 8, 'volume_ul': 5.0}, **second)])
+    batched = batch_dispense(worklist, 4)
+    assert batched['aspirate'].sum() == n_aspirate
+    # rows, groups and volumes are unchanged
+    assert batched[worklist.columns.drop(['dispense_type', 'liquid_class'])].equals(
+        worklist.drop(['dispense_type', 'liquid_class'], axis=1))
+
+
+def test_partial_dispenses_match_liquid_class():
+    worklist = get_group_worklist([{'n': 8, 'volume_ul': 5.0}] * 3 + [{'n': 3, 'volume_ul': 5.0}])
+    batched = batch_dispense(worklist, 4)
+    last = batched['dispense_index'] == batched['n_dispense']
+    assert (batched.loc[last, 'dispense_type'] == 'Jet_Empty').all()
+    assert (batched.loc[~last, 'dispense_type'] == 'Jet_Part').all()
+    assert (batched['liquid_class'] == get_liquid_class(batched)).all()
+    assert batched.loc[~last, 'liquid_class'].unique().tolist() == ['ivl_tip50_water_JetPart']
+
+
+def test_tip_count_after_batching():
+    worklist = get_group_worklist([{'n': 8, 'volume_ul': 5.0}] * 3 + [{'n': 3, 'volume_ul': 5.0}] +
+                                  [{'n': 8, 'volume_ul': 100.0, 'tip_type': 300, 'step': 'Step2'}] * 2)
+    batched = batch_dispense(worklist, 4)
+    for each in [get_tip_count, get_tip_count_fast]:
+        tip_count = each(batched)
+        # one tip per aspiration: 8 channels for the 4 groups of step 1, then 8 channels for the 2 groups of step 2
+        assert dict(zip(tip_count['tip'], tip_count['count'])) == {'tip_50_full': 8, 'tip_300_full': 8}
+        assert tip_count['count'].sum() == batched['aspirate'].sum()
+
+
+def test_batched_example_keeps_transfers():
+    with contextlib.redirect_stdout(sys.stderr):
+        config = dict(read_config(), sub_exp='first', jobs=1, cache_dir='none', result_cache_dir='none')
+        single = generate(dict(config, multi_dispense=1))['factorial_experiment0']
+        batched = generate(dict(config, multi_dispense=4))['factorial_experiment0']
+    column_list = ['step', 'volume_ul', 'source', 'group_number', 'to_plate', 'to_well']
+    assert batched['worklist'][column_list].equals(single['worklist'][column_list])
+    assert batched['user_tip']['count'].sum() < single['user_tip']['count'].sum()
@@ -0,0 +1,56 @@
+import pandas as pd
+import contextlib
+import pytest
+import sys
+import os
+from api import generate, read_config, default_dir
+from main import load_inputs
+from estimate import estimate, check_feasibility
+
+exp_input = pd.read_csv(os.path.join(default_dir, 'input_experiment', 'factorial_experiment.csv'))
+exp_input['volume'] = exp_input['volume'].astype(str)
+
+
+def get_varied_volume_input(volume):
+    """
+    make the example experiment with options listed in the volume cell of its first step
+    :param volume: volume cell, such as '1, 2'
+    :return: dataframe, experimental setup
+    """
+    out = exp_input.copy()
+    out.loc[0, 'volume'] = volume
+    return out
+
+
+def test_varied_volume_fits():
+    config = dict(read_config(), exp_input=get_varied_volume_input('1, 2'), nplate=2, sub_exp='first')
+    out = estimate(load_inputs(config))
+    assert out['feasible']
+    # the volumes are varied like any other variable, doubling the strips of each sub experiment
+    assert out['sub_exp']['factorial_experiment0']['destinations'] == \
+        2 * estimate(load_inputs(dict(config, exp_input=exp_input)))['sub_exp']['factorial_experiment0']['destinations']
+
+    # the check is on by default and lets the experiment through
+    with contextlib.redirect_stdout(sys.stderr):
+        made = generate(dict(config, jobs=1, cache_dir='none', result_cache_dir='none'))
+    assert list(made) == ['factorial_experiment0']
+
+
+def test_varied_volume_over_largest_tip():
+    out = estimate(load_inputs(dict(read_config(), exp_input=get_varied_volume_input('1, 2000'), nplate=2)))
+    assert not out['feasible']
+    assert any(['Step1 transfers 2000.0 ul, more than the largest tip' in each for each in out['problems']])
+
+
+def test_combined_runs_count_assay_plates():
+    config = dict(read_config(), combine_run=2, nplate=1)
+    # each sub experiment fits alone, but the combined run needs one assay plate for each
+    with pytest.raises(ValueError, match='factorial_experiment_combined0: 2 sub experiments need 2 assay plates'):
+        check_feasibility(load_inputs(config))
+
+    out = estimate(load_inputs(dict(config, nplate=2)))
+    assert out['feasible']
+    assert out['combined']['factorial_experiment_combined0']['sub_exp'] == ['factorial_experiment0',
+                                                                          'factorial_experiment1']
+    assert out['combined']['factorial_experiment_combined0']['assay_plates'] == 2
+    assert estimate(load_inputs(dict(config, combine_run=1)))['combined'] == {}
@@ -0,0 +1,81 @@
+import pandas as pd
+import contextlib
+import sys
+from api import generate
+from synthetic import get_synthetic_config
+from util import pack_partial_groups, add_plate_well_columns
+
+reservoir = 'ivl_1_flat_v1_0001'
+plate = 'ivl_384_flat_v1_0001'
+assay = 'IVL_Plate_v3_96cassettes_ABformat_0001'
+
+# groups making a dilution series, each using few channels: diluent from the reservoir, a stock into well 1, then
+# well 1 diluted into well 2 and well 2 into well 5, which the assay aspirates from
+group_rows = [[1, 'water', reservoir, 1, plate, 1],
+              [1, 'water', reservoir, 1, plate, 2],
+              [2, 'stock', plate, 10, plate, 1],
+              [3, 'water', reservoir, 1, plate, 3],
+              [3, 'water', reservoir, 1, plate, 4],
+              [4, 'water', plate, 1, plate, 2],
+              [5, 'water', reservoir, 1, plate, 5],
+              [6, 'water', plate, 2, plate, 5],
+              [6, 'water', plate, 3, plate, 6],
+              [7, 'pbst', plate, 5, assay, 1],
+              [7, 'pbst', plate, 6, assay, 2],
+              [8, 'imaging', assay, 1, assay, 1]]
+
+
+def get_dependent_worklist():
+    """
+    make a full worklist of partial groups that depend on each other through the wells they fill and aspirate from
+    :return: worklist
+    """
+    worklist = pd.DataFrame(group_rows, columns=['group_number', 'liquid_class', 'from_plate', 'from_well', 'to_plate',
+                                                 'to_well'])
+    worklist['step'] = 'solution'
+    worklist.loc[worklist['to_plate'] == assay, 'step'] = 'assay'
+    worklist['volume_ul'] = 10.0
+    worklist['timer_group_check'] = 0
+    worklist.loc[worklist['group_number'] == 8, 'timer_group_check'] = 7
+    return worklist
+
+
+def check_filled_first(worklist):
+    """
+    check that every well is filled in groups that run before the first group aspirating from it
+    :param worklist: full worklist, in the order it is run
+    """
+    worklist = add_plate_well_columns(worklist.reset_index(drop=True))
+    order = {group: i for i, group in enumerate(pd.unique(worklist['group_number']))}
+    position = worklist['group_number'].map(order)
+    last_fill = position.groupby(worklist['to_plate_well']).max()
+    first_use = position.groupby(worklist['from_plate_well']).min()
+    for well, first in first_use.items():
+        if well in last_fill.index and not well.startswith(assay):
+            assert last_fill[well] < first, well
+
+
+def test_pack_keeps_dependencies():
+    worklist = get_dependent_worklist()
+    check_filled_first(worklist)
+    packed = pack_partial_groups(worklist, keep_tag='IVL_Plate_', reservoir_tag='ivl_1')
+    check_filled_first(packed)
+    # group 3 joins group 1, group 5 joins group 4, the stock, group 6 and the assay stay alone
+    assert packed['group_number'].nunique() == 6
+    assert packed.shape[0] == worklist.shape[0]
+    # the assay groups keep their order and their timer
+    assert list(packed.loc[packed['step'] == 'assay', 'group_number'].unique()) == [5, 6]
+    assert packed.loc[packed['group_number'] == 6, 'timer_group_check'].tolist() == [5]
+
+
+def test_pack_synthetic_fills_first():
+    config = get_synthetic_config(n_step=3, n_option=4, n_var=2, nrep=2, n_stock=4)
+    n_group = []
+    for pack_groups in [0, 1]:
+        with contextlib.redirect_stdout(sys.stderr):
+            out = generate(dict(config, pack_groups=pack_groups, sub_exp='first', jobs=1, cache_dir='none',
+                                result_cache_dir='none'))
+        for each in out.values():
+            check_filled_first(each['worklist'])
+        n_group = n_group + [sum([each['worklist']['group_number'].nunique() for each in out.values()])]
+    assert n_group[1] < n_group[0]
@@ -0,0 +1,73 @@
+import pandas as pd
+import numpy as np
+import itertools
+import pytest
+from split_input import get_balanced_nblock, get_balanced_indices, get_sub_exp_split
+
+
+# numbers of options of the variables split, strips of each combination of options, strips that fit on the deck
+balanced_cases = [([7], 3, 96), ([20, 9], 4, 96), ([13, 5], 2, 192), ([6, 6, 4], 1, 40), ([12, 11], 1, 96),
+                  ([5, 3], 8, 96), ([9, 2, 7], 3, 384)]
+
+
+def get_block_size(n_list, nblock):
+    """
+    get the numbers of strips of the largest and the smallest sub experiment
+    :param n_list: number of options of each variable
+    :param nblock: number of blocks of each variable
+    :return: tuple of the largest and the smallest sizes, in combinations of options
+    """
+    size_list = [[len(each) for each in get_balanced_indices(n, k)] for n, k in zip(n_list, nblock)]
+    return np.prod([max(each) for each in size_list]), np.prod([min(each) for each in size_list])
+
+
+@pytest.mark.parametrize('n_list, n_strip, capacity', balanced_cases)
+def test_balanced_blocks_fit_deck(n_list, n_strip, capacity):
+    nblock = get_balanced_nblock(n_list, n_strip, capacity)
+    assert len(nblock) == len(n_list)
+    largest, _ = get_block_size(n_list, nblock)
+    assert largest * n_strip <= capacity
+
+
+@pytest.mark.parametrize('n_list, n_strip, capacity', balanced_cases)
+def test_balanced_fewest_sub_exp(n_list, n_strip, capacity):
+    nblock = get_balanced_nblock(n_list, n_strip, capacity)
+    # every number of blocks of every variable that fits the deck
+    fit_list = [each for each in itertools.product(*[range(1, n + 1) for n in n_list])
+                if get_block_size(n_list, each)[0] * n_strip <= capacity]
+    fewest = min([np.prod(each) for each in fit_list])
+    assert np.prod(nblock) == fewest
+    # among those, the sub experiments are the closest in size
+    spread = [np.subtract(*get_block_size(n_list, each)) for each in fit_list if np.prod(each) == fewest]
+    assert np.subtract(*get_block_size(n_list, nblock)) == min(spread)
+
+
+@pytest.mark.parametrize('n, nblock', [(7, 1), (7, 3), (12, 5), (5, 5), (100, 7)])
+def test_balanced_block_sizes(n, nblock):
+    index_list = get_balanced_indices(n, nblock)
+    size = [len(each) for each in index_list]
+    assert len(index_list) == nblock
+    assert max(size) - min(size) <= 1
+    assert size == sorted(size, reverse=True)
+    assert sum(index_list, []) == list(range(n))
+
+
+def test_balanced_oversized_one_option_per_block():
+    # a single combination of options does not fit on the deck
+    assert get_balanced_nblock([4, 3], 100, 96) == [4, 3]
+    assert get_balanced_nblock([5], 97, 96) == [5]
+
+
+def test_balanced_coord_extra_splits_n_dimensions():
+    # 3 variables of 6, 5 and 4 options split, 2 options in the cell not split, 2 replicates: 4 strips each
+    exp_input = pd.DataFrame([['a0,a1,a2,a3,a4,a5', 'b0,b1,b2,b3,b4'], ['c0,c1,c2,c3', 'd0,d1']])
+    coord_list, perm_ind = get_sub_exp_split(exp_input, '0_0', '0_1', 'none', 'none', ',', '_', split='balanced',
+                                             coord_extra='1_0', nrep=2, nplate=1, nperplate=96)
+    assert coord_list == ['0_0', '0_1', '1_0']
+    assert all([len(each) == 3 for each in perm_ind])
+    # every combination of options is in exactly one sub experiment, each fitting the deck
+    combination = [each for index in perm_ind for each in itertools.product(*index)]
+    assert sorted(combination) == list(itertools.product(range(6), range(5), range(4)))
+    size = [np.prod([len(each) for each in index]) * 4 for index in perm_ind]
+    assert max(size) <= 96
+    assert len(perm_ind) == np.prod(get_balanced_nblock([6, 5, 4], 4, 96)) == 5
@@ -0,0 +1,83 @@
+import pandas as pd
+import contextlib
+import pytest
+import sys
+from api import generate
+from synthetic import get_synthetic_config
+from util import get_tip_count
+
+# synthetic experiments making solutions on the deck, with dilution series from stocks
+sizes = [{'n_step': 3, 'n_option': 4, 'n_var': 2, 'nrep': 2, 'n_stock': 4},
+         {'n_step': 4, 'n_option': 3, 'n_var': 3, 'nrep': 1, 'n_stock': 2},
+         {'n_step': 2, 'n_option': 5, 'n_var': 1, 'nrep': 3, 'n_stock': 5}]
+
+
+def make_full_worklists(config):
+    """
+    make the full worklists of an experiment in memory
+    :param config: settings, see api.generate
+    :return: dictionary of outputs of full_from_run_worklist, keyed by the name of each sub experiment
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        return generate(dict(config, jobs=1, cache_dir='none', result_cache_dir='none'))
+
+
+def get_tip_list(worklist):
+    """
+    follow the tip of each channel through a full worklist with tip_pickup, in the order it is run
+    :param worklist: full worklist
+    :return: list of tips, each a list of (source, destination, dispense_type, index) of the transfers it does
+    """
+    worklist = worklist.reset_index(drop=True)
+    channel = worklist.groupby('group_number', sort=False).cumcount() + 1
+    held = {}
+    tip_list = []
+    for i, row in worklist.iterrows():
+        if row['tip_pickup'] == 1 or channel[i] not in held:
+            held[channel[i]] = []
+            tip_list = tip_list + [held[channel[i]]]
+        held[channel[i]].append((row['from_plate'] + '|' + str(row['from_well']),
+                                 row['to_plate'] + '|' + str(row['to_well']), row['dispense_type'], i))
+    return tip_list
+
+
+@pytest.fixture(scope='module', params=range(len(sizes)))
+def reused(request):
+    return make_full_worklists(dict(get_synthetic_config(**sizes[request.param]), tip_reuse=1, sub_exp='first'))
+
+
+def test_tip_never_changes_solution(reused):
+    for each in reused.values():
+        tip_list = get_tip_list(each['worklist'])
+        assert len(tip_list) < each['worklist'].shape[0]
+        for tip in tip_list:
+            assert len(set([source for source, _, _, _ in tip])) == 1
+
+
+def test_tip_not_reused_after_touching_liquid(reused):
+    for each in reused.values():
+        worklist = each['worklist'].reset_index(drop=True)
+        destination = (worklist['to_plate'] + '|' + worklist['to_well'].astype(str)).values
+        source = (worklist['from_plate'] + '|' + worklist['from_well'].astype(str)).values
+        for tip in get_tip_list(worklist):
+            # every transfer but the last is followed by another aspiration with the same tip
+            for _, to, dispense_type, i in tip[:-1]:
+                filled_before = to in destination[:i]
+                aspirated_later = to in source[i + 1:]
+                assert 'Jet' in dispense_type or not (filled_before or aspirated_later)
+
+
+def test_tip_count_matches_pickups(reused):
+    for each in reused.values():
+        worklist = each['worklist']
+        picked = worklist[worklist['tip_pickup'] == 1]
+        expected = {}
+        for _, group in picked.groupby('group_number'):
+            tip_type = group['tip_type'].values[0]
+            if tip_type > 0:
+                key = 'tip_' + str(tip_type) + '_' + ('partial' if group.shape[0] < 8 else 'full')
+                expected[key] = expected.get(key, 0) + group.shape[0]
+        assert dict(zip(each['user_tip']['tip'], each['user_tip']['count'])) == expected
+        assert get_tip_count(worklist)['count'].sum() == picked[picked['tip_type'] > 0].shape[0]
+        # a tip is ejected once for each pickup
+        assert worklist['tip_eject'].sum() == worklist['tip_pickup'].sum()
@@ -0,0 +1,98 @@
+import pandas as pd
+import contextlib
+import pytest
+import sys
+import os
+from api import generate
+from synthetic import get_synthetic_config
+from util import assign_plate_well, pack_plate_well, split_source_well, plate_cost_ul
+
+plate_df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_instrument',
+                                    'reagent_plates.csv'))
+
+
+def get_well_volume(worklist, well_df, colname):
+    """
+    get the volume taken from each well and the volume the user puts in it, with its holdover
+    :param worklist: worklist with colname and volume_ul
+    :param well_df: output of assign_plate_well or pack_plate_well
+    :param colname: column name of the solution
+    :return: dataframe, one row per well
+    """
+    volume = worklist.groupby(colname)['volume_ul'].sum().reset_index().merge(well_df)
+    volume = volume.merge(plate_df, how='left')
+    volume['volume_user'] = volume['volume_ul'] + volume['volume_holdover']
+    return volume
+
+
+def test_pack_moves_few_wells_to_save_a_plate():
+    # 3 solutions small enough for the 384 well plate, 5 that need deep wells
+    worklist = pd.DataFrame({'source': ['a', 'b', 'c'] + ['d', 'e', 'f', 'g', 'h'],
+                             'volume_ul': [30.0, 30.0, 45.0] + [500.0, 500.0, 700.0, 900.0, 940.0]})
+    smallest = get_well_volume(worklist, assign_plate_well(worklist, plate_df, 'source'), 'source')
+    packed = get_well_volume(worklist, pack_plate_well(worklist, plate_df, 'source'), 'source')
+
+    assert sorted(smallest['plate'].unique()) == ['ivl_384_flat_v1', 'ivl_96_dw_v1']
+    # the 3 small wells join the deep well plate: 3 * 20 ul more holdover, one plate less
+    assert list(packed['plate'].unique()) == ['ivl_96_dw_v1']
+    assert sorted(packed['well_number']) == list(range(1, 9))
+    assert (packed['plate_number'] == 1).all()
+    assert packed['volume_holdover'].sum() == smallest['volume_holdover'].sum() + 3 * 20
+    assert packed['volume_holdover'].sum() + plate_cost_ul < smallest['volume_holdover'].sum() + 2 * plate_cost_ul
+    # every well keeps its dead volume
+    assert (packed['volume_user'] <= packed['volume_well']).all()
+    assert packed.set_index('source')['volume_user'].to_dict() == {'a': 90, 'b': 90, 'c': 105, 'd': 560, 'e': 560,
+                                                                   'f': 760, 'g': 960, 'h': 1000}
+
+
+def test_pack_keeps_plates_that_are_full_enough():
+    # enough small wells that moving them costs more holdover than the plate they would save
+    worklist = pd.DataFrame({'source': ['s' + str(i) for i in range(12)] + ['d'],
+                             'volume_ul': [30.0] * 12 + [500.0]})
+    smallest = assign_plate_well(worklist, plate_df, 'source')
+    packed = pack_plate_well(worklist, plate_df, 'source')
+    assert packed.sort_values('source').reset_index(drop=True).equals(
+        smallest.sort_values('source').reset_index(drop=True))
+
+
+@pytest.mark.parametrize('volume, n_well, well_volume', [
+    # 2000 ul would need the reservoir, 800 ul of holdover, it fits in 3 deep wells of 60 ul each
+    ([600.0, 600.0, 500.0, 300.0], 3, [900.0, 600.0, 500.0]),
+    # fits in one deep well, not split
+    ([300.0, 300.0, 200.0], 1, [800.0]),
+    # transfers of a full 1000 ul tip do not fit in a deep well, they stay in the reservoir
+    ([1000.0, 1000.0], 1, [2000.0])])
+def test_split_source_well(volume, n_well, well_volume):
+    worklist = pd.DataFrame({'source': 'water', 'volume_ul': volume})
+    split = split_source_well(worklist, plate_df, 'source')
+    volume_df = split.groupby('source_well')['volume_ul'].sum().sort_values(ascending=False)
+    assert volume_df.shape[0] == n_well
+    assert list(volume_df.values) == well_volume
+    # transfers are not split
+    assert split['volume_ul'].tolist() == volume
+
+    # each well keeps its dead volume in the plate it is put in
+    well_df = assign_plate_well(split, plate_df, 'source_well')
+    volume_df = get_well_volume(split, well_df, 'source_well')
+    assert (volume_df['volume_user'] <= volume_df['volume_well']).all()
+    if n_well > 1:
+        assert (volume_df['plate'] == 'ivl_96_dw_v1').all()
+        assert (volume_df['volume_user'] - volume_df['volume_ul'] == 60).all()
+
+
+def test_well_packing_returned_with_full_outputs():
+    config = dict(get_synthetic_config(n_step=4, n_option=3, n_var=1, nrep=1, nsub=3, n_stock=4, n_library=16),
+                  sub_exp='first', jobs=1, cache_dir='none', result_cache_dir='none')
+    with contextlib.redirect_stdout(sys.stderr):
+        smallest = generate(dict(config, well_packing='smallest'))['synthetic_experiment0']
+        packed = generate(dict(config, well_packing='dead_volume'))['synthetic_experiment0']
+    assert 'well_packing' not in smallest
+    well_packing = packed['well_packing'].set_index('well_packing')
+    # 3 solutions move from the 384 well plate to deep wells: one plate less for 3 * 20 ul more holdover
+    assert well_packing.loc['dead_volume', 'plates'] == well_packing.loc['smallest', 'plates'] - 1
+    assert well_packing.loc['dead_volume', 'holdover_ul'] == well_packing.loc['smallest', 'holdover_ul'] + 60
+    # as the user puts them on the instrument
+    assert packed['user_solution']['user_input'].sum() == pytest.approx(smallest['user_solution']['user_input'].sum() +
+                                                                        60)
+    plate_list = [set(each['user_labware']['plate_well'].str.split('|').str[0]) for each in [smallest, packed]]
+    assert len(plate_list[1]) == len(plate_list[0]) - 1
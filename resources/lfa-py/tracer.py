@@ -0,0 +1,254 @@
+import pandas as pd
+import tracemalloc
+import functools
+import threading
+import json
+import time
+import sys
+import os
+
+# trace file and format, from the environment so that worker processes inherit them. tracing is off if no file is set
+trace_path = os.environ.get('LFA_TRACE') or None
+trace_format = os.environ.get('LFA_TRACE_FORMAT', 'chrome')
+
+# memory profiling of each stage, and the resident memory in MB above which the pipeline is stopped, 0 for no limit
+memory_enabled = os.environ.get('LFA_MEMORY', '0') not in ['', '0']
+memory_budget_mb = float(os.environ.get('LFA_MEMORY_BUDGET_MB', '0') or 0)
+
+# stack of the stages being traced in each thread, to attach iteration counts to the innermost one
+local = threading.local()
+lock = threading.Lock()
+
+
+class MemoryBudgetError(MemoryError):
+    """
+    raised when the memory used by the pipeline goes above the memory budget
+    """
+    pass
+
+
+def start_memory(budget_mb=0):
+    """
+    start profiling memory of each stage, also for worker processes started afterwards
+    :param budget_mb: resident memory in MB above which the pipeline is stopped with MemoryBudgetError, 0 for no limit
+    :return: none
+    """
+    global memory_enabled, memory_budget_mb
+    memory_enabled = True
+    memory_budget_mb = budget_mb
+    os.environ['LFA_MEMORY'] = '1'
+    os.environ['LFA_MEMORY_BUDGET_MB'] = str(budget_mb)
+
+
+def get_rss():
+    """
+    get the resident memory of the current process
+    :return: resident memory in bytes, None if it is not available on this platform
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_frame_bytes(obj):
+    """
+    get the memory used by the worklist of a stage output
+    :param obj: dataframe, dictionary with a worklist, or tuple starting with a dataframe
+    :return: bytes, None if there is no worklist
+    """
+    if isinstance(obj, dict):
+        obj = obj.get('worklist')
+    elif isinstance(obj, tuple) and len(obj) > 0:
+        obj = obj[0]
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    return None
+
+
+def start_trace(path, fmt='chrome'):
+    """
+    start tracing the pipeline stages into a new file, also for worker processes started afterwards
+    :param path: path to the trace file
+    :param fmt: 'chrome' for the chrome trace event format (open in chrome://tracing or perfetto), 'json' for one json
+        object per line
+    :return: none
+    """
+    global trace_path, trace_format
+    trace_path = path
+    trace_format = fmt
+    os.environ['LFA_TRACE'] = path
+    os.environ['LFA_TRACE_FORMAT'] = fmt
+    with open(path, 'w') as f:
+        if fmt == 'chrome':
+            # the closing bracket is optional in the chrome format, so processes can keep appending events
+            f.write('[\n')
+
+
+def stop_trace():
+    """
+    stop tracing
+    :return: none
+    """
+    global trace_path
+    trace_path = None
+    os.environ.pop('LFA_TRACE', None)
+
+
+def get_rows(obj):
+    """
+    get the number of rows of a stage input or output
+    :param obj: dataframe, dictionary with a worklist, or tuple starting with a dataframe
+    :return: number of rows, None if unknown
+    """
+    if isinstance(obj, pd.DataFrame):
+        return obj.shape[0]
+    if isinstance(obj, dict) and isinstance(obj.get('worklist'), pd.DataFrame):
+        return obj['worklist'].shape[0]
+    if isinstance(obj, tuple) and len(obj) > 0 and isinstance(obj[0], pd.DataFrame):
+        return obj[0].shape[0]
+    return None
+
+
+def count(key, n=1):
+    """
+    add to a count, such as the number of iterations, of the innermost stage being traced
+    :param key: name of the count
+    :param n: number to add
+    :return: none
+    """
+    if trace_path is None and not memory_enabled:
+        return
+    stack = getattr(local, 'stack', [])
+    if len(stack) > 0:
+        stack[-1][key] = stack[-1].get(key, 0) + n
+
+
+def write_event(event):
+    """
+    append one event to the trace file
+    :param event: dictionary with name, start and duration in seconds, and counts
+    :return: none
+    """
+    if trace_format == 'chrome':
+        args = {key: value for key, value in event.items() if key not in ['name', 'start', 'duration']}
+        line = json.dumps({'name': event['name'], 'ph': 'X', 'ts': event['start'] * 1e6,
+                           'dur': event['duration'] * 1e6, 'pid': os.getpid(), 'tid': threading.get_ident(),
+                           'args': args}) + ',\n'
+    else:
+        line = json.dumps(dict(event, pid=os.getpid())) + '\n'
+
+    with lock:
+        with open(trace_path, 'a') as f:
+            if trace_format == 'chrome' and f.tell() == 0:
+                f.write('[\n')
+            f.write(line)
+
+
+def traced(name):
+    """
+    decorator to trace a pipeline stage: wall time, rows of the first dataframe input and of the output, and counts
+    added with count. if memory profiling is on, also the tracemalloc peak, the resident memory and its change, and the
+    memory used by the output worklist. when both are off, the only cost is one check per call
+    :param name: name of the stage
+    :return: decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if trace_path is None and not memory_enabled:
+                return func(*args, **kwargs)
+
+            rows_in = None
+            for each in list(args) + list(kwargs.values()):
+                rows_in = get_rows(each)
+                if rows_in is not None:
+                    break
+
+            if not hasattr(local, 'stack'):
+                local.stack = []
+            counts = {}
+            if memory_enabled:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                # the peak is reset for each stage, and the peaks of inner stages are added back to the outer ones
+                tracemalloc.reset_peak()
+                counts['peak_inner'] = 0
+                rss_start = get_rss()
+            local.stack.append(counts)
+            start = time.time()
+            clock = time.perf_counter()
+            try:
+                out = func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - clock
+                local.stack.pop()
+
+            event = {'name': name, 'start': start, 'duration': duration, 'rows_in': rows_in, 'rows_out': get_rows(out)}
+            if memory_enabled:
+                peak = max(tracemalloc.get_traced_memory()[1], counts.pop('peak_inner'))
+                if len(local.stack) > 0:
+                    local.stack[-1]['peak_inner'] = max(local.stack[-1].get('peak_inner', 0), peak)
+                rss = get_rss()
+                event.update({'tracemalloc_peak_mb': peak / 2 ** 20,
+                              'rss_mb': None if rss is None else rss / 2 ** 20,
+                              'rss_delta_mb': None if rss is None or rss_start is None else (rss - rss_start) / 2 ** 20,
+                              'worklist_mb': None if get_frame_bytes(out) is None else get_frame_bytes(out) / 2 ** 20})
+            event.update(counts)
+
+            if trace_path is not None:
+                write_event(event)
+
+            if memory_enabled and memory_budget_mb > 0:
+                used_mb = event['rss_mb'] if event['rss_mb'] is not None else event['tracemalloc_peak_mb']
+                if used_mb > memory_budget_mb:
+                    raise MemoryBudgetError('memory budget exceeded after stage ' + name + ': ' +
+                                            str(round(used_mb)) + ' MB used, budget is ' +
+                                            str(round(memory_budget_mb)) + ' MB (LFA_MEMORY_BUDGET_MB)')
+            return out
+        return wrapper
+    return decorator
+
+
+def read_trace(path):
+    """
+    read a trace file in either format
+    :param path: path to the trace file
+    :return: dataframe, one row per event
+    """
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        event_list = json.loads(text.rstrip(',') + ('' if text.endswith(']') else ']'))
+        event_list = [dict(each['args'], name=each['name'], duration=each['dur'] / 1e6, pid=each['pid'])
+                      for each in event_list]
+    else:
+        event_list = [json.loads(each) for each in text.split('\n') if each.strip()]
+    return pd.DataFrame(event_list)
+
+
+def summarize_trace(path):
+    """
+    summarize a trace by stage: number of calls, total and max time, max rows, and max memory if profiled
+    :param path: path to the trace file
+    :return: dataframe, one row per stage, slowest first
+    """
+    trace_df = read_trace(path)
+    agg_dict = {'calls': ('duration', 'size'),
+                'time_total_s': ('duration', 'sum'),
+                'time_max_s': ('duration', 'max'),
+                'rows_in_max': ('rows_in', 'max'),
+                'rows_out_max': ('rows_out', 'max')}
+    for each in ['iterations', 'tracemalloc_peak_mb', 'rss_mb', 'rss_delta_mb', 'worklist_mb']:
+        if each in trace_df.columns:
+            agg_dict[each + '_max'] = (each, 'max')
+    summary = trace_df.groupby('name').agg(**agg_dict).sort_values('time_total_s', ascending=False)
+    return summary.reset_index().rename(columns={'name': 'stage'})
+
+
+if __name__ == '__main__':
+    # print the summary of a trace file
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', 20)
+    print(summarize_trace(sys.argv[1]).round(3).to_string(index=False))
@@ -1,6 +1,11 @@
 import pandas as pd
 import numpy as np
 from scipy.optimize import nnls
+from tracer import traced, count
+from engine import select, fast_version
+
+# reagent volume one plate on the deck is worth, in ul, when choosing plates with pack_plate_well
+plate_cost_ul = 200
 
 
 def get_source(worklist, plate_df):
@@ -59,10 +64,10 @@ def get_dilution_df(target, diluent, sol_df, target_volume=None, tolerance=0.01)
         each_make_df = pd.DataFrame(data=[[each_volume]], index=[each_target], columns=[each_target])
         if ingredients.shape[0] > 0 and np.in1d(np.append(ingredients, [diluent]), sol_df.columns).all():
             # find appropriate stock solutions
-            include = (sol_df[target_df.columns.values] > 0).any(1)
-            exclude = (sol_df.drop(target_df.columns.values, axis=1)==0).all(1)
+            include = (sol_df[target_df.columns.values] > 0).any(axis=1)
+            exclude = (sol_df.drop(target_df.columns.values, axis=1)==0).all(axis=1)
             stock_df = sol_df.loc[include & exclude].drop(each_target)
-            stock_df = stock_df.loc[:, (stock_df > 0).any(0)]
+            stock_df = stock_df.loc[:, (stock_df > 0).any(axis=0)]
 
             # now add volume and diluent to solve
             target_df['volume'] = 1
@@ -172,6 +177,32 @@ def shift_plate_worklist(worklist0_input, worklist1_input):
     return worklist0, worklist1
 
 
+@traced('combine_run_worklists')
+def combine_run_worklists(run_worklist_list, name_list):
+    """
+    combine the run worklists of sub experiments that share one session on the instrument, so that their solutions are
+    made once. the plates of each run worklist are shifted past those of the ones before it, and its groups and timers
+    come after theirs
+    :param run_worklist_list: list of run worklists, in the order they are run
+    :param name_list: names of the sub experiments, kept in the column sub_exp
+    :return: run worklist
+    """
+    worklist = run_worklist_list[0].assign(sub_exp=name_list[0])
+    for each, name in zip(run_worklist_list[1:], name_list[1:]):
+        each = each.assign(sub_exp=name).reset_index(drop=True)
+
+        # plates of each type are numbered after those of that type before, the same plate as from and to included
+        used, _ = get_plate_type_number(pd.concat([worklist['to_plate'], worklist['from_plate']],
+                                                  ignore_index=True).to_frame())
+        n_used = used.groupby('plate')['plate_number'].max()
+        for col in ['to_plate', 'from_plate']:
+            plate, nzfill = get_plate_type_number(each[[col]])
+            plate['plate_number'] = plate['plate_number'] + plate['plate'].map(n_used).fillna(0).astype(int)
+            each[col] = plate['plate'] + '_' + plate['plate_number'].astype(str).str.zfill(nzfill)
+        worklist = worklist_concat(worklist, each)
+    return worklist
+
+
 def renumber_reservoir(worklist, reservoir_tag='ivl_1_'):
     """
     renumber the wells when a reservoir is used
@@ -192,15 +223,22 @@ def renumber_reservoir(worklist, reservoir_tag='ivl_1_'):
     return out
 
 
-def assign_plate_well(worklist, plate_df_input, colname, use_holdover=1):
+def assign_plate_well(worklist, plate_df_input, colname, use_holdover=1, well_packing='smallest'):
     """
     assign plate and well for transfer steps
     :param worklist: input worklist
     :param plate_df_input: dataframe describing plates
     :param colname: column name
     :param use_holdover: use holdover volume
+    :param well_packing: 'smallest' to put each solution in the smallest well it fits in, 'dead_volume' to choose
+        plates that use the least reagent and plates, see pack_plate_well
     :return: dataframe of plates and wells
     """
+    if well_packing == 'dead_volume':
+        return pack_plate_well(worklist, plate_df_input, colname, use_holdover=use_holdover)
+    if well_packing != 'smallest':
+        raise ValueError('well_packing must be smallest or dead_volume, not ' + str(well_packing))
+
     # first tally up the total volume
     well_df = worklist.groupby(colname)['volume_ul'].sum().to_frame().reset_index()
     well_df = well_df[well_df['volume_ul'] > 0]
@@ -230,7 +268,162 @@ def assign_plate_well(worklist, plate_df_input, colname, use_holdover=1):
     return well_df
 
 
-def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_df, n_per_group, nzfill):
+@traced('pack_plate_well')
+def pack_plate_well(worklist, plate_df_input, colname, use_holdover=1):
+    """
+    assign plate and well for transfer steps as assign_plate_well does, choosing the plate type of each solution so
+    that little reagent and few plates are used: each well costs its holdover volume, each plate plate_cost_ul. wells
+    start in the plate type they fit in with the least holdover, then the wells of the last plate of a type, partly
+    used, move to the types they cost the least in, as long as it saves. the holdover and plates saved over
+    assign_plate_well are counted in the trace. with the plates of reagent_plates.csv, the well with the least holdover
+    is also the smallest one a solution fits in, so the layout only changes when a plate type holds a few wells, fewer
+    than plate_cost_ul over the extra holdover of the next plate type, e.g. up to 9 wells of the 384 well plate (40 ul)
+    moved to a deep well plate (60 ul) already in use
+    :param worklist: input worklist
+    :param plate_df_input: dataframe describing plates
+    :param colname: column name
+    :param use_holdover: use holdover volume
+    :return: dataframe of plates and wells
+    """
+    # first tally up the total volume
+    well_df = worklist.groupby(colname)['volume_ul'].sum().to_frame().reset_index()
+    well_df = well_df[well_df['volume_ul'] > 0].reset_index(drop=True)
+
+    # reagent plate df, in the order assign_plate_well tries them
+    plate_df = plate_df_input.copy()
+    plate_df['volume_usable'] = plate_df['volume_well'] - use_holdover*plate_df['volume_holdover']
+    plate_df = plate_df.sort_values('volume_usable').reset_index(drop=True)
+    plate_df['nwellperplate'] = plate_df['ncol'] * plate_df['nrow']
+    holdover = plate_df['volume_holdover'].values.astype(float)
+    nwellperplate = plate_df['nwellperplate'].values
+
+    # plate types each well fits in, the largest one if none, as in assign_plate_well
+    fit = well_df['volume_ul'].values[:, np.newaxis] <= plate_df['volume_usable'].values[np.newaxis, :]
+    fit[~fit.any(axis=1), -1] = True
+    cost_well = np.where(fit, holdover[np.newaxis, :], np.inf)
+
+    def get_cost(choice):
+        n_well = np.bincount(choice, minlength=plate_df.shape[0])
+        return holdover[choice].sum() + plate_cost_ul * np.ceil(n_well / nwellperplate).sum()
+
+    # start from the least holdover, the smallest well if the same
+    choice = np.argmin(cost_well, axis=1)
+    cost = get_cost(choice)
+    improved = True
+    while improved:
+        improved = False
+        for each in range(plate_df.shape[0]):
+            in_type = np.where(choice == each)[0]
+            if in_type.shape[0] == 0:
+                continue
+            count('iterations')
+            n_last = in_type.shape[0] - (np.ceil(in_type.shape[0] / nwellperplate[each]) - 1) * nwellperplate[each]
+            alternative = cost_well[in_type].copy()
+            alternative[:, each] = np.inf
+            move = np.argsort(alternative.min(axis=1) - holdover[each], kind='stable')[:int(n_last)]
+            if not np.isfinite(alternative[move].min(axis=1)).all():
+                continue
+            new_choice = choice.copy()
+            new_choice[in_type[move]] = alternative[move].argmin(axis=1)
+            new_cost = get_cost(new_choice)
+            if new_cost < cost - 1e-9:
+                choice = new_choice
+                cost = new_cost
+                improved = True
+
+    smallest = fit.argmax(axis=1)
+    count('holdover_saved_ul', float(holdover[smallest].sum() - holdover[choice].sum()))
+    count('plates_saved', int(round((get_cost(smallest) - holdover[smallest].sum() - cost + holdover[choice].sum()) /
+                                    plate_cost_ul)))
+
+    # now assign location based on the plate, as in assign_plate_well
+    well_df['plate'] = plate_df['plate'].values[choice]
+    well_df['plate_number'] = 0
+    well_df['well_number'] = 0
+    for each in np.unique(choice):
+        index = np.where(choice == each)[0]
+        plate_well = np.arange(index.shape[0])
+        well_df.loc[index, 'plate_number'] = np.floor(plate_well / nwellperplate[each]) + 1
+        well_df.loc[index, 'well_number'] = plate_well % nwellperplate[each] + 1
+
+    well_df = well_df[[colname, 'plate', 'plate_number', 'well_number']]
+    return well_df
+
+
+@traced('split_source_well')
+def split_source_well(worklist_input, plate_df_input, colname):
+    """
+    split the transfers from a solution across several wells when their holdover volumes and their share of a plate,
+    plate_cost_ul, cost less than those of one larger well, such as wells of a deep well plate instead of a reservoir.
+    transfers are not split, they are packed into wells first fit decreasing. only solutions that need the reservoir
+    and whose transfers fit in a deep well are split, so solutions transferred by full 1000 ul tips, as the diluent
+    of large volumes usually is, stay in the reservoir
+    :param worklist_input: input worklist
+    :param plate_df_input: dataframe describing plates
+    :param colname: column name of the solution
+    :return: worklist with column colname + '_well', the name of the well each transfer is from, the solution followed
+        by the index of the well if it is split
+    """
+    worklist = worklist_input.copy()
+    worklist[colname + '_well'] = worklist[colname]
+    plate_df = plate_df_input.copy()
+    plate_df['volume_usable'] = plate_df['volume_well'] - plate_df['volume_holdover']
+    plate_df['cost_well'] = plate_df['volume_holdover'] + plate_cost_ul / (plate_df['ncol'] * plate_df['nrow'])
+    plate_df = plate_df.sort_values('volume_usable')
+
+    for each, sub in worklist[worklist['volume_ul'] > 0].groupby(colname):
+        # holdover of the one well assign_plate_well would use
+        single = plate_df.loc[plate_df['volume_usable'] >= sub['volume_ul'].sum(), 'volume_holdover']
+        single = single.values[0] if single.shape[0] > 0 else plate_df['volume_holdover'].values[-1]
+
+        best = None
+        for _, plate in plate_df.iterrows():
+            if sub['volume_ul'].max() > plate['volume_usable']:
+                continue
+            well_volume = []
+            well_index = pd.Series(0, index=sub.index)
+            for index, volume in sub['volume_ul'].sort_values(ascending=False, kind='stable').items():
+                fit = [i for i, each_volume in enumerate(well_volume) if each_volume + volume <= plate['volume_usable']]
+                well_index[index] = fit[0] if len(fit) > 0 else len(well_volume)
+                if len(fit) > 0:
+                    well_volume[fit[0]] = well_volume[fit[0]] + volume
+                else:
+                    well_volume = well_volume + [volume]
+            cost = len(well_volume) * plate['cost_well']
+            if best is None or cost < best[0] - 1e-9:
+                best = [cost, well_index, len(well_volume) * plate['volume_holdover']]
+        if best is not None and best[1].max() > 0:
+            count('wells_split')
+            count('holdover_saved_ul', float(single - best[2]))
+            worklist.loc[sub.index, colname + '_well'] = each + '_' + (best[1] + 1).astype(str)
+    return worklist
+
+
+def get_well_packing(worklist, plate_df):
+    """
+    compare the wells of the sources of a recipe worklist with those assign_plate_well would choose, to tell how much
+    reagent and how many plates well_packing saves, see pack_plate_well and split_source_well
+    :param worklist: worklist, from get_worklist_from_recipe
+    :param plate_df: dataframe describing plates
+    :return: dataframe with a row for each well_packing, smallest and the one used, of wells, holdover_ul and plates
+    """
+    holdover = dict(zip(plate_df['plate'], plate_df['volume_holdover']))
+
+    smallest = assign_plate_well(worklist, plate_df, colname='source', use_holdover=1)
+    row_smallest = [smallest.shape[0], float(smallest['plate'].map(holdover).sum()),
+                    int(smallest.groupby('plate')['plate_number'].max().sum())]
+
+    well = worklist.loc[worklist['volume_ul'] > 0, ['from_plate', 'from_well']].drop_duplicates()
+    plate = well['from_plate'].str.rsplit('_', n=1).str[0]
+    row_used = [well.shape[0], float(plate.map(holdover).sum()), int(well['from_plate'].nunique())]
+
+    return pd.DataFrame([['smallest'] + row_smallest, ['dead_volume'] + row_used],
+                        columns=['well_packing', 'wells', 'holdover_ul', 'plates'])
+
+
+@traced('get_worklist_from_recipe')
+def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_df, n_per_group, nzfill,
+                             well_packing='smallest'):
     """
     make worklist from recipe
     :param make_solution_df: recipe
@@ -239,6 +432,8 @@ def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_d
     :param liquid_type_df: dataframe, liquid types of solutions
     :param n_per_group: number of transfer steps per group, usually 8 for IVL's Hamilton robots
     :param nzfill: number of digits to fill with leading zeroes to
+    :param well_packing: 'smallest' or 'dead_volume' choice of the wells of the solutions the user puts on the
+        instrument, see assign_plate_well
     :return: new worklist
     """
     
@@ -253,7 +448,7 @@ def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_d
     for index_to_fix in i_large_volume:
         large_volume = worklist.loc[index_to_fix, 'volume_ul']
         volume_list = split_transfer(large_volume, tip_size.max())
-        patch = pd.concat(len(volume_list) * [worklist.loc[i_large_volume]], sort=False)
+        patch = pd.concat(len(volume_list) * [worklist.loc[[index_to_fix]]], sort=False)
         patch['volume_ul'] = volume_list
         worklist = pd.concat([worklist.drop(index_to_fix), patch], sort=False)
 
@@ -287,7 +482,8 @@ def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_d
     worklist['from_path'] = worklist['source'] + ' --> ' + worklist['guid']
     worklist['tip_type'] = get_tip_type(worklist['volume_ul'])
     # to get liquid class
-    worklist = worklist.merge(liquid_type_df.rename(columns={'solution': 'source'}), how='left').fillna('pbst')
+    worklist = worklist.merge(liquid_type_df.loc[:, ['solution', 'liquid_type']].rename(columns={'solution': 'source'}),
+                              how='left').fillna('pbst')
     worklist['liquid_class'] = 'ivl_tip' + worklist['tip_type'].astype(int).astype(str) + '_' + \
                                worklist['liquid_type'] + '_' + worklist['dispense_type'].str.replace('[^a-zA-Z]+', '')
 
@@ -303,15 +499,21 @@ def get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_d
                                                          worklist['group_number'].max()
 
     # assign wells
+    # solutions made here keep the smallest well, their holdover is added by update_holdover_volume_plate_tip
+    src_col = 'source'
+    if well_packing == 'dead_volume':
+        worklist = split_source_well(worklist, plate_df, 'source')
+        src_col = 'source_well'
     plate_well_dst = assign_plate_well(worklist, plate_df, colname='guid', use_holdover=0)
-    plate_well_src = assign_plate_well(worklist, plate_df, colname='source', use_holdover=1)
+    plate_well_src = assign_plate_well(worklist, plate_df, colname=src_col, use_holdover=1, well_packing=well_packing)
     # rearranging plate well, not taking into account overlapping solutions, using different plates in this case
     plate_well_dst, plate_well_src = shift_plate([plate_well_dst, plate_well_src])
     # update wells
     plate_well_src['from_well'] = plate_well_src['well_number']
     plate_well_src['from_plate'] = plate_well_src['plate'] + '_' + plate_well_src['plate_number']. \
         astype(int).astype(str).str.zfill(nzfill)
-    worklist = worklist.merge(plate_well_src[['source', 'from_well', 'from_plate']], how='left')
+    worklist = worklist.merge(plate_well_src[[src_col, 'from_well', 'from_plate']], how='left')
+    worklist = worklist.drop(columns=['source_well'], errors='ignore')
 
     plate_well_dst['to_well'] = plate_well_dst['well_number']
     plate_well_dst['to_plate'] = plate_well_dst['plate'] + '_' + plate_well_dst['plate_number']. \
@@ -344,6 +546,7 @@ def match_from_to_imaging(worklist_input):
     return worklist
 
 
+@traced('get_link_sol_run')
 def get_link_sol_run(sol_worklist, run_worklist, tip_size, n_per_group):
     """
     make worklist to link worklists to make solutions and to run assays
@@ -459,6 +662,7 @@ def add_plate_well_columns(worklist_input, reservoir_tag='ivl_1'):
     return worklist
 
 
+@traced('consolidate_transfer')
 def consolidate_transfer(worklist_input, keep_tag, reservoir_tag):
     """
     consolidate transfer steps
@@ -477,6 +681,7 @@ def consolidate_transfer(worklist_input, keep_tag, reservoir_tag):
                             (~count_from['to_plate_well'].str.contains(keep_tag))]
 
     # now go through count_from and update the worklist
+    count('iterations', count_from['to_plate_well'].nunique())
     for each in count_from['to_plate_well'].unique():
         each_new = worklist.loc[worklist['to_plate_well'] == each, 'from_plate_well'].values[0]
         # update "from" with each_new
@@ -641,6 +846,7 @@ def update_tip_size(worklist_input, tip_size):
     return worklist
 
 
+@traced('update_holdover_volume_plate_tip')
 def update_holdover_volume_plate_tip(worklist_input, plate_df, nzfill, ignore_tag, reservoir_tag, tip_size, n_iter_max=3):
     """
     update volumes, plates, and tips, to account for hold over volumes
@@ -658,6 +864,7 @@ def update_holdover_volume_plate_tip(worklist_input, plate_df, nzfill, ignore_ta
 
     n_iter_remaining = n_iter_max
     while vol_change and n_iter_remaining > 0:
+        count('iterations')
         # update plate and well
         worklist = update_plate_well(worklist, plate_df, nzfill=nzfill, ignore_tag=ignore_tag, reservoir_tag=reservoir_tag)
         worklist, vol_change = update_volume_only(worklist, plate_df, reservoir_tag=reservoir_tag)
@@ -678,6 +885,7 @@ def update_holdover_volume_plate_tip(worklist_input, plate_df, nzfill, ignore_ta
     return worklist
 
 
+@traced('update_dispense_type')
 def update_dispense_type(worklist_input, ignore_tag, reservoir_tag):
     """
     update dispense type
@@ -692,6 +900,7 @@ def update_dispense_type(worklist_input, ignore_tag, reservoir_tag):
 
     # go top down; change to surface empty if dispense into non-empty wells and to plate is not assay plate
     # assumption: no dispense onto stocks
+    count('iterations', worklist.shape[0])
     for irow in worklist.index.values:
         row = worklist.loc[irow, :]
         if ignore_tag not in row['to_plate']:
@@ -715,6 +924,41 @@ def update_dispense_type(worklist_input, ignore_tag, reservoir_tag):
     return worklist
 
 
+@fast_version(update_dispense_type)
+@traced('update_dispense_type')
+def update_dispense_type_fast(worklist_input, ignore_tag, reservoir_tag):
+    """
+    update dispense type, see update_dispense_type. the volume already dispensed into each well is a cumulative sum
+    instead of a sum over the rows above each row. volumes are assumed not negative
+    :param worklist_input: input worklist
+    :param ignore_tag: tag to ignore
+    :param reservoir_tag: tag of the reservoir
+    :return: new worklist
+    """
+    worklist = worklist_input.copy().reset_index(drop=True)
+    original_columns = worklist.columns.values
+    worklist = add_plate_well_columns(worklist, reservoir_tag=reservoir_tag)
+
+    # change to surface empty if dispense into non-empty wells and to plate is not assay plate
+    count('iterations', worklist.shape[0])
+    v_before = worklist.groupby('to_plate_well')['volume_ul'].shift(fill_value=0)
+    v_in = v_before.groupby(worklist['to_plate_well']).cumsum()
+    surface = ~worklist['to_plate'].str.contains(ignore_tag, regex=False) & (v_in > 0)
+    for each in ['dispense_type', 'liquid_class']:
+        worklist.loc[surface, each] = worklist.loc[surface, each].str.replace('Jet', 'Surface', regex=False)
+
+    # also ensure that dispense type is the same in each group, with Jet favored over Surface
+    group_number = worklist['group_number']
+    any_jet = worklist['dispense_type'].str.contains('Jet').groupby(group_number).transform('any')
+    any_surface = worklist['dispense_type'].str.contains('Surface').groupby(group_number).transform('any')
+    mixed = (any_jet & any_surface).fillna(False).astype(bool)
+    for each in ['dispense_type', 'liquid_class']:
+        worklist.loc[mixed, each] = worklist.loc[mixed, each].str.replace('Surface', 'Jet', regex=False)
+
+    worklist = worklist[original_columns]
+    return worklist
+
+
 def solution_user_input(worklist_input, plate_df, description_col, reservoir_tag):
     """
     get solution information for the user to put on the instrument
@@ -750,8 +994,9 @@ def solution_user_input(worklist_input, plate_df, description_col, reservoir_tag
     return vol[['solution', 'plate_well', 'user_input']]
 
 
+@traced('make_solution_worklist')
 def make_solution_worklist(solution_input, diluent, sol_df, liquid_type_df, plate_df, reservoir_tag,
-                           ignore_tag, tip_size, n_per_group, nzfill):
+                           ignore_tag, tip_size, n_per_group, nzfill, engine='reference', well_packing='smallest'):
     
     """
     make solution worklist
@@ -765,32 +1010,40 @@ def make_solution_worklist(solution_input, diluent, sol_df, liquid_type_df, plat
     :param tip_size: tip sizes, usually [50, 300, 1000]
     :param n_per_group: number of transfer step per group
     :param nzfill: number of digits to fill to using leading zeroes
-    :return: dictionary, including the worklist and dataframes telling the user what to put on the instrument
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param well_packing: 'smallest' or 'dead_volume', see assign_plate_well
+    :return: dictionary, including the worklist and dataframes telling the user what to put on the instrument, and
+        well_packing if dead_volume, see get_well_packing
     """
     make_solution_df = get_dilution_df(target=solution_input['solution'].values,
                                        diluent=diluent,
                                        sol_df=sol_df,
                                        target_volume=solution_input['volume'].values)
 
-    worklist = get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_df, n_per_group, nzfill)
+    worklist = get_worklist_from_recipe(make_solution_df, tip_size, plate_df, liquid_type_df, n_per_group, nzfill,
+                                        well_packing=well_packing)
+    out = {}
+    if worklist.shape[0] > 0 and well_packing == 'dead_volume':
+        out['well_packing'] = get_well_packing(worklist, plate_df)
     if worklist.shape[0] > 0:
         worklist = update_holdover_volume_plate_tip(worklist, plate_df, nzfill, ignore_tag, reservoir_tag, tip_size)
-        worklist = update_dispense_type(worklist, ignore_tag=ignore_tag, reservoir_tag=reservoir_tag)
+        worklist = select(update_dispense_type, engine)(worklist, ignore_tag=ignore_tag, reservoir_tag=reservoir_tag)
 
         user_solution = solution_user_input(worklist, plate_df, 'source', reservoir_tag)
         user_labware = get_labware(worklist, reservoir_tag)
-        user_tip = get_tip_count(worklist)
+        user_tip = select(get_tip_count, engine)(worklist)
     else:
         user_solution = pd.DataFrame()
         user_labware = pd.DataFrame()
         user_tip = pd.DataFrame()
 
-    return {'worklist': worklist,
-            'user_solution': user_solution,
-            'user_labware': user_labware,
-            'user_tip': user_tip}
+    return dict({'worklist': worklist,
+                 'user_solution': user_solution,
+                 'user_labware': user_labware,
+                 'user_tip': user_tip}, **out)
 
 
+@traced('squeeze_plate_index')
 def squeeze_plate_index(worklist_input, nzfill):
     """
     squeeze the plate indices down, to consolidate
@@ -836,12 +1089,273 @@ def get_labware(worklist, reservoir_tag):
     return labware
 
 
+def get_channel_utilization(worklist, n_per_group=8):
+    """
+    get how many of the channels of each group transfer liquid
+    :param worklist: worklist
+    :param n_per_group: number of channels
+    :return: dataframe, one row per step and one for all, with the number of groups and transfers, and the utilization,
+        transfers over channels of all groups
+    """
+    group_df = worklist.groupby('group_number', sort=False).agg(step=('step', 'first'), transfers=('step', 'size'))
+    group_df = pd.concat([group_df, group_df.assign(step='all')])
+    utilization = group_df.groupby('step', sort=False).agg(groups=('transfers', 'size'),
+                                                           transfers=('transfers', 'sum')).reset_index()
+    utilization['utilization'] = utilization['transfers'] / utilization['groups'] / n_per_group
+    return utilization
+
+
+@traced('pack_partial_groups')
+def pack_partial_groups(worklist_input, keep_tag, reservoir_tag, n_per_group=8):
+    """
+    merge groups that use fewer than n_per_group channels, to run fewer cycles. only the groups before the first group
+    dispensing to keep_tag, those making solutions, are merged, if they have the same liquid class and no timer. a group
+    joins the latest earlier group it fits in, if it does not aspirate from a well that group fills or the reverse,
+    and it does not need to run after any group in between: no well is filled by one and used by the other
+    :param worklist_input: full worklist
+    :param keep_tag: tag of the plates of the assay, groups from the first one dispensing to them on are not merged
+    :param reservoir_tag: tag of the reservoir
+    :param n_per_group: number of channels
+    :return: worklist, with groups numbered again in order and timers pointing to the new numbers
+    """
+    worklist = add_plate_well_columns(worklist_input.reset_index(drop=True), reservoir_tag=reservoir_tag)
+    group_list = list(pd.unique(worklist['group_number']))
+    count('groups_before', len(group_list))
+
+    # groups that can be merged
+    is_assay = worklist['to_plate'].astype(str).str.contains(keep_tag)
+    assay_group = worklist.loc[is_assay, 'group_number']
+    n_free = group_list.index(assay_group.values[0]) if assay_group.shape[0] > 0 else len(group_list)
+    timer_group = set(worklist['timer_group_check']) | set(worklist.loc[worklist['timer_group_check'] != 0,
+                                                                        'group_number'])
+
+    bin_list = []
+    for group, sub in worklist.groupby('group_number', sort=False):
+        each = {'groups': [group],
+                'size': sub.shape[0],
+                'liquid_class': sub['liquid_class'].values[0] if sub['liquid_class'].nunique() == 1 else None,
+                'read': set(sub['from_plate_well']),
+                'write': set(sub['to_plate_well'])}
+        packable = group_list.index(group) < n_free and group not in timer_group and each['liquid_class'] is not None
+        each['packable'] = packable
+        placed = False
+        if packable:
+            for other in bin_list[::-1]:
+                count('iterations')
+                if other['packable'] and other['liquid_class'] == each['liquid_class'] and \
+                        other['size'] + each['size'] <= n_per_group and \
+                        len(each['read'] & other['write']) + len(each['write'] & other['read']) == 0:
+                    other['groups'] = other['groups'] + each['groups']
+                    other['size'] = other['size'] + each['size']
+                    other['read'] = other['read'] | each['read']
+                    other['write'] = other['write'] | each['write']
+                    placed = True
+                    break
+                if len(each['read'] & other['write']) + len(each['write'] & (other['read'] | other['write'])) > 0:
+                    break
+        if not placed:
+            bin_list = bin_list + [each]
+
+    # rows in the new order of groups, numbered from 1
+    new_number = {group: i + 1 for i, each in enumerate(bin_list) for group in each['groups']}
+    order = {group: i for i, group in enumerate([group for each in bin_list for group in each['groups']])}
+    worklist['_group_order'] = worklist['group_number'].map(order)
+    worklist = worklist.sort_values('_group_order', kind='stable').reset_index(drop=True)
+    worklist['group_number'] = worklist['group_number'].map(new_number)
+    worklist['timer_group_check'] = worklist['timer_group_check'].map(lambda each: new_number.get(each, 0))
+    worklist = worklist[worklist_input.columns]
+    count('groups_after', len(bin_list))
+
+    # wells of the reservoir are numbered by channel
+    return renumber_reservoir(worklist)
+
+
+def get_tip_row_info(worklist, liquid_type_df, no_reuse_class=['imaging']):
+    """
+    get what tip planning needs to know about each row of a worklist
+    :param worklist: full worklist
+    :param liquid_type_df: dataframe, liquid types, with an optional tip_washing column, Yes for solutions whose tips
+        are never reused
+    :param no_reuse_class: liquid classes defined by the user whose tips are never reused, such as imaging
+    :return: dataframe of channel, source (plate and well aspirated from), destination (plate and well dispensed to),
+        tip_type, contact (whether the dispense may touch the liquid in the destination), reusable (whether the tip
+        may be reused at all) and aspirate (0 if the tip already holds the liquid, see one_run.batch_dispense)
+    """
+    info = pd.DataFrame(index=worklist.index)
+    info['channel'] = worklist.groupby('group_number', sort=False).cumcount().values + 1
+    info['source'] = worklist['from_plate'].astype(str) + '|' + worklist['from_well'].astype(str)
+    info['destination'] = worklist['to_plate'].astype(str) + '|' + worklist['to_well'].astype(str)
+    info['tip_type'] = worklist['tip_type']
+    info['contact'] = ~worklist['dispense_type'].astype(str).str.contains('Jet')
+
+    washing = []
+    if 'tip_washing' in liquid_type_df.columns:
+        washing = liquid_type_df.loc[liquid_type_df['tip_washing'].astype(str).str.lower().isin(['yes', '1', 'true']),
+                                     'solution'].tolist()
+    info['reusable'] = ~worklist['source'].isin(washing)
+    if 'user_defined_liquid_class' in worklist.columns:
+        info['reusable'] = info['reusable'] & ~worklist['user_defined_liquid_class'].isin(no_reuse_class)
+    if 'aspirate' in worklist.columns:
+        info['aspirate'] = worklist['aspirate'].fillna(1).astype(int)
+    else:
+        info['aspirate'] = 1
+    return info
+
+
+def use_tip(row, tip_held, well_used, keep_tag=None):
+    """
+    update the tips held by the channels after a transfer
+    :param row: row of get_tip_row_info
+    :param tip_held: dictionary of the tip each channel holds, keyed by channel: source, tip_type, and whether it can
+        be reused. it is updated
+    :param well_used: set of wells that have received liquid, it is updated
+    :param keep_tag: if given, dispenses to plates without this tag are taken to touch the liquid of wells that are not
+        empty, as update_dispense_type makes them, instead of following their dispense type
+    :return: 1 if the channel picks up a new tip for the transfer, 0 if it reuses its tip
+    """
+    held = tip_held.get(row['channel'])
+    pickup = int(held is None or
+                 (row['aspirate'] == 1 and (not held[2] or held[0] != row['source'] or held[1] != row['tip_type'])))
+    # the tip only touches its own source, unless the dispense touches liquid already in the destination
+    contact = row['contact'] if keep_tag is None or keep_tag in row['destination'] else True
+    clean = row['reusable'] and not (contact and row['destination'] in well_used)
+    tip_held[row['channel']] = [row['source'], row['tip_type'], bool(clean and (pickup == 1 or held[2]))]
+    well_used.add(row['destination'])
+    return pickup
+
+
+def get_tip_score(row_list, tip_held, well_used, n_left, keep_tag):
+    """
+    score how much running a group now helps reusing tips
+    :param row_list: list of rows of get_tip_row_info of the group
+    :param tip_held: dictionary of the tip each channel holds, see use_tip
+    :param well_used: set of wells that have received liquid
+    :param n_left: dictionary of the number of transfers from each source not run yet
+    :param keep_tag: tag of the plates of the assay, see use_tip
+    :return: tuple, number of rows reusing the tip of their channel, and number of transfers from the same sources
+        left to run by tips that stay clean
+    """
+    n_reuse = 0
+    n_clean = 0
+    for row in row_list:
+        held = tip_held.get(row['channel'])
+        n_reuse = n_reuse + int(held is not None and held[2] and held[0] == row['source'] and
+                                held[1] == row['tip_type'])
+        contact = row['contact'] if keep_tag in row['destination'] else row['destination'] in well_used
+        if row['reusable'] and not contact:
+            n_clean = n_clean + n_left[row['source']] - 1
+    return n_reuse, n_clean
+
+
+@traced('plan_tips')
+def plan_tips(worklist_input, liquid_type_df, keep_tag, reservoir_tag, engine='reference', no_reuse_class=['imaging']):
+    """
+    let each channel keep its tip for its next transfer from the same source when the tip can not have been
+    contaminated: the source does not need tip washing, and the tip has only dispensed without contact (jet) or into
+    wells that were still empty. the groups before the first group dispensing to keep_tag, those making solutions, are
+    reordered greedily to reuse more tips, such as adding the diluent to empty wells first. every well is still filled
+    before it is aspirated from, and dispense types are updated to the new order, see update_dispense_type
+    :param worklist_input: full worklist
+    :param liquid_type_df: dataframe, liquid types, with an optional tip_washing column, Yes for solutions whose tips
+        are never reused
+    :param keep_tag: tag of the plates of the assay, groups from the first one dispensing to them on are not reordered
+    :param reservoir_tag: tag of the reservoir
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param no_reuse_class: liquid classes defined by the user whose tips are never reused, such as imaging
+    :return: worklist with tip_pickup (1 if the channel picks up a new tip before the transfer) and tip_eject (1 if it
+        ejects its tip after the transfer) columns
+    """
+    worklist = worklist_input.reset_index(drop=True)
+    info = get_tip_row_info(worklist, liquid_type_df, no_reuse_class)
+    group_list = list(pd.unique(worklist['group_number']))
+    row_dict = {group: [row for _, row in each.iterrows()] for group, each in info.groupby(worklist['group_number'],
+                                                                                          sort=False)}
+
+    # groups that can be reordered
+    is_assay = worklist['to_plate'].astype(str).str.contains(keep_tag)
+    assay_group = worklist.loc[is_assay, 'group_number']
+    n_free = group_list.index(assay_group.values[0]) if assay_group.shape[0] > 0 else len(group_list)
+
+    # the liquids added to a well between two aspirations from it can be added in any order. a group aspirating from a
+    # well depends on the groups filling it before, a group filling a well on the groups aspirating from it before
+    last_write = {}
+    last_read = {}
+    phase = {}
+    n_pred = [0] * n_free
+    successor = [set() for _ in range(n_free)]
+    for i in range(n_free):
+        pred = set()
+        for row in row_dict[group_list[i]]:
+            pred = pred | last_write.get(row['source'], set()) | last_read.get(row['destination'], set())
+        pred.discard(i)
+        for j in pred:
+            successor[j].add(i)
+        n_pred[i] = len(pred)
+        for row in row_dict[group_list[i]]:
+            for well, kind, runs in [[row['source'], 'read', last_read], [row['destination'], 'write', last_write]]:
+                runs[well] = (runs.get(well, set()) if phase.get(well) == kind else set()) | {i}
+                phase[well] = kind
+
+    # greedy: among the groups whose wells are ready, the one reusing the most tips, then the one keeping tips clean for
+    # the most transfers left, then the earliest
+    tip_held = {}
+    well_used = set()
+    n_left = pd.Series([row['source'] for i in range(n_free) for row in row_dict[group_list[i]]],
+                       dtype=object).value_counts().to_dict()
+    order = []
+    ready = [i for i in range(n_free) if n_pred[i] == 0]
+    while len(ready) > 0:
+        count('iterations')
+        score = [get_tip_score(row_dict[group_list[i]], tip_held, well_used, n_left, keep_tag) for i in ready]
+        i = ready[max(range(len(ready)), key=lambda each: score[each])]
+        ready.remove(i)
+        order = order + [i]
+        for row in row_dict[group_list[i]]:
+            use_tip(row, tip_held, well_used, keep_tag)
+            n_left[row['source']] = n_left[row['source']] - 1
+        for j in successor[i]:
+            n_pred[j] = n_pred[j] - 1
+            if n_pred[j] == 0:
+                ready = sorted(ready + [j])
+
+    # group numbers keep their values, in the new order
+    order = order + list(range(n_free, len(group_list)))
+    new_number = dict(zip([group_list[i] for i in order], group_list))
+    worklist['_group_order'] = worklist['group_number'].map(dict(zip([group_list[i] for i in order],
+                                                                      range(len(order)))))
+    worklist = worklist.sort_values('_group_order', kind='stable').drop(columns='_group_order')
+    worklist['group_number'] = worklist['group_number'].map(new_number)
+    worklist = worklist.reset_index(drop=True)
+    if order != list(range(len(group_list))):
+        # dispense types follow whether wells are empty, in the new order
+        free = ~worklist['to_plate'].astype(str).str.contains(keep_tag)
+        for each in ['dispense_type', 'liquid_class']:
+            worklist.loc[free, each] = worklist.loc[free, each].str.replace('Surface', 'Jet', regex=False)
+        worklist = select(update_dispense_type, engine)(worklist, ignore_tag=keep_tag, reservoir_tag=reservoir_tag)
+
+    # tips in the final order
+    info = get_tip_row_info(worklist, liquid_type_df, no_reuse_class)
+    tip_held = {}
+    well_used = set()
+    worklist['tip_pickup'] = [use_tip(row, tip_held, well_used) for _, row in info.iterrows()]
+    next_pickup = worklist.groupby(info['channel'])['tip_pickup'].shift(-1).fillna(1)
+    worklist['tip_eject'] = next_pickup.astype(int)
+    return worklist
+
+
+@traced('get_tip_count')
 def get_tip_count(worklist):
     """
     get tip count
-    :param worklist: worklist
+    :param worklist: worklist, with tip_pickup if tips are planned, see plan_tips, or aspirate if dispenses are batched,
+        see one_run.batch_dispense
     :return: tip count
     """
+    if 'tip_pickup' in worklist.columns:
+        worklist = worklist[worklist['tip_pickup'] == 1]
+    elif 'aspirate' in worklist.columns:
+        # a channel keeps its tip for all dispenses of an aspiration, rows making solutions are not batched
+        worklist = worklist[worklist['aspirate'].fillna(1) == 1]
     tip_count = []
     for group_number in worklist['group_number'].unique():
         sub = worklist[worklist['group_number']==group_number]
@@ -850,14 +1364,47 @@ def get_tip_count(worklist):
             tip_group = 'partial' if sub.shape[0] < 8 else 'full'
             each_tip_df = pd.DataFrame(data=[[sub.shape[0]]], columns=['tip_'+str(tip_type)+'_'+tip_group], index=[group_number])
             tip_count = tip_count + [each_tip_df]
+    if len(tip_count) == 0:
+        raise ValueError('no tip pickups in worklist')
     tip_count = pd.concat(tip_count, sort=False).sum(axis=0).astype(int).to_frame(name='count')
     tip_count['tip'] = tip_count.index
     tip_count = tip_count.sort_values('tip')
     return tip_count[['tip', 'count']]
 
 
+@fast_version(get_tip_count)
+@traced('get_tip_count')
+def get_tip_count_fast(worklist):
+    """
+    get tip count, see get_tip_count. groups are counted at once instead of one at a time
+    :param worklist: worklist, with tip_pickup if tips are planned, see plan_tips, or aspirate if dispenses are batched,
+        see one_run.batch_dispense
+    :return: tip count
+    """
+    if 'tip_pickup' in worklist.columns:
+        worklist = worklist[worklist['tip_pickup'] == 1]
+    elif 'aspirate' in worklist.columns:
+        # a channel keeps its tip for all dispenses of an aspiration, rows making solutions are not batched
+        worklist = worklist[worklist['aspirate'].fillna(1) == 1]
+    first = worklist.drop_duplicates('group_number')
+    group_size = worklist.groupby('group_number').size()
+    first = first[first['tip_type'] > 0]
+    if first.shape[0] == 0:
+        raise ValueError('no tip pickups in worklist')
+
+    n = group_size[first['group_number'].values].values
+    tip = ['tip_' + str(tip_type) + '_' + ('partial' if each_n < 8 else 'full')
+           for tip_type, each_n in zip(first['tip_type'].values, n)]
+    tip_count = pd.Series(n, index=tip).groupby(level=0, sort=False).sum().astype(int).to_frame(name='count')
+    tip_count['tip'] = tip_count.index
+    tip_count = tip_count.sort_values('tip')
+    return tip_count[['tip', 'count']]
+
+
+@traced('full_from_run_worklist')
 def full_from_run_worklist(run_worklist_input, diluent, sol_df, liquid_type_df, plate_df, reservoir_tag, assay_plate_tag,
-                           tip_size, n_per_group, nzfill):
+                           tip_size, n_per_group, nzfill, engine='reference', tip_reuse=0, pack_groups=0,
+                           well_packing='smallest'):
     """
     make full worklist from run worklist
     :param run_worklist_input: run worklist
@@ -870,7 +1417,14 @@ def full_from_run_worklist(run_worklist_input, diluent, sol_df, liquid_type_df,
     :param tip_size: tip sizes, usually [50, 300, 1000]
     :param n_per_group: number of steps per group
     :param nzfill: number of digits to fill to using leading zeroes
-    :return: dictionary, including worklist and info for the user to put solutions, labware, and tips on
+    :param engine: 'reference' or 'fast' implementations of the hot functions, see engine.py
+    :param tip_reuse: reuse tips for transfers from the same source where they can not be contaminated, see plan_tips
+    :param pack_groups: merge groups making solutions that use few channels, see pack_partial_groups
+    :param well_packing: 'smallest' or 'dead_volume' choice of the wells of the solutions the user puts on the
+        instrument to make other solutions from, see assign_plate_well
+    :return: dictionary, including worklist and info for the user to put solutions, labware, and tips on,
+        channel_utilization before and after packing if pack_groups, and the wells, holdover and plates of the
+        solutions the user puts on the instrument with and without well_packing if dead_volume, see get_well_packing
     """
     run_worklist = run_worklist_input.copy()
 
@@ -888,7 +1442,9 @@ def full_from_run_worklist(run_worklist_input, diluent, sol_df, liquid_type_df,
                   'ignore_tag': assay_plate_tag,
                   'tip_size': tip_size,
                   'n_per_group': 8,
-                  'nzfill': 4}
+                  'nzfill': 4,
+                  'engine': engine,
+                  'well_packing': well_packing}
     output = make_solution_worklist(source_unique, **input_dict)
     if output['worklist'].shape[0] > 0:
         sol_worklist = output['worklist'].copy()
@@ -901,19 +1457,36 @@ def full_from_run_worklist(run_worklist_input, diluent, sol_df, liquid_type_df,
         worklist_combo = worklist_concat(worklist_combo, run_worklist)
         worklist = consolidate_transfer(worklist_combo, keep_tag=assay_plate_tag, reservoir_tag=reservoir_tag)
         worklist = update_holdover_volume_plate_tip(worklist, plate_df, nzfill, assay_plate_tag, reservoir_tag, tip_size)
-        worklist = update_dispense_type(worklist, ignore_tag=assay_plate_tag, reservoir_tag=reservoir_tag)
+        if pack_groups:
+            worklist_unpacked = worklist
+            worklist = pack_partial_groups(worklist, keep_tag=assay_plate_tag, reservoir_tag=reservoir_tag,
+                                           n_per_group=n_per_group)
+        worklist = select(update_dispense_type, engine)(worklist, ignore_tag=assay_plate_tag,
+                                                        reservoir_tag=reservoir_tag)
         worklist = squeeze_plate_index(worklist, nzfill=nzfill)
     else:
         worklist = run_worklist
+        worklist_unpacked = worklist
+
+    if tip_reuse:
+        worklist = plan_tips(worklist, liquid_type_df, keep_tag=assay_plate_tag, reservoir_tag=reservoir_tag,
+                             engine=engine)
 
     user_solution = solution_user_input(worklist, plate_df, 'source', reservoir_tag)
     user_labware = get_labware(worklist, reservoir_tag)
-    user_tip = get_tip_count(worklist)
-
-    return {'worklist': worklist,
-            'user_solution': user_solution,
-            'user_labware': user_labware,
-            'user_tip': user_tip}
+    user_tip = select(get_tip_count, engine)(worklist)
+
+    out = {'worklist': worklist,
+           'user_solution': user_solution,
+           'user_labware': user_labware,
+           'user_tip': user_tip}
+    if pack_groups:
+        before = get_channel_utilization(worklist_unpacked, n_per_group).assign(packing='before')
+        after = get_channel_utilization(worklist, n_per_group).assign(packing='after')
+        out['channel_utilization'] = pd.concat([before, after], ignore_index=True)
+    if 'well_packing' in output:
+        out['well_packing'] = output['well_packing']
+    return out
 
 
 def update_liquid_class(worklist_input, liquid_type_df_input):
@@ -925,7 +1498,7 @@ def update_liquid_class(worklist_input, liquid_type_df_input):
     """
     worklist = worklist_input.copy()
     worklist['liquid_type'] = worklist['liquid_class'].str.split('_', expand=True).iloc[:, 2]
-    liquid_type_df = liquid_type_df_input.copy()
+    liquid_type_df = liquid_type_df_input.iloc[:, :2].copy()
     liquid_type_df.columns = ['source', 'liquid_type']
 
     worklist = worklist.merge(liquid_type_df, on='source', how='left')
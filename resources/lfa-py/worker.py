@@ -0,0 +1,86 @@
+from api import default_dir, read_config, run_json_job
+from main import load_inputs
+import multiprocessing
+import threading
+import traceback
+import argparse
+import json
+import sys
+import os
+
+# parsed reference files kept warm in each worker process, see main.read_input_file
+file_cache = {}
+
+
+def init_worker(input_master_file):
+    """
+    warm up a worker process by reading the reference files of the default settings
+    :param input_master_file: path to input_master.csv, relative to the directory of this file
+    :return: none
+    """
+    try:
+        load_inputs(read_config(os.path.join(default_dir, input_master_file)), file_cache)
+    except Exception:
+        # the reference files are read again with each job, and errors are reported there
+        traceback.print_exc(file=sys.stderr)
+
+
+def run_job(job):
+    """
+    make worklists for one job, reusing the reference files read by this worker process
+    :param job: dictionary describing the job, see api.run_json_job
+    :return: dictionary with id, ok, and either results or error
+    """
+    # the worker processes are the parallelism, they cannot start pools of their own
+    job = dict(job, settings=dict(job.get('settings', {}), jobs=1))
+    return run_json_job(job, file_cache)
+
+
+def serve(processes=1, recycle_after=100, input_master_file='input_master.csv', stream_in=None, stream_out=None):
+    """
+    serve jobs read from a stream, one json object per line, and write results to another, one json object per line.
+    results are written as jobs finish, use the id of each job to match them
+    :param processes: number of worker processes
+    :param recycle_after: number of jobs after which a worker process is replaced, to bound memory
+    :param input_master_file: path to input_master.csv used to warm up the workers
+    :param stream_in: input stream, stdin by default
+    :param stream_out: output stream, stdout by default
+    :return: none
+    """
+    stream_in = sys.stdin if stream_in is None else stream_in
+    stream_out = sys.stdout if stream_out is None else stream_out
+    lock = threading.Lock()
+
+    def write(result):
+        with lock:
+            stream_out.write(json.dumps(result, separators=(',', ':')) + '\n')
+            stream_out.flush()
+
+    with multiprocessing.Pool(processes=processes, initializer=init_worker, initargs=(input_master_file,),
+                              maxtasksperchild=recycle_after) as pool:
+        pending = []
+        for line in stream_in:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                write({'id': None, 'ok': False, 'error': 'invalid job: ' + str(e)})
+                continue
+            pending = pending + [pool.apply_async(
+                run_job, (job,), callback=write,
+                error_callback=lambda e, job_id=job.get('id'): write({'id': job_id, 'ok': False, 'error': repr(e)}))]
+        for each in pending:
+            each.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='long-lived worker to make worklists, jobs are read from stdin and '
+                                                 'results written to stdout, one json object per line')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--recycle-after', type=int, default=100,
+                        help='number of jobs after which a worker process is replaced')
+    parser.add_argument('--input-master', default='input_master.csv',
+                        help='input_master.csv used to warm up the workers')
+    args = parser.parse_args()
+    serve(processes=args.processes, recycle_after=args.recycle_after, input_master_file=args.input_master)
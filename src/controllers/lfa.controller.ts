@@ -429,6 +429,9 @@ async function updateInputMasterFile(
         return { ...row, value: plateConfig.numColumns.toString() };
       case "nrep":
         return { ...row, value: experiment.numReplicates.toString() };
+      case "sub_exp":
+        // only the first sub experiment is served
+        return { ...row, value: "first" };
       default:
         return row;
     }